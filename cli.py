@@ -1,12 +1,28 @@
-from sys import argv
-from os import environ
+from sys import argv, exit as sys_exit
+from os import environ, cpu_count
 from typing import Final, Tuple
 from argparse import ArgumentParser, ArgumentTypeError
 
 try:
+    from src.metrics import METRICS
+    from src.storage import USER_STORAGE
     from src.logger import set_quiet
+    from src.utils import read_text
+    from src.hashing import HashingPool, HashingBusyError, measure_hash_time, suggest_iterations
+    from src.user import (
+        USERS, PASSWORD_SHA, USER_NAME_SHA, SESSION_TOKEN_SHA,
+        revoke_sessions_by_ip, migrate_user_names, rebuild_user_name_filter
+    )
 except (ModuleNotFoundError, ImportError):
+    from metrics import METRICS
+    from storage import USER_STORAGE
     from logger import set_quiet
+    from utils import read_text
+    from hashing import HashingPool, HashingBusyError, measure_hash_time, suggest_iterations
+    from user import (
+        USERS, PASSWORD_SHA, USER_NAME_SHA, SESSION_TOKEN_SHA,
+        revoke_sessions_by_ip, migrate_user_names, rebuild_user_name_filter
+    )
 
 
 LOGO: Final[str] =\
@@ -56,6 +72,71 @@ def parse_bind_address(bind_str: str) -> Tuple[str, int]:
     raise ArgumentTypeError("Bind address must be in format 'host:port'")
 
 
+def print_hashing_calibration(target_milliseconds: int) -> None:
+    """
+    Benchmarks every hasher on this host and prints the iteration
+    counts that reach the target latency.
+
+    Args:
+        target_milliseconds: The target duration of one key derivation.
+
+    Returns:
+        None
+    """
+
+    hashers = [
+        ("PASSWORD_ITERATIONS", PASSWORD_SHA),
+        ("SESSION_TOKEN_ITERATIONS", SESSION_TOKEN_SHA),
+        ("USER_NAME_ITERATIONS", USER_NAME_SHA)
+    ]
+
+    print(f"Iteration counts for {target_milliseconds} ms per hash on this host:")
+    for setting, sha in hashers:
+        current_milliseconds = measure_hash_time(sha) * 1000
+        suggested_iterations = suggest_iterations(sha, target_milliseconds / 1000)
+
+        print(
+            f"{setting:<26} {sha.iterations:>9} now ({current_milliseconds:>7.1f} ms)"
+            f" -> {setting}={suggested_iterations}"
+        )
+
+
+def run_user_name_migration(file_path: str) -> bool:
+    """
+    Migrates users stored before username blind indexes existed, using
+    the usernames in a file.
+
+    Args:
+        file_path: The path of a file with one username per line.
+
+    Returns:
+        True if the migration finished, otherwise False.
+    """
+
+    file_content = read_text(file_path)
+    if file_content is None:
+        print(f"`{file_path}` could not be read.")
+        return False
+
+    user_names = [line.strip() for line in file_content.splitlines() if line.strip()]
+    pool = HashingPool(max_workers = cpu_count() or 1)
+
+    try:
+        migrated_count = migrate_user_names(user_names, pool)
+    except HashingBusyError:
+        print("The usernames could not be hashed in time.")
+        return False
+
+    rebuild_user_name_filter()
+    METRICS.flush()
+
+    print(
+        f"Migrated {migrated_count} users, {len(USERS.get_unindexed_keys())}"
+        " users without a username index are left."
+    )
+    return True
+
+
 def init_cli() -> None:
     """
     Initializes command line interface for deploying SkyNest.
@@ -138,8 +219,46 @@ def init_cli() -> None:
         help='Creator name to display in the application'
     )
 
+    parser.add_argument(
+        '--revoke-ip',
+        default=None,
+        help='Revoke all sessions created from an IP address and exit'
+    )
+
+    parser.add_argument(
+        '--migrate-user-names',
+        default=None,
+        metavar='FILE',
+        help='Migrate users without a username index using the usernames in a file and exit'
+    )
+
+    parser.add_argument(
+        '--calibrate-hashing',
+        type=int,
+        default=None,
+        metavar='MILLISECONDS',
+        help='Suggest hashing iteration counts for a target latency and exit'
+    )
+
     args = parser.parse_args()
 
+    if args.migrate_user_names:
+        sys_exit(0 if run_user_name_migration(args.migrate_user_names) else 1)
+
+    if args.calibrate_hashing:
+        print_hashing_calibration(args.calibrate_hashing)
+        sys_exit(0)
+
+    if args.revoke_ip:
+        revoked_count = revoke_sessions_by_ip(args.revoke_ip)
+        METRICS.flush()
+
+        print(f"Revoked {revoked_count} sessions created from {args.revoke_ip}.")
+        if USER_STORAGE == "pickle":
+            print("Running workers keep pickle sessions in memory until they restart.")
+
+        sys_exit(0)
+
     if args.bind:
         host, port = args.bind
         environ['HOST'] = str(host)
@@ -1,19 +1,38 @@
 from os import environ
+from math import ceil
+from time import time, perf_counter
 from typing import Final, Optional, Tuple, Union
 
 from gunicorn.app.base import BaseApplication
 from werkzeug.middleware.proxy_fix import ProxyFix
-from flask import Flask, Response, request, g
+from flask import Flask, Response, request, g, jsonify
 
 from cli import init_cli
 from src.access import verify_access
 from src.crypto import sha256_hash_text
-from src.state import get_state, create_state, get_beam_id
-from src.ddos_mitigation import rate_limit, is_ip_malicious
-from src.request import get_scheme, get_user_agent, get_ip_address
-from src.utils import CURRENT_DIRECTORY_PATH, is_path_allowed
-from src.errors import WEB_ERROR_CODES, NOT_RIGHT_ERROR, UN_OR_PWD_NOT_RIGHT_ERROR
-from src.user import create_test_user, get_signin_error, create_session, verify_twofa
+from src.hashing import (
+    HASHING_POOL, HASHING_WORKERS_RAW, HASHING_QUEUE_DEPTH_RAW,
+    HashingBusyError, get_default_hashing_workers
+)
+from src.metrics import METRICS
+from src.state import (
+    get_states, create_state, get_beam_id, get_time_to_live, is_valid_state
+)
+from src.ddos_mitigation import (
+    rate_limit, is_ip_malicious, charge_kdf_budget, record_kdf_seconds
+)
+from src.request import is_post, get_scheme, get_user_agent, get_ip_address
+from src.utils import CURRENT_DIRECTORY_PATH, LRUCache, is_path_allowed
+from src.errors import (
+    WEB_ERROR_CODES, NOT_RIGHT_ERROR, UN_OR_PWD_NOT_RIGHT_ERROR, SERVER_BUSY_ERROR,
+    TOO_MANY_ATTEMPTS_ERROR
+)
+from src.login_flow import create_login_flow, get_login_flow
+from src.user import (
+    create_test_user, get_signin_error, get_user_based_on_key, create_session, verify_twofa,
+    is_user_name_length_valid, is_user_name_characters_valid, is_user_name_taken,
+    rebuild_user_name_filter
+)
 from src.captcha import (
     generate_powbox_challenge, verify_pow_response,
     get_clicked_images, is_valid_captcha
@@ -42,6 +61,15 @@ if POW_DIFFICULTY_RAW.isdigit():
     POW_DIFFICULTY = int(POW_DIFFICULTY_RAW)
 
 
+BROWSER_CHECK_CACHE_SIZE_RAW: str = environ.get("BROWSER_CHECK_CACHE_SIZE", "")
+BROWSER_CHECK_CACHE_SIZE: int = 10000
+if BROWSER_CHECK_CACHE_SIZE_RAW.isdigit():
+    BROWSER_CHECK_CACHE_SIZE = int(BROWSER_CHECK_CACHE_SIZE_RAW)
+
+# Maps challenge cookies to the state name and IP hash of verified browsers
+# in this worker until the cookie expires.
+BROWSER_CHECK_CACHE: Final[LRUCache] = LRUCache(BROWSER_CHECK_CACHE_SIZE)
+
 ACCESS_TOKEN: Final[Optional[str]] = environ.get("ACCESS_TOKEN", None)
 ONE_YEAR_IN_SECONDS: Final[int] = 31536000
 
@@ -108,15 +136,16 @@ for error_code in WEB_ERROR_CODES:
 
 
 @app.before_request
-def checking_browser() -> Optional[str]:
+def checking_browser() -> Optional[Union[str, Tuple[str, int, dict]]]:
     """
     Check the browser's verification status before processing the request.
 
     Returns:
-        Optional[str]: If the browser is verified, returns None to
-            continue processing the request. If the browser fails verification,
-            returns a rendered template for rate limiting or a browser check
-            challenge, which will halt further request processing.
+        Optional[Union[str, Tuple[str, int, dict]]]: If the browser is verified,
+            returns None to continue processing the request. If the browser fails
+            verification, returns a rendered template for rate limiting (with
+            status 429 and a Retry-After header) or a browser check challenge,
+            which will halt further request processing.
     """
 
     if is_path_allowed(request.path):
@@ -128,17 +157,42 @@ def checking_browser() -> Optional[str]:
     if isinstance(ip_address, str):
         hashed_ip_address = sha256_hash_text(ip_address)
 
-    if rate_limit(ip_address):
-        return render_template("rate_limit")
-
     challenge_cookie = request.cookies.get("challenge")
-    if challenge_cookie:
-        state_name, state_data = get_state(challenge_cookie)
-        if state_name == "browser_checked" and \
-            state_data.get("ip") == hashed_ip_address:
 
-            g.browser_verified = True
-            return None
+    cached_state = None
+    if challenge_cookie:
+        cached_state = BROWSER_CHECK_CACHE.get(challenge_cookie)
+        METRICS.increment("browser_check_cache", "misses" if cached_state is None else "hits")
+
+    # Only a browser check cached in this worker verifies a client before the
+    # rate limit. A session cookie is not verified yet, so its class gets no
+    # looser limits than anonymous clients, see `RATE_LIMIT_POLICIES`.
+    client_class = "anonymous"
+    if cached_state == ("browser_checked", hashed_ip_address):
+        client_class = "verified"
+    elif is_valid_state(request.cookies.get("session", "")):
+        client_class = "session"
+
+    route = request.url_rule.rule if request.url_rule is not None else None
+    retry_after = rate_limit(ip_address, route, request.method, client_class)
+    if retry_after:
+        return render_template("rate_limit"), 429, {"Retry-After": str(ceil(retry_after))}
+
+    if cached_state is None:
+        powbox_state = request.form.get("powbox_state") if is_post(request) else None
+        (state_name, state_data), g.pow_state = get_states([
+            (challenge_cookie, False), (powbox_state, True)
+        ])
+
+        cached_state = (state_name, state_data.get("ip", None))
+
+        expires_at = state_data.get("expires", None)
+        if state_name == "browser_checked" and isinstance(expires_at, int):
+            BROWSER_CHECK_CACHE.set(challenge_cookie, cached_state, expires_at)
+
+    if cached_state == ("browser_checked", hashed_ip_address):
+        g.browser_verified = True
+        return None
 
     reason = is_ip_malicious(ip_address)
     if not reason:
@@ -147,9 +201,15 @@ def checking_browser() -> Optional[str]:
     if verify_pow_response(request, difficulty = POW_DIFFICULTY):
         g.browser_verified = True
 
-        cookies = getattr(g, "cookies", {})
-        cookies["challenge"] = create_state("browser_checked", {"ip": hashed_ip_address})
-        g.cookies = cookies
+        expires_at = int(time()) + get_time_to_live("browser_checked")
+        state = create_state("browser_checked", {"ip": hashed_ip_address, "expires": expires_at})
+        if state:
+            BROWSER_CHECK_CACHE.set(state, ("browser_checked", hashed_ip_address), expires_at)
+
+            cookies = getattr(g, "cookies", {})
+            cookies["challenge"] = state
+            g.cookies = cookies
+
         return None
 
     beam_id = get_beam_id([get_ip_address(request), get_user_agent(request)])
@@ -261,80 +321,126 @@ def posted_login() -> Union[str, Response]:
       - Performing 2FA token verification if enabled.
       - Setting up a session for a successful login.
 
+    The steps of one login share a login flow, which stores the resolved user
+    and the checks that have passed, so every step runs at most once. The
+    password is never stored in the flow: it is verified before the flow is
+    created if a proof of work has been verified, and otherwise entered again
+    once the captcha has passed.
+
     Returns:
         Union[str, Response]: The rendered template or response
             text based on the current login state.
     """
 
-    user_name: Optional[str] = None
-    password: Optional[str] = None
+    login_flow = None
 
-    submitted = False
-    is_captcha_verified = verify_pow_response(request)
-    is_valid_password = False
-    is_totp_verified = False
+    user_name = request.form.get("user_name")
+    password = request.form.get("password")
 
     state = request.form.get("state")
     if state:
-        state_name, state_data = get_state(state, True)
-        if state_name:
-            user_name = state_data.get("user_name")
-            password = state_data.get("password")
+        login_flow = get_login_flow(state)
+        if not login_flow:
+            return render_login(error = UN_OR_PWD_NOT_RIGHT_ERROR)
+
+        user_name = login_flow.user_name
+
+    elif user_name is None and password is None:
+        return render_login()
 
-            submitted = True
+    try:
+        if not login_flow:
+            user, error = get_signin_error(user_name, password, get_ip_address(request))
+            if not user:
+                return render_login(user_name, password, error)
 
-        if not isinstance(user_name, str) or not isinstance(password, str):
-            return render_login(user_name, password, error = UN_OR_PWD_NOT_RIGHT_ERROR)
+            is_pow_verified = verify_pow_response(request)
+            is_password_verified = False
 
-        if state_name == "captcha_oneclick":
-            is_valid = is_valid_captcha(
-                state_data, get_clicked_images(request)
+            if is_pow_verified:
+                exhausted_budget = charge_kdf_budget(user.stored_key, get_ip_address(request))
+
+                if exhausted_budget == "account":
+                    is_pow_verified = False
+
+                elif exhausted_budget is not None:
+                    return render_login(user_name, error = TOO_MANY_ATTEMPTS_ERROR)
+
+                else:
+                    start_time = perf_counter()
+                    is_password_verified = user.is_valid_password(password)
+                    record_kdf_seconds(perf_counter() - start_time)
+
+                    if not is_password_verified:
+                        return render_login(user_name, password, UN_OR_PWD_NOT_RIGHT_ERROR)
+
+            login_flow = create_login_flow(
+                user.user_name, user.stored_key,
+                is_pow_verified, is_password_verified
             )
+            if not login_flow:
+                return render_login(user_name, password, SERVER_BUSY_ERROR)
 
-            if not is_valid:
-                # FIXME: Add failed attempt to ip address
-                return render_captcha(user_name, password, NOT_RIGHT_ERROR)
+        else:
+            user = get_user_based_on_key(login_flow.user_name, login_flow.user_key)
+            if not user:
+                login_flow.finish()
+                return render_login(user_name, error = UN_OR_PWD_NOT_RIGHT_ERROR)
 
-            is_captcha_verified = True
+        if not login_flow.has_passed("captcha"):
+            correct_images = login_flow.claim_captcha() if state else None
+            if correct_images is not None:
+                if not is_valid_captcha(
+                    {"correct_images": correct_images}, get_clicked_images(request)):
 
-        if state_name == "twofa":
-            is_captcha_verified = True
+                    # FIXME: Add failed attempt to ip address
+                    return render_captcha(login_flow, NOT_RIGHT_ERROR)
 
-            token = request.form.get("codes", None)
-            is_totp_verified = verify_twofa(user_name, token)
-            if not is_totp_verified:
-                return render_twofa(user_name, password, NOT_RIGHT_ERROR)
+                login_flow.set_passed("captcha")
+
+            elif not login_flow.has_passed("pow"):
+                return render_captcha(login_flow)
 
-            is_valid_password = True
+        if not login_flow.has_passed("password"):
+            if not isinstance(password, str):
+                return render_login(user_name, state = login_flow.flow_id)
 
-    if not submitted:
-        user_name = request.form.get("user_name")
-        password = request.form.get("password")
-        submitted = user_name is not None or password is not None
+            # The captcha has passed, so only the budget of the IP address is charged.
+            exhausted_budget = charge_kdf_budget(
+                login_flow.user_key, get_ip_address(request), charge_account = False
+            )
+            if exhausted_budget is not None:
+                login_flow.finish()
+                return render_login(user_name, error = TOO_MANY_ATTEMPTS_ERROR)
 
-    if submitted:
-        user, error = get_signin_error(user_name, password)
+            start_time = perf_counter()
+            is_valid_password = user.is_valid_password(password)
+            record_kdf_seconds(perf_counter() - start_time, charged_account = False)
 
-        if not user:
-            return render_login(user_name, password, error)
+            if not is_valid_password:
+                login_flow.finish()
+                return render_login(user_name, password, UN_OR_PWD_NOT_RIGHT_ERROR)
 
-        if not isinstance(user_name, str) or not isinstance(password, str):
-            return render_login(user_name, password, error = UN_OR_PWD_NOT_RIGHT_ERROR)
+            login_flow.set_passed("password")
+
+        if user.twofa_token and not login_flow.has_passed("twofa"):
+            token = request.form.get("codes", None)
+            if token is None:
+                return render_twofa(login_flow)
 
-        if not is_captcha_verified:
-            return render_captcha(user_name, password)
+            if not verify_twofa(user, token):
+                return render_twofa(login_flow, NOT_RIGHT_ERROR)
 
-        if not is_valid_password and not user.is_valid_password(password):
-            return render_login(user_name, password, UN_OR_PWD_NOT_RIGHT_ERROR)
+            login_flow.set_passed("twofa")
 
-        if user.twofa_token and not is_totp_verified:
-            return render_twofa(user_name, password)
+        if not login_flow.finish():
+            return render_login(user_name, error = UN_OR_PWD_NOT_RIGHT_ERROR)
 
         user_agent, ip = get_user_agent(request), get_ip_address(request)
 
         session = create_session(user, user_agent, ip)
         if not session:
-            return render_login(user_name, password, UN_OR_PWD_NOT_RIGHT_ERROR)
+            return render_login(user_name, error = UN_OR_PWD_NOT_RIGHT_ERROR)
 
         state = create_state(
             "session", {
@@ -343,6 +449,9 @@ def posted_login() -> Union[str, Response]:
                 "user_name": user.user_name
             }
         )
+        if not state:
+            session.revoke()
+            return render_login(user_name, error = SERVER_BUSY_ERROR)
 
         cookies = getattr(g, "cookies", {})
         cookies["session"] = state
@@ -350,7 +459,8 @@ def posted_login() -> Union[str, Response]:
 
         return render_text(user_name)
 
-    return render_login(user_name, password)
+    except HashingBusyError:
+        return render_login(user_name, password, SERVER_BUSY_ERROR)
 
 
 @app.get("/signup")
@@ -370,6 +480,26 @@ def posted_signup() -> str:
     return "Posted"
 
 
+@app.get("/signup/availability")
+def signup_availability() -> Tuple[Response, int]:
+    """
+    Checks whether a username can still be chosen, for live
+    feedback while the username is typed into the signup form.
+
+    Returns:
+        Tuple[Response, int]: A JSON object with the `available` field
+            and the status code.
+    """
+
+    user_name = request.args.get("user_name", "")
+    if not is_user_name_length_valid(user_name) or \
+        not is_user_name_characters_valid(user_name):
+
+        return jsonify(available = False), 200
+
+    return jsonify(available = not is_user_name_taken(user_name)), 200
+
+
 @app.route('/favicon.ico')
 def favicon() -> Response:
     """
@@ -437,6 +567,7 @@ def main() -> None:
     init_cli()
 
     create_test_user() # FIXME: Remove create_test_user
+    rebuild_user_name_filter()
 
     host = environ.get("HOST", "127.0.0.1")
     port = environ.get("PORT", "8080")
@@ -447,6 +578,13 @@ def main() -> None:
     if isinstance(workers_raw, str) and workers_raw.isdigit():
         workers = int(workers_raw)
 
+    # The hashing pool is shared by the budget of all workers, and `-w` may
+    # have changed their number after the pool was configured.
+    if not HASHING_WORKERS_RAW.isdigit():
+        HASHING_POOL.max_workers = get_default_hashing_workers(workers)
+        if not HASHING_QUEUE_DEPTH_RAW.isdigit():
+            HASHING_POOL.max_queue_depth = HASHING_POOL.max_workers * 4
+
     cert_file_path = environ.get("CERT_FILE_PATH", None)
     if cert_file_path:
         cert_file_path = cert_file_path.replace("./", CURRENT_DIRECTORY_PATH)
@@ -0,0 +1,152 @@
+"""
+scripts/memory_benchmark/main.py
+
+This module measures the resident memory of a worker after loading the
+user store, once with avatars stored inline in every user record and once
+with avatars moved into the content-addressed avatar store.
+
+Usage:
+    Run this script directly, optionally with the number of users and the
+    avatar size in bytes, e.g. `python scripts/memory_benchmark 100000 2048`.
+"""
+
+from sys import argv, path as sys_path
+from time import perf_counter
+from hashlib import sha256
+from os import path, sysconf
+from secrets import token_bytes
+from tempfile import TemporaryDirectory
+from multiprocessing import get_context
+from pickle import dump as pickle_dump
+from resource import getrusage, RUSAGE_SELF
+from typing import Final, Tuple
+
+
+CURRENT_DIRECTORY_PATH: Final[str] = path.dirname(path.abspath(__file__))
+ROOT_DIRECTORY_PATH: Final[str] = path.dirname(path.dirname(CURRENT_DIRECTORY_PATH))
+if ROOT_DIRECTORY_PATH not in sys_path:
+    sys_path.append(ROOT_DIRECTORY_PATH)
+
+DEFAULT_USER_COUNT: Final[int] = 100000
+DEFAULT_AVATAR_SIZE: Final[int] = 2048
+
+
+def get_rss() -> int:
+    """
+    Returns the resident memory of the current process in bytes.
+
+    Returns:
+        int: The resident set size, or the peak resident set size if
+            `/proc` is not available.
+    """
+
+    try:
+        with open("/proc/self/statm", "r", encoding = "utf-8") as file_stream:
+            return int(file_stream.read().split()[1]) * sysconf("SC_PAGE_SIZE")
+
+    except (OSError, ValueError, IndexError):
+        return getrusage(RUSAGE_SELF).ru_maxrss * 1024
+
+
+def write_snapshots(directory_path: str, user_count: int,
+                    avatar_size: int) -> Tuple[str, str]:
+    """
+    Writes two user snapshots with the same users, one with inline avatars
+    and one with avatar digests.
+
+    Args:
+        directory_path (str): The directory for the snapshots.
+        user_count (int): The number of users.
+        avatar_size (int): The size of every avatar in bytes.
+
+    Returns:
+        Tuple[str, str]: The paths of the inline and the digest snapshot.
+    """
+
+    inline_users, digest_users = {}, {}
+    for index in range(user_count):
+        avatar = token_bytes(avatar_size)
+        user_data = {
+            "password": token_bytes(64),
+            "user_name_index": token_bytes(32),
+            "display_name": f"User {index}",
+        }
+
+        inline_users[token_bytes(8)] = dict(user_data, avatar = avatar)
+        digest_users[token_bytes(8)] = dict(user_data, avatar = sha256(avatar).hexdigest())
+
+    file_paths = (
+        path.join(directory_path, "inline.pkl"),
+        path.join(directory_path, "digest.pkl")
+    )
+
+    for file_path, users in zip(file_paths, (inline_users, digest_users)):
+        with open(file_path, "wb") as file_stream:
+            pickle_dump(users, file_stream)
+
+    return file_paths
+
+
+def measure(file_path: str, use_users: bool) -> Tuple[int, float]:
+    """
+    Loads a snapshot in a new forked process and measures the memory it occupies.
+
+    Args:
+        file_path (str): The path of the snapshot.
+        use_users (bool): Whether to load it with `Users`, which also builds the
+            indexes, or only with `JournaledPickleFile` like before avatars
+            were moved out of the records.
+
+    Returns:
+        Tuple[int, float]: The resident memory added by the load in bytes
+            and the load time in seconds.
+    """
+
+    from src.storage import Users
+    from src.utils import JournaledPickleFile
+
+    start_rss = get_rss()
+    start_time = perf_counter()
+
+    if use_users:
+        users = Users(file_path)
+    else:
+        users = JournaledPickleFile(file_path).load()
+
+    load_time = perf_counter() - start_time
+    used_rss = get_rss() - start_rss
+
+    del users
+    return used_rss, load_time
+
+
+def main() -> None:
+    """
+    Main function to write the snapshots and print the measurements.
+    """
+
+    user_count = int(argv[1]) if len(argv) > 1 and argv[1].isdigit() else DEFAULT_USER_COUNT
+    avatar_size = int(argv[2]) if len(argv) > 2 and argv[2].isdigit() else DEFAULT_AVATAR_SIZE
+
+    print(f"Writing {user_count} users with {avatar_size} byte avatars...")
+
+    with TemporaryDirectory() as directory_path:
+        with get_context("fork").Pool(1, maxtasksperchild = 1) as pool:
+            inline_file_path, digest_file_path = pool.apply(
+                write_snapshots, (directory_path, user_count, avatar_size)
+            )
+
+            results = [
+                ("inline avatars", pool.apply(measure, (inline_file_path, False))),
+                ("avatar store", pool.apply(measure, (digest_file_path, True)))
+            ]
+
+    for name, (used_rss, load_time) in results:
+        print(
+            f"{name:<16} {used_rss / 1024 / 1024:>9.1f} MiB RSS"
+            f" {used_rss / user_count:>8.0f} B/user {load_time:>7.2f} s load"
+        )
+
+
+if __name__ == "__main__":
+    main()
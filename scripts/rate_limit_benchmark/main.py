@@ -0,0 +1,175 @@
+"""
+scripts/rate_limit_benchmark/main.py
+
+This module compares the list-based rate limiter, which pushed, trimmed and read
+back a list of timestamps per IP address in a pipeline, with the generic cell rate
+algorithm script, checked on every request or only once the local bucket of a
+worker is empty: the Redis commands the server runs and the latency per call.
+
+Usage:
+    Run this script directly with a Redis server configured, optionally with
+    the number of calls and IP addresses, e.g.
+    `python scripts/rate_limit_benchmark 20000 100`.
+"""
+
+from sys import argv, path as sys_path
+from os import path
+from time import time, perf_counter
+from typing import Final, Callable, Optional, Any
+
+
+CURRENT_DIRECTORY_PATH: Final[str] = path.dirname(path.abspath(__file__))
+ROOT_DIRECTORY_PATH: Final[str] = path.dirname(path.dirname(CURRENT_DIRECTORY_PATH))
+if ROOT_DIRECTORY_PATH not in sys_path:
+    sys_path.append(ROOT_DIRECTORY_PATH)
+
+from redis import RedisError
+from src.utils import REDIS_CLIENT
+from src.ddos_mitigation import RATE_LIMIT_SCRIPT, RATE_LIMIT, RATE_LIMIT_PERIOD, RateLimiter
+
+
+DEFAULT_CALL_COUNT: Final[int] = 20000
+DEFAULT_IP_COUNT: Final[int] = 100
+
+
+def list_rate_limit(key: str) -> bool:
+    """
+    The rate limiter before the script, 15 requests per 10 seconds.
+
+    Args:
+        key (str): The key of the IP address.
+
+    Returns:
+        bool: True if the IP is rate-limited, False otherwise.
+    """
+
+    current_time = int(time())
+
+    with REDIS_CLIENT.pipeline() as pipe:
+        pipe.rpush(key, current_time)
+        pipe.ltrim(key, -17, -1)
+        pipe.lrange(key, 0, -1)
+        pipe.expire(key, 10)
+
+        timestamps = pipe.execute()[2]
+
+    return sum(1 for t in timestamps if current_time - int(t) <= 10) > 15
+
+
+def script_rate_limit(key: str) -> bool:
+    """
+    The generic cell rate algorithm script of `rate_limit`.
+
+    Args:
+        key (str): The key of the IP address.
+
+    Returns:
+        bool: True if the IP is rate-limited, False otherwise.
+    """
+
+    is_allowed, _, _ = RATE_LIMIT_SCRIPT(
+        keys = [key], args = [RATE_LIMIT_PERIOD * 1000, 1, RATE_LIMIT_PERIOD * 1000 / RATE_LIMIT, 0]
+    )
+    return not is_allowed
+
+
+def get_command_count() -> Optional[int]:
+    """
+    Returns the number of commands the Redis server has run, including
+    the commands run by scripts.
+
+    Returns:
+        Optional[int]: The number of commands, or None if the server
+            does not report command statistics.
+    """
+
+    try:
+        command_stats = REDIS_CLIENT.info("commandstats")
+    except RedisError:
+        return None
+
+    return sum(
+        stats.get("calls", 0) for stats in command_stats.values()
+        if isinstance(stats, dict)
+    )
+
+
+def measure(rate_limiter: Callable[[str], bool], prefix: str, call_count: int,
+            ip_count: int, finish: Optional[Callable[[], Any]] = None) -> dict:
+    """
+    Calls a rate limiter for a number of IP addresses in turn.
+
+    Args:
+        rate_limiter (Callable[[str], bool]): The rate limiter.
+        prefix (str): The prefix of the benchmark keys.
+        call_count (int): The number of calls.
+        ip_count (int): The number of distinct IP addresses.
+        finish (Optional[Callable[[], Any]]): Called after the last call, e.g. to
+            charge the requests of local buckets.
+
+    Returns:
+        dict: The latencies in microseconds, the number of limited calls
+            and the number of Redis commands per call.
+    """
+
+    keys = [f"{prefix}:198.51.100.{index}" for index in range(ip_count)]
+
+    start_command_count = get_command_count()
+    latencies, limited_count = [], 0
+
+    for index in range(call_count):
+        start_time = perf_counter()
+        limited_count += rate_limiter(keys[index % ip_count])
+        latencies.append((perf_counter() - start_time) * 1000000)
+
+    if finish is not None:
+        finish()
+
+    end_command_count = get_command_count()
+    REDIS_CLIENT.delete(*keys, *REDIS_CLIENT.scan_iter(f"rate_limit_tat:*:{prefix}:*"))
+
+    latencies.sort()
+    commands_per_call = None
+    if start_command_count is not None and end_command_count is not None:
+        # The INFO call between the measurements is counted as well.
+        commands_per_call = (end_command_count - start_command_count - 1) / call_count
+
+    return {
+        "mean": sum(latencies) / call_count,
+        "p50": latencies[call_count // 2],
+        "p99": latencies[min(call_count - 1, call_count * 99 // 100)],
+        "limited": limited_count,
+        "commands": commands_per_call
+    }
+
+
+def main() -> None:
+    """
+    Main function to benchmark both rate limiters and print the results.
+    """
+
+    call_count = int(argv[1]) if len(argv) > 1 and argv[1].isdigit() else DEFAULT_CALL_COUNT
+    ip_count = int(argv[2]) if len(argv) > 2 and argv[2].isdigit() else DEFAULT_IP_COUNT
+
+    print(f"Rate limiting {call_count} calls from {ip_count} IP addresses...")
+
+    rate_limiter = RateLimiter("benchmark")
+
+    for name, check, prefix, finish in (
+        ("list pipeline", list_rate_limit, "rate_limit_benchmark_list", None),
+        ("gcra script", script_rate_limit, "rate_limit_benchmark_tat", None),
+        ("local buckets", lambda key: rate_limiter.check([(key, 1)]) > 0,
+         "rate_limit_benchmark_local", rate_limiter.sync)
+    ):
+        results = measure(check, prefix, call_count, ip_count, finish)
+
+        commands = "n/a" if results["commands"] is None else f"{results['commands']:.1f}"
+        print(
+            f"{name:<14} {results['mean']:>7.1f} us mean {results['p50']:>7.1f} us p50"
+            f" {results['p99']:>7.1f} us p99 {commands:>4} commands/call"
+            f" {results['limited']:>7} limited"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""
+scripts/state_codec_benchmark/__main__.py
+
+This module serves as the entry point for the application.
+"""
+
+from main import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+scripts/state_codec_benchmark/main.py
+
+This module compares the binary state codec with the JSON encoding that was
+used before, measuring the payload size and the time to encode and decode
+every state type.
+
+Usage:
+    Run this script directly, optionally with the number of rounds,
+    e.g. `python scripts/state_codec_benchmark 100000`.
+"""
+
+from sys import argv, path as sys_path
+from os import path
+from time import perf_counter
+from typing import Final, Callable, Tuple, Optional
+from json import loads as json_loads, dumps as json_dumps
+
+
+CURRENT_DIRECTORY_PATH: Final[str] = path.dirname(path.abspath(__file__))
+ROOT_DIRECTORY_PATH: Final[str] = path.dirname(path.dirname(CURRENT_DIRECTORY_PATH))
+if ROOT_DIRECTORY_PATH not in sys_path:
+    sys_path.append(ROOT_DIRECTORY_PATH)
+
+from src.state_codec import encode_state, decode_state
+
+
+DEFAULT_ROUNDS: Final[int] = 100000
+
+SAMPLE_STATES: Final[list[Tuple[str, dict]]] = [
+    ("pow", {"challenge": "Xo4rVb9TzQk2LmN8pW3sYd7Fh1Jc6Ga0"}),
+    ("browser_checked", {"ip": "yukJEpusF5XhBrQJnQKFyfiQmmjEVZyFzuVEdvJLaHM"}),
+    ("session", {
+        "session_id": "q8Xn2Lp5Rt7Vw1Yz3Bc6Df9Gh4Jk0Mn",
+        "session_token": "Ab3De6Gh9Jk2Mn5Pq8St1Vw4Yz7Bc0Ef3Hi6Kl9No2Qr5Tu8",
+        "user_name": "alice_1234"
+    }),
+    ("browser_checked", {
+        "ip": "yukJEpusF5XhBrQJnQKFyfiQmmjEVZyFzuVEdvJLaHM", "expires": 1767225600
+    }),
+]
+
+
+def encode_json(state_name: str, data: dict) -> bytes:
+    """
+    Encodes a state like `create_state` did before the binary codec.
+
+    Args:
+        state_name (str): The name of the state.
+        data (dict): The data of the state.
+
+    Returns:
+        bytes: The JSON payload.
+    """
+
+    data = dict(data)
+    data["state"] = state_name
+    return json_dumps(data).encode("utf-8")
+
+
+def decode_json(encoded: bytes) -> Tuple[Optional[str], dict]:
+    """
+    Decodes a state like `get_state` did before the binary codec.
+
+    Args:
+        encoded (bytes): The JSON payload.
+
+    Returns:
+        Tuple[Optional[str], dict]: The state name and decoded data.
+    """
+
+    decoded_data = json_loads(encoded)
+    state_name = decoded_data.get("state", None)
+
+    for key in ["state", "single_use", "time"]:
+        if key in decoded_data:
+            decoded_data.pop(key)
+
+    return state_name, decoded_data
+
+
+def measure(function: Callable, argument: tuple, rounds: int) -> float:
+    """
+    Measures the average duration of a function call.
+
+    Args:
+        function (Callable): The function to call.
+        argument (tuple): The positional arguments of every call.
+        rounds (int): The number of calls.
+
+    Returns:
+        float: The average duration in microseconds.
+    """
+
+    start_time = perf_counter()
+    for _ in range(rounds):
+        function(*argument)
+
+    return (perf_counter() - start_time) / rounds * 1000000
+
+
+def main() -> None:
+    """
+    Main function to run the benchmark and print the results.
+    """
+
+    rounds = int(argv[1]) if len(argv) > 1 and argv[1].isdigit() else DEFAULT_ROUNDS
+
+    print(f"{'state':<18}{'codec':<8}{'bytes':>7}{'encode us':>11}{'decode us':>11}")
+
+    for state_name, data in SAMPLE_STATES:
+        for codec_name, encode, decode in (
+            ("json", encode_json, decode_json),
+            ("binary", encode_state, decode_state)
+        ):
+            encoded = encode(state_name, data)
+            if decode(encoded) != (state_name, data):
+                print(f"{state_name} does not round-trip with {codec_name}.")
+                return
+
+            encode_time = measure(encode, (state_name, data), rounds)
+            decode_time = measure(decode, (encoded,), rounds)
+
+            print(
+                f"{state_name:<18}{codec_name:<8}{len(encoded):>7}"
+                f"{encode_time:>11.2f}{decode_time:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,12 +9,12 @@ from os import path
 from hashlib import sha256
 from secrets import choice
 from gzip import decompress
-from typing import Final, Tuple
+from typing import Final, Optional, Tuple
 from functools import lru_cache
 
 import cv2
 import numpy as np
-from flask import Request
+from flask import Request, g
 
 try:
     from src.request import is_post
@@ -38,13 +38,13 @@ DECOMPRESSED_DATASET_FILE_PATH: Final[str] = path.join(
 )
 
 
-def generate_powbox_challenge() -> Tuple[str, str]:
+def generate_powbox_challenge() -> Tuple[str, Optional[str]]:
     """
     Generate a Proof of Work (PoW) challenge and its associated state.
 
     Returns:
-        Tuple[str, str]: A tuple containing the generated challenge and 
-        the encoded state string.
+        Tuple[str, Optional[str]]: A tuple containing the generated challenge and 
+        the encoded state string, or None if the state could not be created.
     """
 
     challenge = generate_random_string(32, "aA0")
@@ -53,6 +53,27 @@ def generate_powbox_challenge() -> Tuple[str, str]:
     return challenge, state
 
 
+def get_pow_state(powbox_state: Optional[str]) -> Tuple[Optional[str], dict]:
+    """
+    Consumes the PoW state of the current request. The result is kept in `g`,
+    so the state is read once even if the response is verified several times,
+    and a caller that already read it in a batch can store it in `g.pow_state`.
+
+    Args:
+        powbox_state (Optional[str]): The state string sent with the PoW solution.
+
+    Returns:
+        Tuple[Optional[str], dict]: The state name and decoded data.
+    """
+
+    pow_state = getattr(g, "pow_state", None)
+    if pow_state is None:
+        pow_state = get_state(powbox_state, True)
+        g.pow_state = pow_state
+
+    return pow_state
+
+
 def verify_pow_response(request: Request, difficulty: int = 5) -> bool:
     """
     Verify the Proof of Work (PoW) response from a client request.
@@ -76,7 +97,7 @@ def verify_pow_response(request: Request, difficulty: int = 5) -> bool:
     if not powbox_solution or not powbox_state:
         return False
 
-    state_name, decoded_data = get_state(powbox_state, True)
+    state_name, decoded_data = get_pow_state(powbox_state)
     challenge = decoded_data.get("challenge", None)
     if state_name != "pow" or not challenge:
         return False
@@ -172,18 +193,17 @@ def random_image(images: list) -> str:
     return convert_image_to_base64(distorted_image)
 
 
-def create_captcha(data: dict, captcha_type: str = "oneclick") -> Tuple[list, str]:
+def generate_captcha(captcha_type: str = "oneclick") -> Tuple[list, list]:
     """
-    Create a CAPTCHA consisting of a set of images, including one correct image.
+    Generate the images of a CAPTCHA, including one correct image.
 
     Args:
-        data (dict): A dictionary to store the correct image indices and 
-            any additional data related to the CAPTCHA.
         captcha_type (str, optional): The type of CAPTCHA to create. 
             Defaults to "oneclick".
 
     Returns:
-        Tuple[list, str]: A tuple containing base64-encoded images and an associated state string.
+        Tuple[list, list]: A tuple containing base64-encoded images and
+            the indices of the correct images.
     """
 
     dataset = load_dataset()
@@ -206,6 +226,24 @@ def create_captcha(data: dict, captcha_type: str = "oneclick") -> Tuple[list, st
         captcha_images = secure_shuffle(captcha_images)
         correct_image_indexs.append(captcha_images.index(random_correct_image))
 
+    return captcha_images, correct_image_indexs
+
+
+def create_captcha(data: dict, captcha_type: str = "oneclick") -> Tuple[list, str]:
+    """
+    Create a CAPTCHA consisting of a set of images, including one correct image.
+
+    Args:
+        data (dict): A dictionary to store the correct image indices and 
+            any additional data related to the CAPTCHA.
+        captcha_type (str, optional): The type of CAPTCHA to create. 
+            Defaults to "oneclick".
+
+    Returns:
+        Tuple[list, str]: A tuple containing base64-encoded images and an associated state string.
+    """
+
+    captcha_images, correct_image_indexs = generate_captcha(captcha_type)
     data["correct_images"] = correct_image_indexs
 
     state = create_state("captcha_" + captcha_type, data)
@@ -7,9 +7,10 @@ including hashing, encryption, TOTP generation, and Base62 encoding.
 
 from time import time
 from io import BytesIO
+from struct import Struct
 from base64 import b32decode
 from hashlib import sha1, sha256
-from hmac import new as new_hmac
+from hmac import new as new_hmac, compare_digest
 from secrets import choice, token_bytes
 from typing import Final, Union, Optional, Tuple
 
@@ -147,14 +148,49 @@ def sha256_hash_text(text: Union[str, bytes]) -> Optional[str]:
     return Base62.encode(hashed_text)
 
 
+def hmac_sha256(key: bytes, text: Union[str, bytes]) -> Optional[bytes]:
+    """
+    Computes a keyed HMAC-SHA256 digest of the given input.
+
+    Args:
+        key (bytes): The secret key for the HMAC.
+        text (Union[str, bytes]): The input text to be authenticated.
+
+    Returns:
+        Optional[bytes]: The HMAC-SHA256 digest of the input.
+    """
+
+    try:
+        if isinstance(text, str):
+            text = text.encode("utf-8")
+
+        return new_hmac(key, text, sha256).digest()
+
+    except (TypeError, ValueError, UnicodeEncodeError):
+        log("hmac_sha256 Error.", level=4)
+
+    return None
+
+
+SHA256_HASH_VERSION: Final[int] = 1
+SHA256_HASH_HEADER: Final[Struct] = Struct(">BI")
+
+
 class SHA256:
     """
     A class to perform hashing operations with optional salting and serialization.
+
+    Self-describing hashes start with a version byte and the iteration count,
+    so they can be verified after the configured iteration count changed.
+    Hashes without this header are recognised by their length and verified
+    with the legacy iteration count.
     """
 
 
     def __init__(self, iterations: int = 10000, hash_length: int = 8,
-                 salt_length: int = 8, use_encoding: bool = False) -> None:
+                 salt_length: int = 8, use_encoding: bool = False,
+                 self_describing: bool = False,
+                 legacy_iterations: Optional[int] = None) -> None:
         """
         Initializes the Hashing class with specified parameters.
 
@@ -162,20 +198,26 @@ class SHA256:
             iterations (int, optional): The number of iterations for the hashing process.
             hash_length (int, optional): The length of the resulting hash in bytes.
             salt_length (int, optional): The length of the salt in bytes.
+            use_encoding (bool, optional): Whether to encode hashes with Base62.
+            self_describing (bool, optional): Whether hashes carry their iteration count.
+            legacy_iterations (Optional[int], optional): The iteration count of hashes
+                without a header, defaults to `iterations`.
         """
 
         self.iterations = iterations
         self.hash_length = hash_length
         self.salt_length = salt_length
         self.use_encoding = use_encoding
+        self.self_describing = self_describing
+        self.legacy_iterations = legacy_iterations or iterations
 
 
-    def _hash(self, plain_value: bytes, salt: bytes) -> bytes:
+    def _hash(self, plain_value: bytes, salt: bytes, iterations: Optional[int] = None) -> bytes:
         kdf = PBKDF2HMAC(
             algorithm = hashes.SHA3_256(),
             length = self.hash_length,
             salt = salt,
-            iterations = self.iterations,
+            iterations = iterations or self.iterations,
             backend = default_backend()
         )
 
@@ -215,6 +257,11 @@ class SHA256:
             hashed = self._hash(plain_value, use_salt)
             combined_hash = use_salt + hashed
 
+            if self.self_describing:
+                combined_hash = SHA256_HASH_HEADER.pack(
+                    SHA256_HASH_VERSION, self.iterations
+                ) + combined_hash
+
             if self.use_encoding:
                 combined_hash = Base62.encode(combined_hash)
 
@@ -254,6 +301,8 @@ class SHA256:
             if not isinstance(hashed_value, bytes):
                 return False
 
+            iterations, hashed_value = self._split_header(hashed_value)
+
             use_salt = b""
             real_hash = hashed_value
             if self.salt_length > 0:
@@ -265,9 +314,9 @@ class SHA256:
                     use_salt = hashed_value[:self.salt_length]
                     real_hash = hashed_value[self.salt_length:]
 
-            hashed = self._hash(plain_value, use_salt)
+            hashed = self._hash(plain_value, use_salt, iterations)
 
-            return hashed == real_hash
+            return compare_digest(hashed, real_hash)
 
         except (TypeError, ValueError, UnicodeDecodeError):
             log("SHA256 Comparing Error.", level=4)
@@ -275,6 +324,57 @@ class SHA256:
         return False
 
 
+    def _split_header(self, hashed_value: bytes) -> Tuple[int, bytes]:
+        """
+        Splits the header off a self-describing hash.
+
+        Args:
+            hashed_value (bytes): The decoded hash.
+
+        Returns:
+            Tuple[int, bytes]: The iteration count and the hash without header.
+        """
+
+        header_length = SHA256_HASH_HEADER.size
+        if not self.self_describing or \
+            len(hashed_value) != header_length + self.salt_length + self.hash_length:
+            return self.legacy_iterations, hashed_value
+
+        version, iterations = SHA256_HASH_HEADER.unpack(hashed_value[:header_length])
+        if version != SHA256_HASH_VERSION or iterations <= 0:
+            return self.legacy_iterations, hashed_value
+
+        return iterations, hashed_value[header_length:]
+
+
+    def needs_rehash(self, hashed_value: Union[str, bytes]) -> bool:
+        """
+        Checks whether a hash was created with other cost parameters than the configured ones.
+
+        Args:
+            hashed_value (Union[str, bytes]): The hashed value to check.
+
+        Returns:
+            bool: True if the value should be hashed again, otherwise False.
+        """
+
+        if not self.self_describing:
+            return False
+
+        if isinstance(hashed_value, str) and self.use_encoding:
+            hashed_value = Base62.decode(hashed_value)
+
+        if not isinstance(hashed_value, bytes):
+            return False
+
+        header_length = SHA256_HASH_HEADER.size
+        if len(hashed_value) != header_length + self.salt_length + self.hash_length:
+            return True
+
+        iterations, _ = self._split_header(hashed_value)
+        return iterations != self.iterations
+
+
 def split_into_chunks(data: bytes, length: int) -> list[bytes]:
     """
     Split the input data into chunks of a specified length.
@@ -484,6 +584,108 @@ class AES:
         return None
 
 
+class SealedBox(AES):
+    """
+    Authenticated encryption for values that are handed to clients.
+
+    Values are encrypted with AES-CBC and then authenticated with a truncated
+    HMAC-SHA256 tag over the associated data, the IV and the cipher text.
+    Both keys are derived once from the token, so sealing a value costs
+    no key derivation.
+    """
+
+    TAG_LENGTH: Final[int] = 16
+
+
+    def __init__(self, token: Union[str, bytes]) -> None:
+        """
+        Initializes the box and derives the encryption and authentication keys.
+
+        Args:
+            token (Union[str, bytes]): The secret the keys are derived from.
+        """
+
+        super().__init__(token)
+
+        self._encryption_key = hmac_sha256(self.token, "encryption")
+        self._authentication_key = hmac_sha256(self.token, "authentication")
+
+
+    def _get_tag(self, associated_data: bytes, iv: bytes, cipher_value: bytes) -> bytes:
+        """
+        Computes the authentication tag of a sealed value.
+
+        Args:
+            associated_data (bytes): Data that is authenticated but not encrypted.
+            iv (bytes): The initialization vector.
+            cipher_value (bytes): The encrypted value.
+
+        Returns:
+            bytes: The truncated HMAC-SHA256 tag.
+        """
+
+        return new_hmac(
+            self._authentication_key, associated_data + iv + cipher_value, sha256
+        ).digest()[:self.TAG_LENGTH]
+
+
+    def encrypt(self, plain_value: Union[str, bytes],
+                associated_data: bytes = b"") -> Optional[bytes]:
+        """
+        Seals the given plain value.
+
+        Args:
+            plain_value (Union[str, bytes]): The plain value to be sealed.
+            associated_data (bytes): Data stored beside the sealed value, e.g. a
+                header, that must not be changed either.
+
+        Returns:
+            Optional[bytes]: The IV, the encrypted value and the tag.
+        """
+
+        try:
+            if isinstance(plain_value, str):
+                plain_value = plain_value.encode("utf-8")
+
+            iv, cipher_value = self._encrypt(self._encryption_key, plain_value)
+            return iv + cipher_value + self._get_tag(associated_data, iv, cipher_value)
+
+        except (TypeError, ValueError, AttributeError, RuntimeError):
+            log("AES Sealing Error.", level=4)
+
+        return None
+
+
+    def decrypt(self, cipher_value: Union[str, bytes],
+                associated_data: bytes = b"") -> Optional[bytes]:
+        """
+        Opens a sealed value, rejecting it if it or the associated data were changed.
+
+        Args:
+            cipher_value (Union[str, bytes]): The sealed value.
+            associated_data (bytes): The data that was given when sealing.
+
+        Returns:
+            Optional[bytes]: The plain value, or None if the value is not authentic.
+        """
+
+        if not isinstance(cipher_value, bytes) or len(cipher_value) < 32 + self.TAG_LENGTH:
+            return None
+
+        iv, tag = cipher_value[:16], cipher_value[-self.TAG_LENGTH:]
+        cipher_value = cipher_value[16:-self.TAG_LENGTH]
+
+        if not compare_digest(tag, self._get_tag(associated_data, iv, cipher_value)):
+            return None
+
+        try:
+            return self._decrypt(self._encryption_key, cipher_value, iv)
+        except (TypeError, ValueError, AttributeError, RuntimeError):
+            log("AES Opening Error.", level=4)
+
+        return None
+
+
 def generate_base32_secret(length: int = 16) -> str:
     """
     Generate a secure random Base32-encoded string.
@@ -5,8 +5,12 @@ This module provides functionality for mitigating Distributed Denial of Service
 by implementing a rate limiting mechanism based on IP addresses. 
 """
 
-from time import time
-from typing import Final, Optional, Any
+from os import environ, getpid
+from time import time, monotonic, perf_counter
+from threading import Lock
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import Final, Optional, Tuple, Callable, Any
 from datetime import datetime, timedelta
 from socket import gethostbyname, gaierror
 from socket import timeout as socket_timeout
@@ -17,51 +21,517 @@ from urllib.parse import urlencode
 from urllib.request import Request, urlopen
 from urllib.error import HTTPError, URLError
 
+from redis import RedisError
+from redis.commands.core import Script
+
 try:
     from src.logger import log
+    from src.metrics import METRICS
     from src.crypto import sha256_hash_text
-    from src.utils import REDIS_CLIENT, matches_rules
-    from src.internet_protocol import is_valid_ip, reverse_ip, is_ipv4
+    from src.utils import REDIS_CLIENT, PeriodicTask, matches_rules, str_to_float
+    from src.internet_protocol import is_valid_ip, reverse_ip, is_ipv4, get_ip_networks
 except (ModuleNotFoundError, ImportError):
     from logger import log
+    from metrics import METRICS
     from crypto import sha256_hash_text
-    from utils import REDIS_CLIENT, matches_rules
-    from internet_protocol import is_valid_ip, reverse_ip, is_ipv4
+    from utils import REDIS_CLIENT, PeriodicTask, matches_rules, str_to_float
+    from internet_protocol import is_valid_ip, reverse_ip, is_ipv4, get_ip_networks
 
 
 DEFAULT_IP_HASH: Final[str] = "eCpiLALcButgO5xE90Xbt3Oa8Hd5WvScPomOSoP8bts"
 
+IPAPI_URL: Final[str] = "http://ip-api.com/json/{ip_address}?fields=proxy,hosting"
+EXONERATOR_URL: Final[str] = "https://metrics.torproject.org/exonerator.html"
+
+IP_REPUTATION_DEADLINE_RAW: str = environ.get("IP_REPUTATION_DEADLINE", "")
+IP_REPUTATION_DEADLINE: float = 2.0
+if (deadline := str_to_float(IP_REPUTATION_DEADLINE_RAW)) is not None and deadline > 0:
+    IP_REPUTATION_DEADLINE = deadline
+
+IP_REPUTATION_WORKERS_RAW: str = environ.get("IP_REPUTATION_WORKERS", "")
+IP_REPUTATION_WORKERS: int = 8
+if IP_REPUTATION_WORKERS_RAW.isdigit() and int(IP_REPUTATION_WORKERS_RAW) > 0:
+    IP_REPUTATION_WORKERS = int(IP_REPUTATION_WORKERS_RAW)
+
+IP_REPUTATION_QUEUE_DEPTH_RAW: str = environ.get("IP_REPUTATION_QUEUE_DEPTH", "")
+IP_REPUTATION_QUEUE_DEPTH: int = IP_REPUTATION_WORKERS * 4
+if IP_REPUTATION_QUEUE_DEPTH_RAW.isdigit():
+    IP_REPUTATION_QUEUE_DEPTH = int(IP_REPUTATION_QUEUE_DEPTH_RAW)
+
+RATE_LIMIT_RAW: str = environ.get("RATE_LIMIT", "")
+RATE_LIMIT: int = 15
+if RATE_LIMIT_RAW.isdigit() and int(RATE_LIMIT_RAW) > 0:
+    RATE_LIMIT = int(RATE_LIMIT_RAW)
+
+RATE_LIMIT_PERIOD_RAW: str = environ.get("RATE_LIMIT_PERIOD", "")
+RATE_LIMIT_PERIOD: int = 10 # seconds
+if RATE_LIMIT_PERIOD_RAW.isdigit() and int(RATE_LIMIT_PERIOD_RAW) > 0:
+    RATE_LIMIT_PERIOD = int(RATE_LIMIT_PERIOD_RAW)
+
+RATE_LIMIT_LOCAL_BURST_RAW: str = environ.get("RATE_LIMIT_LOCAL_BURST", "")
+RATE_LIMIT_LOCAL_BURST: int = 2
+if RATE_LIMIT_LOCAL_BURST_RAW.isdigit():
+    RATE_LIMIT_LOCAL_BURST = int(RATE_LIMIT_LOCAL_BURST_RAW)
+
+RATE_LIMIT_SYNC_INTERVAL_RAW: str = environ.get("RATE_LIMIT_SYNC_INTERVAL", "")
+RATE_LIMIT_SYNC_INTERVAL: int = 200 # milliseconds
+if RATE_LIMIT_SYNC_INTERVAL_RAW.isdigit():
+    RATE_LIMIT_SYNC_INTERVAL = int(RATE_LIMIT_SYNC_INTERVAL_RAW)
+
+# Generic cell rate algorithm over nested buckets: every key in KEYS, from the largest
+# network to the address, holds a theoretical arrival time (TAT) in milliseconds,
+# which every request moves by the emission interval of the key. ARGV[1] is the
+# period, ARGV[2] is 1 to admit a request and ARGV[i * 2 + 1] and ARGV[i * 2 + 2] are
+# the emission interval of KEYS[i] and the requests a worker has already admitted
+# to it, which are always charged. A request is admitted if the TAT of every key
+# stays at most the period ahead. Keys after the first one that refuses a request
+# are neither read nor created unless they have requests to charge. Returns
+# whether the request was admitted and, for every key, how many more requests it
+# would admit and the milliseconds until the next one, or -1 if it was not read.
+RATE_LIMIT_SCRIPT: Final[Script] = REDIS_CLIENT.register_script("""
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local period = tonumber(ARGV[1])
+local is_allowed = ARGV[2] == "1"
+
+local tats = {}
+for index, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[index * 2 + 1])
+    local pending = tonumber(ARGV[index * 2 + 2])
+
+    if is_allowed or pending > 0 then
+        local tat = math.max(tonumber(redis.call("GET", key)) or now, now)
+        tat = tat + interval * pending
+
+        if is_allowed and tat + interval - now > period then
+            is_allowed = false
+        end
+        tats[index] = tat
+    end
+end
+
+local results = {is_allowed and 1 or 0}
+for index, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[index * 2 + 1])
+    local tat = tats[index]
+
+    if tat == nil then
+        table.insert(results, 0)
+        table.insert(results, -1)
+    else
+        if is_allowed then
+            tat = tat + interval
+        end
+
+        if tat > now then
+            redis.call("SET", key, tostring(tat), "PX", math.ceil(tat - now))
+        end
+
+        table.insert(results, math.floor((period - (tat - now)) / interval))
+        table.insert(results, math.max(0, math.ceil(tat + interval - now - period)))
+    end
+end
+
+return results
+""")
+
+
+class RateLimiter:
+    """
+    A rate limiter in two tiers: every worker admits requests from local buckets
+    and charges them to the shared generic cell rate algorithm keys in Redis in
+    batches every `sync_interval` milliseconds. Once a local bucket is empty, the
+    next request is checked in Redis directly, so Redis calls scale with the
+    number of active clients instead of requests.
+
+    Every request is charged to a chain of buckets, from the largest network of
+    the client down to its address, each of which admits `limit` requests times
+    its multiplier per period. A request is admitted only if every bucket of the
+    chain admits it, and the largest bucket is checked first, so a flooding
+    network is refused without creating buckets for its addresses.
+
+    Local buckets are refilled after every synchronization, but never beyond what
+    the shared key still allows. As each worker holds at most `local_burst` times
+    the multiplier admitted requests per bucket that are not charged yet, at most
+    `WORKERS * local_burst` times the multiplier requests more than a bucket
+    allows are admitted per period. A `local_burst` of 0 checks every request
+    in Redis.
+
+    Attributes:
+        name (str): The name of the limit, part of its Redis keys.
+        limit (int): The number of requests per period of a single address.
+        period (int): The length of the period in seconds.
+        local_burst (int): The number of requests of a single address a worker
+            admits without Redis.
+        sync_interval (int): The milliseconds between two synchronizations.
+    """
+
+
+    def __init__(self, name: str, limit: int = RATE_LIMIT, period: int = RATE_LIMIT_PERIOD,
+                 local_burst: int = RATE_LIMIT_LOCAL_BURST,
+                 sync_interval: int = RATE_LIMIT_SYNC_INTERVAL) -> None:
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.local_burst = local_burst
+        self.sync_interval = sync_interval
+
+        self._lock = Lock()
+        # Maps the bucket ID to [allowance, pending, blocked until, synced at, multiplier].
+        self._buckets: dict[str, list] = {}
+        self._syncer = PeriodicTask(self.sync, sync_interval / 1000)
+
+
+    def _get_args(self, buckets: list[list], pendings: list[int], is_request: bool) -> list:
+        args = [self.period * 1000, int(is_request)]
+        for bucket, pending in zip(buckets, pendings):
+            args += [self.period * 1000 / (self.limit * bucket[4]), pending]
+
+        return args
+
+
+    def _update(self, bucket: list, remaining: int, retry_after: int, now: float) -> None:
+        if int(retry_after) < 0:
+            return
+
+        bucket[0] = max(0, min(self.local_burst * bucket[4], int(remaining)) - bucket[1])
+        bucket[2] = now + int(retry_after) / 1000 if int(remaining) < 1 else 0
+        bucket[3] = now
+
+
+    def check(self, chain: list[Tuple[str, int]]) -> float:
+        """
+        Admits a request to a chain of buckets.
+
+        Args:
+            chain (list[Tuple[str, int]]): The ID and the multiplier of every
+                bucket, from the largest network to the address.
+
+        Returns:
+            float: The number of seconds until the client may send the
+                next request, or 0 if the request is allowed.
+        """
+
+        now = time()
+        with self._lock:
+            buckets = []
+            for bucket_id, multiplier in chain:
+                bucket = self._buckets.get(bucket_id, None)
+                if bucket is None:
+                    bucket = self._buckets[bucket_id] = [
+                        self.local_burst * multiplier, 0, 0, now, multiplier
+                    ]
+
+                if bucket[2] > now:
+                    return bucket[2] - now
+
+                buckets.append(bucket)
+
+            if all(bucket[0] > 0 for bucket in buckets):
+                for bucket in buckets:
+                    bucket[0] -= 1
+                    bucket[1] += 1
+
+                self._syncer.start()
+                return 0
+
+            pendings = [bucket[1] for bucket in buckets]
+            for bucket in buckets:
+                bucket[1] = 0
+
+        try:
+            results = RATE_LIMIT_SCRIPT(
+                keys = ["rate_limit_tat:" + self.name + ":" + bucket_id for bucket_id, _ in chain],
+                args = self._get_args(buckets, pendings, True)
+            )
+        except RedisError:
+            log("Rate limit could not be checked.", level = 4)
+
+            with self._lock:
+                for bucket, pending in zip(buckets, pendings):
+                    bucket[1] += pending
+
+            return 0
+
+        with self._lock:
+            for index, bucket in enumerate(buckets):
+                self._update(bucket, results[index * 2 + 1], results[index * 2 + 2], now)
+
+        if results[0]:
+            return 0
+
+        return max(
+            int(results[index * 2 + 2]) for index in range(len(buckets))
+            if int(results[index * 2 + 1]) < 1
+        ) / 1000
+
+
+    def sync(self) -> bool:
+        """
+        Charges the requests every local bucket has admitted since the last
+        synchronization and refills the buckets. Buckets that have nothing to
+        charge and were synchronized more than a period ago are removed.
+
+        Returns:
+            bool: True if the requests were charged, otherwise False.
+        """
+
+        now = time()
+        with self._lock:
+            pending_buckets = []
+            for bucket_id, bucket in list(self._buckets.items()):
+                if bucket[1] > 0:
+                    pending_buckets.append((bucket_id, bucket, bucket[1]))
+                    bucket[1] = 0
+
+                elif bucket[3] < now - self.period and bucket[2] <= now:
+                    del self._buckets[bucket_id]
+
+        if not pending_buckets:
+            return True
+
+        try:
+            with REDIS_CLIENT.pipeline(transaction = False) as pipeline:
+                for bucket_id, bucket, pending in pending_buckets:
+                    RATE_LIMIT_SCRIPT(
+                        keys = ["rate_limit_tat:" + self.name + ":" + bucket_id],
+                        args = self._get_args([bucket], [pending], False), client = pipeline
+                    )
+
+                results = pipeline.execute()
+
+        except RedisError:
+            log("Rate limits could not be synchronized.", level = 4)
+
+            with self._lock:
+                for _, bucket, pending in pending_buckets:
+                    bucket[1] += pending
+
+            return False
 
-def rate_limit(ip_address: str) -> bool:
+        with self._lock:
+            for (_, bucket, _), (_, remaining, retry_after) in zip(pending_buckets, results):
+                self._update(bucket, remaining, retry_after, now)
+
+        return True
+
+
+# The multiple of the limit of an address that applies to all addresses of a network
+# by prefix length. A single client usually holds a whole IPv6 /64, a /24 or /48 is
+# shared by the clients of a provider. Addresses themselves have a multiplier of 1.
+RATE_LIMIT_NETWORK_MULTIPLIERS: Final[dict[int, int]] = {24: 16, 48: 16, 64: 4}
+
+RATE_LIMIT_CLIENT_CLASSES: Final[Tuple[str, ...]] = ("verified", "session", "anonymous")
+
+# Rate limit policies as (name, routes, methods, client classes, limit, period in
+# seconds, local burst). The first policy that matches a request applies, requests
+# no policy matches fall under the "default" policy of `RATE_LIMIT` requests per
+# `RATE_LIMIT_PERIOD` seconds. Every policy has its own budget per IP address.
+# Routes that derive keys have no local burst, so each of their requests is
+# checked in Redis. Session cookies are not verified before the rate limit, so
+# the "session" class must never get looser limits than "anonymous".
+RATE_LIMIT_POLICIES: Final[Tuple[Tuple[str, Tuple[str, ...], Tuple[str, ...],
+                                       Tuple[str, ...], int, int, int], ...]] = (
+    ("login", ("/login",), ("POST",), RATE_LIMIT_CLIENT_CLASSES, 10, 60, 0),
+    ("signup", ("/signup",), ("POST",), RATE_LIMIT_CLIENT_CLASSES, 5, 60, 0),
+    ("availability", ("/signup/availability",), ("GET",), RATE_LIMIT_CLIENT_CLASSES, 30, 10, 0),
+    ("pages", ("/", "/auth", "/login", "/signup"), ("GET",),
+     ("verified",), 30, 10, RATE_LIMIT_LOCAL_BURST),
+)
+
+
+def compile_rate_limit_policies(policies: tuple) -> dict[Tuple[str, str, str], RateLimiter]:
     """
-    Rate limit an IP address: max 15 requests/second with a max of 17 timestamps stored.
+    Compiles rate limit policies into a dictionary with one entry
+    for every route, method and client class they cover.
+
+    Args:
+        policies (tuple): The policies, see `RATE_LIMIT_POLICIES`.
+
+    Returns:
+        dict[Tuple[str, str, str], RateLimiter]: The rate limiter of the first
+            matching policy by route, method and client class.
+    """
+
+    dispatch: dict[Tuple[str, str, str], RateLimiter] = {}
+    for name, routes, methods, client_classes, limit, period, local_burst in policies:
+        rate_limiter = RateLimiter(name, limit, period, local_burst)
+
+        for route in routes:
+            for method in methods:
+                for client_class in client_classes:
+                    dispatch.setdefault((route, method, client_class), rate_limiter)
+
+    return dispatch
+
+
+RATE_LIMIT_DISPATCH: Final[dict[Tuple[str, str, str], RateLimiter]] = \
+    compile_rate_limit_policies(RATE_LIMIT_POLICIES)
+DEFAULT_RATE_LIMITER: Final[RateLimiter] = RateLimiter("default")
+
+
+KDF_BUDGET_WINDOW_RAW: str = environ.get("KDF_BUDGET_WINDOW", "")
+KDF_BUDGET_WINDOW: int = 300 # 5 minutes in seconds
+if KDF_BUDGET_WINDOW_RAW.isdigit() and int(KDF_BUDGET_WINDOW_RAW) > 0:
+    KDF_BUDGET_WINDOW = int(KDF_BUDGET_WINDOW_RAW)
+
+ACCOUNT_KDF_BUDGET_RAW: str = environ.get("ACCOUNT_KDF_BUDGET", "")
+ACCOUNT_KDF_BUDGET: int = 10
+if ACCOUNT_KDF_BUDGET_RAW.isdigit():
+    ACCOUNT_KDF_BUDGET = int(ACCOUNT_KDF_BUDGET_RAW)
+
+IP_KDF_BUDGET_RAW: str = environ.get("IP_KDF_BUDGET", "")
+IP_KDF_BUDGET: int = 30
+if IP_KDF_BUDGET_RAW.isdigit():
+    IP_KDF_BUDGET = int(IP_KDF_BUDGET_RAW)
+
+# Refills every bucket in KEYS by its capacity (ARGV[i + 1]) per window (ARGV[1]) and
+# takes one token from each, but only if all of them have one left. Returns the
+# position of the first exhausted bucket, or 0 if every bucket was charged.
+KDF_BUDGET_SCRIPT: Final[Script] = REDIS_CLIENT.register_script("""
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local window = tonumber(ARGV[1])
+
+local remaining = {}
+for index, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[index + 1])
+    local bucket = redis.call("HMGET", key, "tokens", "time")
+
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * capacity / window)
+
+    if tokens < 1 then
+        return index
+    end
+    remaining[index] = tokens - 1
+end
+
+for index, key in ipairs(KEYS) do
+    redis.call("HSET", key, "tokens", tostring(remaining[index]), "time", tostring(now))
+    redis.call("EXPIRE", key, window)
+end
+
+return 0
+""")
+
+
+def rate_limit(ip_address: str, route: Optional[str] = None, method: str = "GET",
+               client_class: str = "anonymous") -> float:
+    """
+    Rate limit an IP address by the policy of the requested route, see
+    `RATE_LIMIT_POLICIES` and `RateLimiter`. Besides the address, its /24
+    for IPv4 or its /48 and /64 for IPv6 are limited as well.
 
     Args:
         ip_address (str): The IP address to check.
+        route (Optional[str]): The route of the request, None if no route matches.
+        method (str): The HTTP method of the request.
+        client_class (str): "verified" for verified browsers, "session" for
+            clients with a session cookie, otherwise "anonymous".
+
+    Returns:
+        float: The number of seconds until the IP address may send the
+            next request, or 0 if the request is allowed.
+    """
+
+    chain = []
+    if isinstance(ip_address, str):
+        for prefix_length, network in get_ip_networks(ip_address):
+            hashed_network = sha256_hash_text(network)
+            if isinstance(hashed_network, str):
+                chain.append((hashed_network, RATE_LIMIT_NETWORK_MULTIPLIERS.get(prefix_length, 1)))
+
+    if not chain:
+        chain = [(DEFAULT_IP_HASH, 1)]
+
+    rate_limiter = RATE_LIMIT_DISPATCH.get((route, method, client_class), DEFAULT_RATE_LIMITER)
+
+    retry_after = rate_limiter.check(chain)
+    if retry_after:
+        METRICS.increment("rate_limit", rate_limiter.name + "_limited")
+
+    return retry_after
+
+
+def get_kdf_budgets(user_key: bytes, ip_address: Optional[str],
+                    charge_account: bool = True) -> list[tuple[str, str, int]]:
+    """
+    Returns the buckets that are charged for a key derivation.
+
+    Args:
+        user_key (bytes): The key of the account the password is checked for.
+        ip_address (Optional[str]): The IP address of the client.
+        charge_account (bool): Whether to include the bucket of the account.
 
     Returns:
-        bool: True if the IP is rate-limited, False otherwise.
+        list[tuple[str, str, int]]: The name, the Redis key and the
+            capacity of every bucket.
     """
 
-    hashed_ip = sha256_hash_text(ip_address)
+    hashed_ip = sha256_hash_text(ip_address) if isinstance(ip_address, str) else None
     if not isinstance(hashed_ip, str):
         hashed_ip = DEFAULT_IP_HASH
 
-    namespace_key = f"rate_limit:{hashed_ip}"
-    current_time = int(time())
+    budgets = [("ip", "kdf_budget:ip:" + hashed_ip, IP_KDF_BUDGET)]
+    if charge_account:
+        budgets.append(("account", "kdf_budget:account:" + user_key.hex(), ACCOUNT_KDF_BUDGET))
+
+    return budgets
+
+
+def charge_kdf_budget(user_key: bytes, ip_address: Optional[str],
+                      charge_account: bool = True) -> Optional[str]:
+    """
+    Takes one key derivation from the budgets of an account and of an IP
+    address before a password is hashed. Nothing is charged if any of the
+    budgets is exhausted.
+
+    Args:
+        user_key (bytes): The key of the account the password is checked for.
+        ip_address (Optional[str]): The IP address of the client.
+        charge_account (bool): Whether to charge the budget of the account,
+            which can be skipped once the client has solved a captcha.
+
+    Returns:
+        Optional[str]: The name of the exhausted budget ("ip" or "account"),
+            or None if the key derivation may run.
+    """
+
+    budgets = get_kdf_budgets(user_key, ip_address, charge_account)
+
+    try:
+        exhausted = KDF_BUDGET_SCRIPT(
+            keys = [key for _, key, _ in budgets],
+            args = [KDF_BUDGET_WINDOW] + [capacity for _, _, capacity in budgets]
+        )
+    except RedisError:
+        log("KDF budget could not be charged.", level = 4)
+        return None
+
+    if not exhausted:
+        return None
+
+    name = budgets[int(exhausted) - 1][0]
+    METRICS.increment("kdf_budget", name + "_exhausted")
 
-    with REDIS_CLIENT.pipeline() as pipe:
-        pipe.rpush(namespace_key, current_time)
-        pipe.ltrim(namespace_key, -17, -1)
-        pipe.lrange(namespace_key, 0, -1)
-        pipe.expire(namespace_key, 10)
+    return name
 
-        result = pipe.execute()
-        timestamps = result[2]
 
-    recent_requests = sum(1 for t in timestamps if current_time - int(t) <= 10)
+def record_kdf_seconds(seconds: float, charged_account: bool = True) -> None:
+    """
+    Adds the time spent on a key derivation to the metrics of the
+    budgets it was charged to.
+
+    Args:
+        seconds (float): The duration of the key derivation.
+        charged_account (bool): Whether the budget of the account was charged.
+    """
 
-    return recent_requests > 15
+    METRICS.increment("kdf_budget", "ip_seconds", seconds)
+    if charged_account:
+        METRICS.increment("kdf_budget", "account_seconds", seconds)
 
 
 def http_request(url: str, method: str = "GET", timeout: int = 2,
@@ -234,12 +704,13 @@ def get_cache(key: str, ip_address: str) -> Optional[bool]:
     return None
 
 
-def is_ip_malicious_ipapi(ip_address: str) -> Optional[bool]:
+def is_ip_malicious_ipapi(ip_address: str, timeout: float = 2) -> Optional[bool]:
     """
     Uses the IPApi.com API to check the reputation of the given IP address.
 
     Args:
         ip_address (str): The IP address to check.
+        timeout (float): The maximum number of seconds to wait for a response.
 
     Returns:
         Optional[bool]: True if the IP address is malicious, False if it is not, or None
@@ -250,9 +721,9 @@ def is_ip_malicious_ipapi(ip_address: str) -> Optional[bool]:
     if isinstance(cached_result, bool):
         return cached_result
 
-    url = f"http://ip-api.com/json/{ip_address}?fields=proxy,hosting"
+    url = IPAPI_URL.format(ip_address = ip_address)
 
-    data = http_request(url, is_json = True, default = {})
+    data = http_request(url, timeout = timeout, is_json = True, default = {})
     if not isinstance(data, dict):
         return None
 
@@ -269,15 +740,17 @@ def is_ip_malicious_ipapi(ip_address: str) -> Optional[bool]:
     return False
 
 
-def is_ip_tor_exonerator(ip_address: str) -> Optional[bool]:
+def is_ip_tor_exonerator(ip_address: str, timeout: float = 3) -> Optional[bool]:
     """
     Checks if an IP address is a Tor exit node using the Tor Project's ExoneraTor service.
     
     Args:
         ip_address (str): The IP address to check.
+        timeout (float): The maximum number of seconds to wait for a response.
         
     Returns:
-        Optional[bool]: True if IP is a Tor exit node, False if not.
+        Optional[bool]: True if IP is a Tor exit node, False if not,
+            None if the service did not answer in time.
     """
 
     cached_result = get_cache("tor_exonerator", ip_address)
@@ -286,13 +759,12 @@ def is_ip_tor_exonerator(ip_address: str) -> Optional[bool]:
 
     today = (datetime.now() - timedelta(days = 2)).strftime('%Y-%m-%d')
 
-    base_url = "https://metrics.torproject.org/exonerator.html"
     query_params = {
         "ip": ip_address,
         "timestamp": today,
         "lang": "en"
     }
-    url = f"{base_url}?{urlencode(query_params)}"
+    url = f"{EXONERATOR_URL}?{urlencode(query_params)}"
 
     req = Request(
         url, headers = {'Range': 'bytes=0-', "User-Agent":
@@ -301,7 +773,7 @@ def is_ip_tor_exonerator(ip_address: str) -> Optional[bool]:
         }
     )
     try:
-        with urlopen(req, timeout = 3) as response:
+        with urlopen(req, timeout = timeout) as response:
             html = ''
             while True:
                 chunk = response.read(128).decode('utf-8')
@@ -313,7 +785,15 @@ def is_ip_tor_exonerator(ip_address: str) -> Optional[bool]:
                     add_to_cache("tor_exonerator", ip_address, True)
                     return True
 
-    except (HTTPError, URLError, TimeoutError):
+    except (socket_timeout, TimeoutError):
+        log("Tor exonerator timed out.")
+        return None
+
+    except (HTTPError, URLError) as error:
+        if isinstance(getattr(error, "reason", None), (socket_timeout, TimeoutError)):
+            log("Tor exonerator timed out.")
+            return None
+
         log("Tor exonerator failed.")
 
         add_to_cache("tor_exonerator", ip_address, True, True)
@@ -361,33 +841,168 @@ def is_ipv4_tor(ip_address: str) -> Optional[bool]:
     return False
 
 
+# Reputation providers as (name, function, timeout in seconds, IPv4 only). The timeout
+# is passed to the provider as given, None if it cannot be limited, e.g. for blocking
+# DNS lookups. A provider that is still running at the deadline finishes in the
+# background and caches its result for the next request.
+IP_REPUTATION_PROVIDERS: Final[Tuple[Tuple[str, Callable[..., Optional[bool]],
+                                           Optional[float], bool], ...]] = (
+    ("Malicious", is_ip_malicious_ipapi, 2, False),
+    ("TOR", is_ip_tor_exonerator, 3, False),
+    ("TORv4", is_ipv4_tor, None, True),
+)
+
+class ReputationPool:
+    """
+    A thread pool for reputation providers with a queue-depth limit, so lookups
+    of requests that have already returned cannot pile up under a flood.
+
+    Attributes:
+        max_workers (int): The number of threads.
+        max_queue_depth (int): The maximum number of lookups queued or running at once.
+    """
+
+
+    def __init__(self, max_workers: int = IP_REPUTATION_WORKERS,
+                 max_queue_depth: int = IP_REPUTATION_QUEUE_DEPTH) -> None:
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+
+        self._lock = Lock()
+        self._pending = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+
+
+    def _release(self, _: Optional[Future] = None) -> None:
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+
+
+    def submit(self, function: Callable[..., Any], *args: Any) -> Optional[Future]:
+        """
+        Queues a lookup unless the queue is full. The thread pool is created
+        lazily so that every forked web worker owns its own pool.
+
+        Args:
+            function (Callable[..., Any]): The function to run.
+            *args (Any): The arguments of the function.
+
+        Returns:
+            Optional[Future]: The future of the lookup, or None if the queue is full.
+        """
+
+        with self._lock:
+            if self._executor_pid != getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers = self.max_workers, thread_name_prefix = "ip_reputation"
+                )
+                self._executor_pid = getpid()
+                self._pending = 0
+
+            if self._pending >= self.max_queue_depth:
+                return None
+
+            self._pending += 1
+            executor = self._executor
+
+        try:
+            future = executor.submit(function, *args)
+        except RuntimeError:
+            self._release()
+            return None
+
+        future.add_done_callback(self._release)
+        return future
+
+
+IP_REPUTATION_POOL: Final[ReputationPool] = ReputationPool()
+
+
+def check_ip_reputation(name: str, function: Callable[..., Optional[bool]],
+                        ip_address: str, timeout: Optional[float]) -> Optional[bool]:
+    """
+    Runs a reputation provider and records its latency in the
+    `<name>_seconds` histogram of the "ip_reputation" metrics.
+
+    Args:
+        name (str): The name of the provider.
+        function (Callable[..., Optional[bool]]): The provider.
+        ip_address (str): The IP address to check.
+        timeout (Optional[float]): The timeout of the provider, None if it takes none.
+
+    Returns:
+        Optional[bool]: The result of the provider, or None if the provider failed.
+    """
+
+    start_time = perf_counter()
+    try:
+        if timeout is None:
+            return function(ip_address)
+
+        return function(ip_address, timeout = timeout)
+
+    except RedisError:
+        log(f"{name} reputation could not be cached.", level = 4)
+
+    except Exception as error:
+        log(f"{name} reputation failed: {error!r}", level = 4)
+
+    finally:
+        METRICS.observe("ip_reputation", name + "_seconds", perf_counter() - start_time)
+
+    return None
+
+
 def is_ip_malicious(ip_address: str) -> Optional[str]:
     """
     Performs comprehensive malicious IP detection using multiple methods.
 
+    The providers in `IP_REPUTATION_PROVIDERS` run concurrently in a shared thread
+    pool. After `IP_REPUTATION_DEADLINE` seconds the results of the providers that
+    have finished are used, the others count as unknown and are cancelled unless
+    they have started. Providers are skipped while the pool is full.
+
     Args:
         ip_address (str): The IP address to check.
 
     Returns:
-        Optional[str]: String indicating detection source if malicious, None if not malicious.
+        Optional[str]: The name of the first provider that reports the IP as
+            malicious, None if none of them does.
     """
 
     if not is_valid_ip(ip_address):
         return "Invalid"
 
-    is_malicious = is_ip_malicious_ipapi(ip_address)
-    is_tor_exonerator = is_ip_tor_exonerator(ip_address)
+    deadline = monotonic() + IP_REPUTATION_DEADLINE
 
-    is_tor_v4 = False
-    if is_ipv4(ip_address):
-        is_tor_v4 = is_ipv4_tor(ip_address)
+    futures = {}
+    for name, function, timeout, is_ipv4_only in IP_REPUTATION_PROVIDERS:
+        if is_ipv4_only and not is_ipv4(ip_address):
+            continue
 
-    for (third_party_name, third_party_result) in [
-        ("Malicious", is_malicious),
-        ("TOR", is_tor_exonerator),
-        ("TORv4", is_tor_v4)
-    ]:
-        if third_party_result is True:
-            return third_party_name
+        future = IP_REPUTATION_POOL.submit(check_ip_reputation, name, function, ip_address, timeout)
+        if future is None:
+            METRICS.increment("ip_reputation", name + "_shed")
+            continue
 
-    return None
+        futures[future] = name
+
+    reason = None
+    try:
+        for future in as_completed(futures, timeout = max(0, deadline - monotonic())):
+            if future.result() is True:
+                reason = futures[future]
+                break
+
+    except FuturesTimeoutError:
+        for future, name in futures.items():
+            if not future.done():
+                METRICS.increment("ip_reputation", name + "_timeouts")
+
+        log("IP reputation providers missed the deadline.", level = 3)
+
+    for future in futures:
+        future.cancel()
+
+    return reason
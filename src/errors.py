@@ -19,6 +19,12 @@ UN_OR_PWD_NOT_RIGHT_ERROR: Final[Error] = Error(
     "Your username or password is incorrect.",
     ["user_name", "password"]
 )
+SERVER_BUSY_ERROR: Final[Error] = Error(
+    "The server is busy right now. Please try again in a moment.", []
+)
+TOO_MANY_ATTEMPTS_ERROR: Final[Error] = Error(
+    "Too many sign-in attempts. Please try again later.", []
+)
 
 
 WEB_ERROR_CODES: Final[dict[int, dict[str, str]]] = {
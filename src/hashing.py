@@ -0,0 +1,328 @@
+"""
+src/hashing.py
+
+This module provides a bounded process pool for expensive key derivations such as
+password and session token hashing, so a burst of logins cannot block every web worker.
+"""
+
+from os import environ, cpu_count, getpid
+from time import monotonic, perf_counter
+from secrets import token_bytes
+from threading import Lock
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Final, Optional, Union, Tuple
+
+try:
+    from src.logger import log
+    from src.crypto import SHA256
+    from src.utils import load_dotenv, str_to_float
+except (ModuleNotFoundError, ImportError):
+    from logger import log
+    from crypto import SHA256
+    from utils import load_dotenv, str_to_float
+
+
+load_dotenv()
+
+
+def get_default_hashing_workers(web_workers: int) -> int:
+    """
+    Returns the number of hashing processes per web worker, so that all
+    web workers together run about one key derivation per CPU core.
+
+    Args:
+        web_workers (int): The number of Gunicorn workers.
+
+    Returns:
+        int: The number of hashing processes, at least 1.
+    """
+
+    return max(1, (cpu_count() or 2) // max(1, web_workers))
+
+
+WORKERS_RAW: str = environ.get("WORKERS", "")
+WORKERS: int = 16
+if WORKERS_RAW.isdigit():
+    WORKERS = int(WORKERS_RAW)
+
+HASHING_WORKERS_RAW: str = environ.get("HASHING_WORKERS", "")
+HASHING_WORKERS: int = get_default_hashing_workers(WORKERS)
+if HASHING_WORKERS_RAW.isdigit():
+    HASHING_WORKERS = int(HASHING_WORKERS_RAW)
+
+HASHING_QUEUE_DEPTH_RAW: str = environ.get("HASHING_QUEUE_DEPTH", "")
+HASHING_QUEUE_DEPTH: int = max(1, HASHING_WORKERS) * 4
+if HASHING_QUEUE_DEPTH_RAW.isdigit():
+    HASHING_QUEUE_DEPTH = int(HASHING_QUEUE_DEPTH_RAW)
+
+HASHING_DEADLINE_RAW: str = environ.get("HASHING_DEADLINE", "")
+HASHING_DEADLINE: float = 5.0
+if (deadline := str_to_float(HASHING_DEADLINE_RAW)) is not None and deadline > 0:
+    HASHING_DEADLINE = deadline
+
+
+class HashingBusyError(Exception):
+    """
+    Raised when the hashing pool is full or could not finish a job before its deadline.
+    """
+
+
+def _hash(sha: SHA256, plain_value: Union[str, bytes]) -> Optional[Union[str, bytes]]:
+    return sha.hash(plain_value)
+
+
+def _compare(sha: SHA256, plain_value: Union[str, bytes],
+             hashed_value: Union[str, bytes]) -> bool:
+    return sha.compare(plain_value, hashed_value)
+
+
+class HashingPool:
+    """
+    A process pool for key derivations with a queue-depth limit and per-call deadlines.
+
+    Attributes:
+        max_workers (int): The number of hashing processes. If 0, jobs run inline.
+        max_queue_depth (int): The maximum number of jobs queued or running at once.
+        deadline (float): The default number of seconds a call may wait for its jobs.
+    """
+
+
+    def __init__(self, max_workers: int = HASHING_WORKERS,
+                 max_queue_depth: int = HASHING_QUEUE_DEPTH,
+                 deadline: float = HASHING_DEADLINE) -> None:
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.deadline = deadline
+
+        self._lock = Lock()
+        self._pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """
+        Returns the process pool of the current process, creating it if needed.
+
+        The pool is created lazily so that every forked web worker owns its own pool.
+        """
+
+        with self._lock:
+            if self._executor_pid != getpid():
+                self._executor = None
+                self._executor_pid = getpid()
+                self._pending = 0
+
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers = self.max_workers)
+
+            return self._executor
+
+
+    def _reserve(self, count: int) -> None:
+        """
+        Reserves queue slots for a number of jobs.
+
+        Raises:
+            HashingBusyError: If the jobs would exceed the queue-depth limit.
+        """
+
+        with self._lock:
+            if self._pending + count > self.max_queue_depth:
+                raise HashingBusyError("Hashing queue is full.")
+
+            self._pending += count
+
+
+    def _release(self, _: Optional[Future] = None) -> None:
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+
+
+    def _run_window(self, function, jobs: list, timeout: float) -> list:
+        """
+        Runs a window of jobs that fits into the queue and waits for all of them.
+
+        Raises:
+            HashingBusyError: If the pool is full or the timeout expires.
+        """
+
+        executor = self._get_executor()
+        self._reserve(len(jobs))
+
+        futures = []
+        try:
+            for job in jobs:
+                futures.append(executor.submit(function, *job))
+
+        except (BrokenProcessPool, RuntimeError) as exc:
+            for future in futures:
+                future.cancel()
+                future.add_done_callback(self._release)
+
+            for _ in range(len(jobs) - len(futures)):
+                self._release()
+
+            with self._lock:
+                self._executor = None
+
+            log("Hashing pool is broken.", level = 4)
+            raise HashingBusyError("Hashing pool is unavailable.") from exc
+
+        done, not_done = wait(futures, timeout = max(0.0, timeout))
+        for _ in done:
+            self._release()
+
+        if not_done:
+            for future in not_done:
+                future.cancel()
+                future.add_done_callback(self._release)
+
+            raise HashingBusyError("Hashing deadline expired.")
+
+        try:
+            return [future.result() for future in futures]
+
+        except BrokenProcessPool as exc:
+            with self._lock:
+                self._executor = None
+
+            log("Hashing pool is broken.", level = 4)
+            raise HashingBusyError("Hashing pool is unavailable.") from exc
+
+
+    def _run(self, function, jobs: list, deadline: Optional[float]) -> list:
+        """
+        Runs jobs on the pool and waits for all of them.
+
+        Calls with more jobs than the queue depth are split into windows,
+        all of which have to finish before the deadline.
+
+        Args:
+            function: The module-level function to call for each job.
+            jobs (list): A list of argument tuples.
+            deadline (Optional[float]): Seconds to wait; defaults to the pool deadline.
+
+        Returns:
+            list: The results in the order of the jobs.
+
+        Raises:
+            HashingBusyError: If the pool is full or the deadline expires.
+        """
+
+        if not jobs:
+            return []
+
+        if self.max_workers <= 0:
+            return [function(*job) for job in jobs]
+
+        expires_at = monotonic() + (self.deadline if deadline is None else deadline)
+        window_size = max(1, self.max_queue_depth)
+
+        results = []
+        for start in range(0, len(jobs), window_size):
+            window = jobs[start:start + window_size]
+            results.extend(self._run_window(function, window, expires_at - monotonic()))
+
+        return results
+
+
+    def hash_many(self, jobs: list[Tuple[SHA256, Union[str, bytes]]],
+                  deadline: Optional[float] = None) -> list[Optional[Union[str, bytes]]]:
+        """
+        Hashes several values in parallel.
+
+        Args:
+            jobs (list[Tuple[SHA256, Union[str, bytes]]]): Pairs of hasher and plain value.
+            deadline (Optional[float]): Seconds to wait for all hashes.
+
+        Returns:
+            list[Optional[Union[str, bytes]]]: The hashes in the order of the jobs.
+        """
+
+        return self._run(_hash, jobs, deadline)
+
+
+    def compare_many(self, jobs: list[Tuple[SHA256, Union[str, bytes], Union[str, bytes]]],
+                     deadline: Optional[float] = None) -> list[bool]:
+        """
+        Compares several plain values with their hashes in parallel.
+
+        Args:
+            jobs (list[Tuple[SHA256, Union[str, bytes], Union[str, bytes]]]): Triples of
+                hasher, plain value and hashed value.
+            deadline (Optional[float]): Seconds to wait for all comparisons.
+
+        Returns:
+            list[bool]: The comparison results in the order of the jobs.
+        """
+
+        return self._run(_compare, jobs, deadline)
+
+
+    def hash(self, sha: SHA256, plain_value: Union[str, bytes],
+             deadline: Optional[float] = None) -> Optional[Union[str, bytes]]:
+        """
+        Hashes a single value on the pool.
+        """
+
+        return self.hash_many([(sha, plain_value)], deadline)[0]
+
+
+    def compare(self, sha: SHA256, plain_value: Union[str, bytes],
+                hashed_value: Union[str, bytes], deadline: Optional[float] = None) -> bool:
+        """
+        Compares a single plain value with its hash on the pool.
+        """
+
+        return self.compare_many([(sha, plain_value, hashed_value)], deadline)[0]
+
+
+HASHING_POOL: Final[HashingPool] = HashingPool()
+
+
+def measure_hash_time(sha: SHA256, iterations: Optional[int] = None, rounds: int = 3) -> float:
+    """
+    Measures how long one key derivation of a hasher takes on this host.
+
+    Args:
+        sha (SHA256): The hasher.
+        iterations (Optional[int]): The iteration count, defaults to the configured one.
+        rounds (int): The number of measurements, the fastest one is returned.
+
+    Returns:
+        float: The duration of one key derivation in seconds.
+    """
+
+    salt = token_bytes(sha.salt_length)
+
+    durations = []
+    for _ in range(max(1, rounds)):
+        start_time = perf_counter()
+        sha._hash(b"calibration", salt, iterations)
+        durations.append(perf_counter() - start_time)
+
+    return min(durations)
+
+
+def suggest_iterations(sha: SHA256, target_seconds: float,
+                       sample_iterations: int = 20000) -> int:
+    """
+    Suggests the iteration count at which a key derivation of a hasher
+    takes about the target time on this host.
+
+    Args:
+        sha (SHA256): The hasher.
+        target_seconds (float): The target duration of one key derivation.
+        sample_iterations (int): The iteration count used for the measurement.
+
+    Returns:
+        int: The suggested iteration count, rounded to thousands.
+    """
+
+    seconds_per_iteration = measure_hash_time(sha, sample_iterations) / sample_iterations
+    if seconds_per_iteration <= 0:
+        return sha.iterations
+
+    return max(1000, round(target_seconds / seconds_per_iteration / 1000) * 1000)
@@ -5,7 +5,7 @@ This module provides utility functions for validating, converting, and managing
 both IPv4 and IPv6.
 """
 
-from typing import Final, Optional
+from typing import Final, Optional, Tuple
 from re import VERBOSE, IGNORECASE, Pattern, compile as pattern_compile
 
 
@@ -61,6 +61,10 @@ IPV6_PATTERN: Final[str] = r"""
     )$
 """
 
+# Prefix lengths of the networks requests are grouped by, the last is the address itself.
+IPV4_NETWORK_PREFIX_LENGTHS: Final[Tuple[int, ...]] = (24, 32)
+IPV6_NETWORK_PREFIX_LENGTHS: Final[Tuple[int, ...]] = (48, 64, 128)
+
 COMPILED_IPV4_REGEX: Final[Pattern] = pattern_compile(IPV4_PATTERN, VERBOSE | IGNORECASE)
 COMPILED_IPV6_REGEX: Final[Pattern] = pattern_compile(IPV6_PATTERN, VERBOSE | IGNORECASE)
 
@@ -125,16 +129,54 @@ def ipv6_to_int(ipv6_address: str) -> int:
         int: The integer representation of the IPv6 address.
     """
 
-    parts = ipv6_address.split(':')
-    parts = [int(part, 16) if part else 0 for part in parts]
+    if "::" in ipv6_address:
+        head, tail = ipv6_address.split("::", 1)
+        head_parts = head.split(':') if head else []
+        tail_parts = tail.split(':') if tail else []
+
+        parts = head_parts + ["0"] * (8 - len(head_parts) - len(tail_parts)) + tail_parts
+    else:
+        parts = ipv6_address.split(':')
 
     ip_int = 0
     for i, part in enumerate(parts):
-        ip_int += part << (16 * (7 - i))
+        ip_int += int(part, 16) << (16 * (7 - i))
 
     return ip_int
 
 
+def get_ip_networks(ip_address: str) -> list[Tuple[int, str]]:
+    """
+    Returns the networks an IP address belongs to, from the largest to the
+    address itself: the /24 for IPv4 and the /48 and /64 for IPv6.
+
+    Args:
+        ip_address (str): The IP address.
+
+    Returns:
+        list[Tuple[int, str]]: The prefix length and the network, e.g.
+            `(24, "4:c6336400/24")`, or an empty list if the IP address is invalid.
+    """
+
+    if is_ipv4(ip_address):
+        version, bits, prefix_lengths = 4, 32, IPV4_NETWORK_PREFIX_LENGTHS
+        ip_int = ipv4_to_int(ip_address)
+
+    elif is_ipv6(ip_address):
+        version, bits, prefix_lengths = 6, 128, IPV6_NETWORK_PREFIX_LENGTHS
+        ip_int = ipv6_to_int(ip_address)
+
+    else:
+        return []
+
+    networks = []
+    for prefix_length in prefix_lengths:
+        network_int = ip_int >> (bits - prefix_length) << (bits - prefix_length)
+        networks.append((prefix_length, f"{version}:{network_int:x}/{prefix_length}"))
+
+    return networks
+
+
 def is_unwanted_ipv4(ipv4_address: Optional[str] = None) -> bool:
     """
     Checks whether the given IPv4 address is unwanted.
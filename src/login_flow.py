@@ -0,0 +1,245 @@
+"""
+src/login_flow.py
+
+This module provides the login flow record, a Redis hash that follows one login
+from the submitted credentials to the session and records which checks have passed.
+"""
+
+from json import JSONDecodeError, loads as json_loads, dumps as json_dumps
+from typing import Final, Optional
+
+from redis import RedisError
+
+try:
+    from src.logger import log
+    from src.state import STATE_LENGTH, STATE_CREATION_ATTEMPTS, is_valid_state
+    from src.utils import REDIS_CLIENT, generate_random_string
+except (ModuleNotFoundError, ImportError):
+    from logger import log
+    from state import STATE_LENGTH, STATE_CREATION_ATTEMPTS, is_valid_state
+    from utils import REDIS_CLIENT, generate_random_string
+
+
+LOGIN_FLOW_TIME_TO_LIVE: Final[int] = 600 # 10 minutes in seconds
+LOGIN_FLOW_CHECKS: Final[tuple] = ("pow", "captcha", "password", "twofa")
+
+
+class LoginFlow:
+    """
+    A login in progress, stored in the `login_flow:<flow_id>` Redis hash.
+    Passed checks are stored as `passed:<check>` fields, apart from the data
+    of the flow such as the correct images of a captcha.
+
+    The flow is created once the username has been resolved, so the user lookup
+    runs only once per login. The password is never stored: it is verified
+    before the flow is created, or entered again once the captcha has passed.
+    Every check is recorded with a single HSET, and values that may only be
+    used once are claimed inside a transaction.
+
+    Attributes:
+        flow_id (str): The ID of the flow, sent as the `state` form field.
+        user_name (str): The username entered by the user.
+        user_key (bytes): The key of the resolved user.
+        checks (set): The names of the checks that have passed.
+    """
+
+    __slots__ = ("flow_id", "user_name", "user_key", "checks")
+
+    def __init__(self, flow_id: str, fields: dict) -> None:
+        self.flow_id = flow_id
+        self.user_name = fields["user_name"]
+        self.user_key = bytes.fromhex(fields["user_key"])
+
+        self.checks = {
+            check for check in LOGIN_FLOW_CHECKS
+            if fields.get("passed:" + check, None) == "1"
+        }
+
+
+    @property
+    def redis_key(self) -> str:
+        """
+        Returns the name of the Redis hash of the flow.
+        """
+
+        return "login_flow:" + self.flow_id
+
+
+    def has_passed(self, check: str) -> bool:
+        """
+        Checks whether a check of the flow has passed.
+
+        Args:
+            check (str): The name of the check, e.g. "captcha".
+
+        Returns:
+            bool: True if the check has passed, otherwise False.
+        """
+
+        return check in self.checks
+
+
+    def set_passed(self, check: str) -> bool:
+        """
+        Records that a check has passed.
+
+        Args:
+            check (str): The name of the check, e.g. "captcha".
+
+        Returns:
+            bool: True if the check was recorded, otherwise False.
+        """
+
+        try:
+            REDIS_CLIENT.hset(self.redis_key, "passed:" + check, "1")
+        except RedisError:
+            log("Login flow could not be updated.", level = 4)
+            return False
+
+        self.checks.add(check)
+        return True
+
+
+    def set_captcha(self, correct_images: list) -> bool:
+        """
+        Stores the indices of the correct images of a new captcha.
+
+        Args:
+            correct_images (list): The indices of the correct images.
+
+        Returns:
+            bool: True if the captcha was stored, otherwise False.
+        """
+
+        try:
+            REDIS_CLIENT.hset(self.redis_key, "correct_images", json_dumps(correct_images))
+        except RedisError:
+            log("Login flow could not be updated.", level = 4)
+            return False
+
+        return True
+
+
+    def claim_captcha(self) -> Optional[list]:
+        """
+        Reads and removes the indices of the correct images, so every
+        captcha can be answered only once.
+
+        Returns:
+            Optional[list]: The indices of the correct images, or None if
+                there is no unanswered captcha.
+        """
+
+        try:
+            with REDIS_CLIENT.pipeline() as pipeline:
+                pipeline.hget(self.redis_key, "correct_images")
+                pipeline.hdel(self.redis_key, "correct_images")
+                encoded_correct_images, _ = pipeline.execute()
+
+            if not encoded_correct_images:
+                return None
+
+            correct_images = json_loads(encoded_correct_images)
+
+        except (RedisError, JSONDecodeError):
+            log("Login flow captcha could not be claimed.", level = 4)
+            return None
+
+        return correct_images if isinstance(correct_images, list) else None
+
+
+    def finish(self) -> bool:
+        """
+        Deletes the flow. Only the first of several concurrent
+        requests finishing the same flow succeeds.
+
+        Returns:
+            bool: True if this call deleted the flow, otherwise False.
+        """
+
+        try:
+            return REDIS_CLIENT.delete(self.redis_key) == 1
+        except RedisError:
+            log("Login flow could not be deleted.", level = 4)
+
+        return False
+
+
+def create_login_flow(user_name: str, user_key: bytes, is_pow_verified: bool = False,
+                      is_password_verified: bool = False) -> Optional[LoginFlow]:
+    """
+    Creates a login flow for a resolved user.
+
+    Args:
+        user_name (str): The username entered by the user.
+        user_key (bytes): The key of the resolved user.
+        is_pow_verified (bool): Whether a proof of work has already been verified,
+            which replaces the captcha.
+        is_password_verified (bool): Whether the password has already been verified.
+
+    Returns:
+        Optional[LoginFlow]: The created flow, or None if Redis is unavailable
+            or no unused flow ID was found.
+    """
+
+    fields = {
+        "user_name": user_name,
+        "user_key": user_key.hex()
+    }
+    if is_pow_verified:
+        fields["passed:pow"] = "1"
+    if is_password_verified:
+        fields["passed:password"] = "1"
+
+    try:
+        with REDIS_CLIENT.pipeline() as pipeline:
+            for _ in range(STATE_CREATION_ATTEMPTS):
+                flow_id = generate_random_string(STATE_LENGTH, "aA0")
+
+                pipeline.hsetnx("login_flow:" + flow_id, "user_name", user_name)
+                pipeline.expire("login_flow:" + flow_id, LOGIN_FLOW_TIME_TO_LIVE)
+                is_created, _ = pipeline.execute()
+
+                if is_created:
+                    break
+
+            else:
+                log("Login flow ID could not be found.", level = 4)
+                return None
+
+        REDIS_CLIENT.hset("login_flow:" + flow_id, mapping = fields)
+
+    except RedisError:
+        log("Login flow could not be created.", level = 4)
+        return None
+
+    return LoginFlow(flow_id, fields)
+
+
+def get_login_flow(flow_id: Optional[str]) -> Optional[LoginFlow]:
+    """
+    Retrieves a login flow by its ID.
+
+    Args:
+        flow_id (Optional[str]): The ID of the flow.
+
+    Returns:
+        Optional[LoginFlow]: The flow, or None if it does not exist or has expired.
+    """
+
+    if not isinstance(flow_id, str) or not is_valid_state(flow_id):
+        return None
+
+    try:
+        fields = REDIS_CLIENT.hgetall("login_flow:" + flow_id)
+    except RedisError:
+        log("Login flow could not be read.", level = 4)
+        return None
+
+    if not fields.get("user_name", None) or not fields.get("user_key", None):
+        return None
+
+    try:
+        return LoginFlow(flow_id, fields)
+    except ValueError:
+        return None
@@ -0,0 +1,150 @@
+"""
+src/metrics.py
+
+This module provides counters that every worker increments in memory and
+periodically adds to Redis hashes, so they show totals across all workers.
+"""
+
+from os import environ
+from threading import Lock
+from typing import Final, Union, Tuple
+
+from redis import RedisError
+
+try:
+    from src.logger import log
+    from src.utils import REDIS_CLIENT, PeriodicTask
+except (ModuleNotFoundError, ImportError):
+    from logger import log
+    from utils import REDIS_CLIENT, PeriodicTask
+
+
+METRICS_FLUSH_INTERVAL_RAW: str = environ.get("METRICS_FLUSH_INTERVAL", "")
+METRICS_FLUSH_INTERVAL: int = 10
+if METRICS_FLUSH_INTERVAL_RAW.isdigit():
+    METRICS_FLUSH_INTERVAL = int(METRICS_FLUSH_INTERVAL_RAW)
+
+# Upper bounds in seconds of the buckets of latency histograms.
+LATENCY_BUCKETS: Final[Tuple[float, ...]] = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Metrics:
+    """
+    Counters grouped by name and stored in the `metrics:<group>` Redis hashes.
+
+    Increments only touch a dictionary in memory; a background thread adds
+    them to Redis every `flush_interval` seconds in one pipeline.
+
+    Attributes:
+        flush_interval (int): The number of seconds between two flushes.
+    """
+
+
+    def __init__(self, flush_interval: int = METRICS_FLUSH_INTERVAL) -> None:
+        self.flush_interval = flush_interval
+
+        self._lock = Lock()
+        self._counters: dict[Tuple[str, str], Union[int, float]] = {}
+        self._flusher = PeriodicTask(self.flush, flush_interval)
+
+
+    def increment(self, group: str, name: str, amount: Union[int, float] = 1) -> None:
+        """
+        Increments a counter.
+
+        Args:
+            group (str): The group of the counter, e.g. "sessions".
+            name (str): The name of the counter within the group.
+            amount (Union[int, float]): The amount to add.
+        """
+
+        if not amount:
+            return
+
+        with self._lock:
+            self._counters[(group, name)] = self._counters.get((group, name), 0) + amount
+
+        self._flusher.start()
+
+
+    def observe(self, group: str, name: str, value: float,
+                buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """
+        Records a value in a histogram, stored as the counters `<name>_le_<bound>`
+        of the first bucket whose upper bound is not below the value (or
+        `<name>_le_inf`), `<name>_count` and `<name>_sum`.
+
+        Args:
+            group (str): The group of the histogram, e.g. "ip_reputation".
+            name (str): The name of the histogram within the group.
+            value (float): The value to record, e.g. a latency in seconds.
+            buckets (Tuple[float, ...]): The ascending upper bounds of the buckets.
+        """
+
+        bound = next((str(bound) for bound in buckets if value <= bound), "inf")
+
+        self.increment(group, f"{name}_le_{bound}")
+        self.increment(group, name + "_count")
+        self.increment(group, name + "_sum", float(value))
+
+
+    def flush(self) -> bool:
+        """
+        Adds the counters of this process to Redis and resets them.
+
+        Returns:
+            bool: True if the counters were written, otherwise False.
+        """
+
+        with self._lock:
+            counters, self._counters = self._counters, {}
+
+        if not counters:
+            return True
+
+        try:
+            with REDIS_CLIENT.pipeline(transaction = False) as pipeline:
+                for (group, name), amount in counters.items():
+                    if isinstance(amount, float):
+                        pipeline.hincrbyfloat("metrics:" + group, name, amount)
+                    else:
+                        pipeline.hincrby("metrics:" + group, name, amount)
+
+                pipeline.execute()
+
+        except RedisError:
+            log("Metrics could not be written.", level = 3)
+
+            with self._lock:
+                for counter, amount in counters.items():
+                    self._counters[counter] = self._counters.get(counter, 0) + amount
+
+            return False
+
+        return True
+
+
+    def get(self, group: str) -> dict[str, Union[int, float]]:
+        """
+        Retrieves the totals of a group from Redis.
+
+        Args:
+            group (str): The group of the counters.
+
+        Returns:
+            dict[str, Union[int, float]]: The counters by name.
+        """
+
+        try:
+            fields = REDIS_CLIENT.hgetall("metrics:" + group)
+        except RedisError:
+            log("Metrics could not be read.", level = 3)
+            return {}
+
+        return {
+            name: int(value) if value.lstrip("-").isdigit() else float(value)
+            for name, value in fields.items()
+        }
+
+
+METRICS: Final[Metrics] = Metrics()
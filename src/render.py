@@ -14,17 +14,17 @@ from flask import Response, request, send_file
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
 try:
-    from src.state import create_state
+    from src.login_flow import LoginFlow
     from src.request import get_domain_host
-    from src.captcha import generate_powbox_challenge, create_captcha
+    from src.captcha import generate_powbox_challenge, generate_captcha
     from src.utils import TEMPLATES_DIRECTORY_PATH, FAVICON_FILE_PATH, Error, read_text, load_dotenv
     from src.localisation import (
         LANGUAGES, get_language, get_translations, translate_text, translate_error
     )
 except ModuleNotFoundError:
-    from state import create_state
+    from login_flow import LoginFlow
     from request import get_domain_host
-    from captcha import generate_powbox_challenge, create_captcha
+    from captcha import generate_powbox_challenge, generate_captcha
     from utils import TEMPLATES_DIRECTORY_PATH, FAVICON_FILE_PATH, Error, read_text, load_dotenv
     from localisation import (
         LANGUAGES, get_language, get_translations, translate_text, translate_error
@@ -261,7 +261,8 @@ def render_robots() -> Response:
 
 def render_login(user_name: Optional[str] = None,
                  password: Optional[str] = None,
-                 error: Optional[Error] = None) -> str:
+                 error: Optional[Error] = None,
+                 state: Optional[str] = None) -> str:
     """
     Render the login page.
 
@@ -269,6 +270,8 @@ def render_login(user_name: Optional[str] = None,
         user_name (Optional[str]): The username entered by the user. Defaults to None.
         password (Optional[str]): The password entered by the user. Defaults to None.
         error (Optional[Error]): An optional error message to display. Defaults to None.
+        state (Optional[str]): The ID of a login flow that waits for the password.
+            Defaults to None.
 
     Returns:
         str: The rendered HTML of the login page.
@@ -278,7 +281,7 @@ def render_login(user_name: Optional[str] = None,
 
     return render_template(
         "login", error = error, user_name = user_name, password = password,
-        powbox_challenge = powbox_challenge, powbox_state = powbox_state
+        state = state, powbox_challenge = powbox_challenge, powbox_state = powbox_state
     )
 
 
@@ -309,47 +312,37 @@ def render_signup(user_name: Optional[str] = None,
     )
 
 
-def render_captcha(user_name: str, password: str, error: Optional[Error] = None) -> str:
+def render_captcha(login_flow: LoginFlow, error: Optional[Error] = None) -> str:
     """
-    Render the CAPTCHA page.
+    Render the CAPTCHA page of a login flow.
 
     Args:
-        user_name (str): The username entered by the user.
-        password (str): The password entered by the user.
+        login_flow (LoginFlow): The login flow, which stores the correct images.
         error (Optional[Error]): An optional error message to display. Defaults to None.
 
     Returns:
         str: The rendered HTML of the CAPTCHA page.
     """
 
-    images, state = create_captcha(
-        {"user_name": user_name, "password": password}
-    )
+    images, correct_images = generate_captcha()
+    login_flow.set_captcha(correct_images)
 
     return render_template(
         "captcha", images = images,
-        state = state, error = error
+        state = login_flow.flow_id, error = error
     )
 
 
-def render_twofa(user_name: str, password: str, error: Optional[Error] = None) -> str:
+def render_twofa(login_flow: LoginFlow, error: Optional[Error] = None) -> str:
     """
-    Render the two-factor authentication (2FA) page.
+    Render the two-factor authentication (2FA) page of a login flow.
 
     Args:
-        user_name (str): The username entered by the user.
-        password (str): The password entered by the user.
+        login_flow (LoginFlow): The login flow.
         error (Optional[Error]): An optional error message to display. Defaults to None.
 
     Returns:
         str: The rendered HTML of the two-factor authentication page.
     """
 
-    state = create_state(
-        "twofa", {
-            "user_name": user_name,
-            "password": password
-        }
-    )
-
-    return render_template("twofa", state = state, error = error)
+    return render_template("twofa", state = login_flow.flow_id, error = error)
@@ -5,26 +5,71 @@ This module provides functionality for managing state strings in a web applicati
 including creating, validating, and retrieving state data.
 """
 
-from typing import Final, Tuple, Optional
+from os import environ
+from time import time
+from struct import Struct, error as StructError
+from typing import Final, Tuple, Optional, Any
 from re import Pattern, compile as pattern_compile, match
-from json import loads as json_loads, dumps as json_dumps
+
+from redis import RedisError, ResponseError
+from redis.commands.core import Script
 
 try:
     from src.logger import log
-    from src.crypto import SHA256, Base62
-    from src.utils import REDIS_CLIENT, generate_random_string
+    from src.metrics import METRICS
+    from src.crypto import Base62, SealedBox, hmac_sha256
+    from src.state_codec import encode_state, decode_state
+    from src.utils import (
+        REDIS_BYTES_CLIENT, LRUCache, generate_random_string, load_secret_key
+    )
 except (ModuleNotFoundError, ImportError):
     from logger import log
-    from crypto import SHA256, Base62
-    from utils import REDIS_CLIENT, generate_random_string
+    from metrics import METRICS
+    from crypto import Base62, SealedBox, hmac_sha256
+    from state_codec import encode_state, decode_state
+    from utils import (
+        REDIS_BYTES_CLIENT, LRUCache, generate_random_string, load_secret_key
+    )
 
 
 STATE_LENGTH: Final[int] = 32
 STATE_BASE62_PATTERN: Final[Pattern] = pattern_compile(r"^[0-9A-Za-z]+$")
 
-SHA256_BEAM: Final[SHA256] = SHA256(
-    10000, hash_length = 15, salt_length = 0
-)
+BEAM_ID_KEY: Final[bytes] = load_secret_key("beam_id")
+BEAM_ID_LENGTH: Final[int] = 20
+
+BEAM_ID_CACHE_SIZE_RAW: str = environ.get("BEAM_ID_CACHE_SIZE", "")
+BEAM_ID_CACHE_SIZE: int = 10000
+if BEAM_ID_CACHE_SIZE_RAW.isdigit():
+    BEAM_ID_CACHE_SIZE = int(BEAM_ID_CACHE_SIZE_RAW)
+BEAM_ID_CACHE: Final[LRUCache] = LRUCache(BEAM_ID_CACHE_SIZE)
+
+STATE_CREATION_ATTEMPTS: Final[int] = 5
+
+# GETDEL needs Redis 6.2, older versions fall back to this script.
+GETDEL_SCRIPT: Final[Script] = REDIS_BYTES_CLIENT.register_script("""
+local value = redis.call("GET", KEYS[1])
+if value then
+    redis.call("DEL", KEYS[1])
+end
+return value
+""")
+IS_GETDEL_SUPPORTED: bool = True
+
+STATE_BACKEND_RAW: str = environ.get("STATE_BACKEND", "").lower()
+STATE_BACKEND: str = "redis"
+if STATE_BACKEND_RAW in ("redis", "sealed"):
+    STATE_BACKEND = STATE_BACKEND_RAW
+
+# Short-lived states without secrets, which the sealed backend hands to the
+# client instead of storing them. Sessions stay in Redis so they can be revoked.
+SEALABLE_STATES: Final[Tuple[str, ...]] = ("pow", "browser_checked")
+SEALED_STATE_VERSION: Final[int] = 1
+SEALED_STATE_HEADER: Final[Struct] = Struct(">BI") # version, expiry
+# Sealed pow and browser_checked states are about 140 characters long. Longer
+# strings are refused before decoding, as Base62 decoding is quadratic.
+SEALED_STATE_MAX_LENGTH: Final[int] = 256
+STATE_SEALING_BOX: Final[SealedBox] = SealedBox(load_secret_key("state_sealing"))
 
 DEFAULT_TIME_TO_LIVE: Final[int] = 600 # 10 minutes in seconds
 TIME_TO_LIVE: Final[dict[str, int]] = {
@@ -65,78 +110,273 @@ def is_valid_state(state: str) -> bool:
     return bool(match(STATE_BASE62_PATTERN, state))
 
 
-def create_state(state_name: str, data: dict) -> str:
+def seal_state(encoded_data: bytes, time_to_live: int) -> Optional[str]:
     """
-    Creates an encrypted state string with improved atomicity.
+    Seals the data of a state into a state string that carries its own
+    expiry, so it does not have to be stored.
+
+    Args:
+        encoded_data (bytes): The encoded data of the state.
+        time_to_live (int): The number of seconds the state is valid.
+
+    Returns:
+        Optional[str]: The sealed state string, which is longer than a stored one.
     """
 
-    data["state"] = state_name
-    serialized_data = json_dumps(data)
+    header = SEALED_STATE_HEADER.pack(SEALED_STATE_VERSION, int(time()) + time_to_live)
 
-    pipeline = REDIS_CLIENT.pipeline()
+    sealed_data = STATE_SEALING_BOX.encrypt(encoded_data, header)
+    if not sealed_data:
+        return None
 
-    while True:
-        state_key = generate_random_string(STATE_LENGTH, "aA0")
+    return Base62.encode(header + sealed_data)
 
-        pipeline.watch(f"state:{state_key}")
 
-        if not REDIS_CLIENT.exists(f"state:{state_key}"):
-            ttl = get_time_to_live(state_name)
+def open_sealed_state(state: str) -> Tuple[Optional[bytes], int, bytes]:
+    """
+    Opens a sealed state string.
 
-            pipeline.multi()
-            pipeline.setex(f"state:{state_key}", ttl, serialized_data)
+    Args:
+        state (str): The sealed state string.
 
-            try:
-                pipeline.execute()
-                return state_key
-            except Exception as e:
-                log(f"State creation transaction failed: {e}", level=4)
+    Returns:
+        Tuple[Optional[bytes], int, bytes]: The encoded data of the state or None if the
+            state is not authentic or expired, the expiry time and the authentication
+            tag, which identifies the state for replay protection.
+    """
 
-        pipeline.reset()
+    if len(state) > SEALED_STATE_MAX_LENGTH:
+        return None, 0, b""
 
+    sealed_state = Base62.decode(state)
+    if not sealed_state or len(sealed_state) <= SEALED_STATE_HEADER.size:
+        return None, 0, b""
 
-def get_state(state: str, single_use: bool = False) -> Tuple[Optional[str], dict]:
+    header = sealed_state[:SEALED_STATE_HEADER.size]
+    try:
+        version, expires_at = SEALED_STATE_HEADER.unpack(header)
+    except StructError:
+        return None, 0, b""
+
+    if version != SEALED_STATE_VERSION or expires_at <= time():
+        return None, 0, b""
+
+    sealed_data = sealed_state[SEALED_STATE_HEADER.size:]
+
+    plain_data = STATE_SEALING_BOX.decrypt(sealed_data, header)
+    if plain_data is None:
+        return None, 0, b""
+
+    return plain_data, expires_at, sealed_data[-SealedBox.TAG_LENGTH:]
+
+
+def create_states(states: list[Tuple[str, dict]]) -> list[Optional[str]]:
     """
-    Retrieves data from a state string.
+    Creates several states in one Redis round trip.
+
+    Every state key is claimed with `SET NX EX`, only keys that
+    already exist are retried with a new random key. With the sealed
+    backend, sealable states are created without Redis.
 
     Args:
-        state (str): The state string.
-        single_use (bool): Whether to treat the state as single-use.
+        states (list[Tuple[str, dict]]): The name and the data of every state.
 
     Returns:
-        Tuple[Optional[str], dict]: A tuple containing the state name and decoded data.
+        list[Optional[str]]: The state strings in the same order, None for
+            every state that could not be created.
     """
 
-    if not is_valid_state(state):
-        return None, {}
+    encoded_states = []
+    state_keys: list[Optional[str]] = [None] * len(states)
+    pending_indexes = []
+
+    for index, (state_name, data) in enumerate(states):
+        encoded_states.append((encode_state(state_name, data), get_time_to_live(state_name)))
+
+        if STATE_BACKEND == "sealed" and state_name in SEALABLE_STATES:
+            state_keys[index] = seal_state(*encoded_states[index])
+        else:
+            pending_indexes.append(index)
 
     try:
-        redis_data = REDIS_CLIENT.get(f"state:{state}")
+        for _ in range(STATE_CREATION_ATTEMPTS):
+            if not pending_indexes:
+                break
+
+            candidates = [
+                generate_random_string(STATE_LENGTH, "aA0")
+                for _ in pending_indexes
+            ]
+
+            with REDIS_BYTES_CLIENT.pipeline(transaction = False) as pipeline:
+                for index, state_key in zip(pending_indexes, candidates):
+                    encoded_data, ttl = encoded_states[index]
+                    pipeline.set("state:" + state_key, encoded_data, nx = True, ex = ttl)
+
+                results = pipeline.execute()
+
+            colliding_indexes = []
+            for index, state_key, is_created in zip(pending_indexes, candidates, results):
+                if is_created:
+                    state_keys[index] = state_key
+                else:
+                    colliding_indexes.append(index)
+
+            pending_indexes = colliding_indexes
+
+    except RedisError:
+        log("States could not be created.", level = 4)
+
+    return state_keys
+
+
+def create_state(state_name: str, data: dict) -> Optional[str]:
+    """
+    Creates a state string that references the data stored in Redis.
+
+    Args:
+        state_name (str): The name of the state, e.g. "pow".
+        data (dict): The data of the state.
+
+    Returns:
+        Optional[str]: The state string, or None if it could not be created.
+    """
+
+    return create_states([(state_name, data)])[0]
+
+
+def read_state_values(state_keys: list[Tuple[str, bool]],
+                      replay_keys: Optional[list[Tuple[str, int]]] = None) -> list[Any]:
+    """
+    Reads the stored values of several states in one pipeline, deleting
+    single-use states in the same command so that only one reader gets them.
 
-        if not redis_data:
-            return None, {}
+    Args:
+        state_keys (list[Tuple[str, bool]]): The Redis key of every state and
+            whether it is single-use.
+        replay_keys (Optional[list[Tuple[str, int]]]): The replay key and the
+            remaining lifetime of every sealed single-use state to claim.
+
+    Returns:
+        list[Any]: The stored values, None for missing states, followed by
+            whether each replay key was claimed for the first time.
+
+    Raises:
+        RedisError: If the states could not be read.
+    """
+
+    global IS_GETDEL_SUPPORTED
+
+    with REDIS_BYTES_CLIENT.pipeline(transaction = False) as pipeline:
+        for state_key, single_use in state_keys:
+            if not single_use:
+                pipeline.get(state_key)
+            elif IS_GETDEL_SUPPORTED:
+                pipeline.getdel(state_key)
+            else:
+                GETDEL_SCRIPT(keys = [state_key], client = pipeline)
+
+        for replay_key, time_to_live in replay_keys or []:
+            pipeline.set(replay_key, "1", nx = True, ex = time_to_live)
+
+        try:
+            return pipeline.execute()
+
+        except ResponseError as exc:
+            if not IS_GETDEL_SUPPORTED or "getdel" not in str(exc).lower():
+                raise
+
+    log("GETDEL is not supported by Redis, using a script instead.", level = 2)
+    IS_GETDEL_SUPPORTED = False
+
+    return read_state_values(state_keys, replay_keys)
+
+
+def get_states(states: list[Tuple[Optional[str], bool]]) -> list[Tuple[Optional[str], dict]]:
+    """
+    Retrieves the data of several state strings in one Redis round trip.
+
+    With the sealed backend, sealed states are opened locally, only single-use
+    ones are claimed in Redis so that each of them can be used once. Other
+    backends only accept state strings of `STATE_LENGTH` characters.
+
+    Args:
+        states (list[Tuple[Optional[str], bool]]): Every state string, or None,
+            and whether to treat it as single-use.
+
+    Returns:
+        list[Tuple[Optional[str], dict]]: The state name and decoded data of every
+            state in the same order, `(None, {})` for invalid or missing states.
+    """
+
+    encoded_states: list[Optional[bytes]] = [None] * len(states)
 
-        decoded_data = json_loads(redis_data)
-    except Exception:
-        log("Error while getting and loading state data in get_state.", level = 4)
-        return None, {}
+    indexes, state_keys = [], []
+    replay_indexes, replay_keys = [], []
 
-    state_name = decoded_data.get("state", None)
+    for index, (state, single_use) in enumerate(states):
+        if not isinstance(state, str) or len(state) > SEALED_STATE_MAX_LENGTH \
+            or not match(STATE_BASE62_PATTERN, state):
+            continue
 
-    if single_use:
-        REDIS_CLIENT.delete(f"state:{state}")
+        if len(state) == STATE_LENGTH:
+            indexes.append(index)
+            state_keys.append(("state:" + state, single_use))
+            continue
 
-    for key in ["state", "single_use", "time"]:
-        if key in decoded_data:
-            decoded_data.pop(key)
+        if STATE_BACKEND != "sealed":
+            continue
 
-    return state_name, decoded_data
+        encoded_data, expires_at, tag = open_sealed_state(state)
+        if encoded_data is None:
+            continue
+
+        encoded_states[index] = encoded_data
+        if single_use:
+            replay_indexes.append(index)
+            replay_keys.append(("state_replay:" + tag.hex(), max(expires_at - int(time()), 1)))
+
+    if state_keys or replay_keys:
+        try:
+            redis_values = read_state_values(state_keys, replay_keys)
+        except RedisError:
+            log("States could not be read.", level = 4)
+            return [(None, {}) for _ in states]
+
+        for index, redis_data in zip(indexes, redis_values):
+            encoded_states[index] = redis_data
+
+        for index, is_first_use in zip(replay_indexes, redis_values[len(state_keys):]):
+            if not is_first_use:
+                encoded_states[index] = None
+
+    return [decode_state(encoded_data) for encoded_data in encoded_states]
+
+
+def get_state(state: str, single_use: bool = False) -> Tuple[Optional[str], dict]:
+    """
+    Retrieves data from a state string.
+
+    Args:
+        state (str): The state string.
+        single_use (bool): Whether to treat the state as single-use.
+
+    Returns:
+        Tuple[Optional[str], dict]: A tuple containing the state name and decoded data.
+    """
+
+    return get_states([(state, single_use)])[0]
 
 
 def get_beam_id(identifiable_information: list) -> Optional[str]:
     """
     Generate a Beam ID from a list of identifiable information.
 
+    The Beam ID is a keyed HMAC of the information, so it is cheap to compute
+    but cannot be linked to the information without the server secret. Recent
+    Beam IDs are cached per worker, as the same clients request the browser
+    check again and again.
+
     Args:
         identifiable_information (list): A list of strings containing identifiable
             information that will be concatenated and hashed.
@@ -145,21 +385,27 @@ def get_beam_id(identifiable_information: list) -> Optional[str]:
         Optional[str]: A Beam ID that is 20 characters long, padded with "=" if necessary.
     """
 
+    cache_key = tuple(identifiable_information)
+
+    beam_id = BEAM_ID_CACHE.get(cache_key)
+    METRICS.increment("beam_id_cache", "misses" if beam_id is None else "hits")
+    if beam_id is not None:
+        return beam_id
+
     identifiable_information_str = ""
     for information in identifiable_information:
         if isinstance(information, str):
             identifiable_information_str += information
 
-    beam_id_hash = SHA256_BEAM.hash(identifiable_information_str)
+    beam_id_hash = hmac_sha256(BEAM_ID_KEY, identifiable_information_str)
     if not isinstance(beam_id_hash, bytes):
         return None
 
-    beam_id = Base62.encode(beam_id_hash)
+    beam_id = Base62.encode(beam_id_hash[:15])
     if not beam_id:
         return None
 
-    beam_id = beam_id[:20]
-    while len(beam_id) < 20:
-        beam_id += "="
+    beam_id = beam_id[:BEAM_ID_LENGTH].ljust(BEAM_ID_LENGTH, "=")
 
+    BEAM_ID_CACHE.set(cache_key, beam_id)
     return beam_id
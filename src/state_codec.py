@@ -0,0 +1,197 @@
+"""
+src/state_codec.py
+
+This module provides a compact binary encoding for state payloads, based on a
+registry of schemas that lists the fields of every state type.
+"""
+
+from typing import Final, Tuple, Optional
+from json import JSONDecodeError, loads as json_loads, dumps as json_dumps
+
+try:
+    from src.logger import log
+except (ModuleNotFoundError, ImportError):
+    from logger import log
+
+
+STATE_CODEC_VERSION: Final[int] = 1
+
+# Maps every schema ID to its state type and fields. Field types are "str"
+# (UTF-8 with a varint length), "uint" (a varint) and "uints" (a varint count
+# followed by varints). IDs must never be reused; to change the fields of a
+# state type, add a new schema, the one with the highest ID is used to encode.
+# Removed IDs stay reserved: 4 was "captcha_oneclick", which the login flow replaced.
+STATE_SCHEMAS: Final[dict[int, Tuple[str, Tuple[Tuple[str, str], ...]]]] = {
+    1: ("pow", (("challenge", "str"),)),
+    2: ("browser_checked", (("ip", "str"),)),
+    3: ("session", (
+        ("session_id", "str"), ("session_token", "str"), ("user_name", "str")
+    )),
+    5: ("browser_checked", (("ip", "str"), ("expires", "uint"))),
+}
+STATE_SCHEMAS_BY_NAME: Final[dict[str, Tuple[int, Tuple[Tuple[str, str], ...]]]] = {
+    state_name: (schema_id, fields)
+    for schema_id, (state_name, fields) in sorted(STATE_SCHEMAS.items())
+}
+
+IGNORED_JSON_KEYS: Final[Tuple[str, ...]] = ("state", "single_use", "time")
+
+
+def encode_varint(number: int) -> bytes:
+    """
+    Encodes a non-negative integer as an unsigned LEB128 varint.
+
+    Args:
+        number (int): The integer to encode.
+
+    Returns:
+        bytes: The varint, one byte for numbers below 128.
+    """
+
+    encoded = bytearray()
+    while number > 0x7F:
+        encoded.append((number & 0x7F) | 0x80)
+        number >>= 7
+
+    encoded.append(number)
+    return bytes(encoded)
+
+
+def decode_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """
+    Decodes an unsigned LEB128 varint.
+
+    Args:
+        data (bytes): The encoded data.
+        offset (int): The position of the varint in the data.
+
+    Returns:
+        Tuple[int, int]: The integer and the position after the varint.
+
+    Raises:
+        IndexError: If the data ends within the varint.
+    """
+
+    number, shift = 0, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, offset
+
+        shift += 7
+
+
+def encode_state(state_name: str, data: dict) -> bytes:
+    """
+    Encodes the payload of a state. States without a schema, or whose data
+    does not match it, are encoded as JSON with the state name.
+
+    Args:
+        state_name (str): The name of the state, e.g. "pow".
+        data (dict): The data of the state.
+
+    Returns:
+        bytes: The encoded payload.
+    """
+
+    schema = STATE_SCHEMAS_BY_NAME.get(state_name, None)
+    if schema is not None and len(data) == len(schema[1]):
+        schema_id, fields = schema
+
+        encoded = bytearray((STATE_CODEC_VERSION, schema_id))
+        for field_name, field_type in fields:
+            value = data.get(field_name, None)
+
+            if field_type == "str" and isinstance(value, str):
+                encoded_value = value.encode("utf-8")
+                encoded += encode_varint(len(encoded_value)) + encoded_value
+
+            elif field_type == "uint" and isinstance(value, int) and value >= 0:
+                encoded += encode_varint(value)
+
+            elif field_type == "uints" and isinstance(value, list) and all(
+                isinstance(number, int) and number >= 0 for number in value):
+
+                encoded += encode_varint(len(value))
+                for number in value:
+                    encoded += encode_varint(number)
+
+            else:
+                break
+
+        else:
+            return bytes(encoded)
+
+    return json_dumps(dict(data, state = state_name)).encode("utf-8")
+
+
+def decode_state(encoded: Optional[bytes]) -> Tuple[Optional[str], dict]:
+    """
+    Decodes the payload of a state, in the binary format or as JSON
+    from before the binary format existed.
+
+    Args:
+        encoded (Optional[bytes]): The encoded payload.
+
+    Returns:
+        Tuple[Optional[str], dict]: The state name and decoded data, or
+            `(None, {})` if the payload is invalid.
+    """
+
+    if not encoded:
+        return None, {}
+
+    if encoded[0] != STATE_CODEC_VERSION:
+        try:
+            decoded_data = json_loads(encoded)
+        except (JSONDecodeError, UnicodeDecodeError):
+            log("State data could not be decoded.", level = 4)
+            return None, {}
+
+        if not isinstance(decoded_data, dict):
+            return None, {}
+
+        state_name = decoded_data.get("state", None)
+        for key in IGNORED_JSON_KEYS:
+            decoded_data.pop(key, None)
+
+        return state_name, decoded_data
+
+    schema = STATE_SCHEMAS.get(encoded[1], None) if len(encoded) > 1 else None
+    if schema is None:
+        return None, {}
+
+    state_name, fields = schema
+
+    decoded_data, offset = {}, 2
+    try:
+        for field_name, field_type in fields:
+            number, offset = decode_varint(encoded, offset)
+
+            if field_type == "uint":
+                decoded_data[field_name] = number
+
+            elif field_type == "str":
+                if offset + number > len(encoded):
+                    return None, {}
+
+                decoded_data[field_name] = encoded[offset:offset + number].decode("utf-8")
+                offset += number
+
+            else:
+                decoded_data[field_name] = []
+                for _ in range(number):
+                    item, offset = decode_varint(encoded, offset)
+                    decoded_data[field_name].append(item)
+
+    except (IndexError, UnicodeDecodeError):
+        log("State data could not be decoded.", level = 4)
+        return None, {}
+
+    if offset != len(encoded):
+        return None, {}
+
+    return state_name, decoded_data
@@ -0,0 +1,2175 @@
+"""
+src/storage.py
+
+This module provides the storage engines for user accounts and their sessions,
+a pickle file that is kept in memory, a shared SQLite database and Redis hashes.
+"""
+
+from time import sleep
+from abc import ABC, abstractmethod
+from hashlib import sha256
+from heapq import heappush, heappop
+from os import path, getpid, environ, rename, makedirs
+from threading import Lock, Thread
+from typing import Final, Optional, Union, Tuple, Any
+from base64 import b64encode, b64decode
+from sqlite3 import Connection, Error as SQLiteError, connect
+from json import JSONDecodeError, loads as json_loads, dumps as json_dumps
+
+from redis import RedisError
+
+try:
+    from src.logger import log
+    from src.utils import (
+        REDIS_CLIENT, DATA_DIRECTORY_PATH, LRUCache, JournaledPickleFile,
+        load_dotenv, read_bytes, write_bytes
+    )
+except (ModuleNotFoundError, ImportError):
+    from logger import log
+    from utils import (
+        REDIS_CLIENT, DATA_DIRECTORY_PATH, LRUCache, JournaledPickleFile,
+        load_dotenv, read_bytes, write_bytes
+    )
+
+
+load_dotenv()
+USER_STORAGE: Final[str] = environ.get("USER_STORAGE", "pickle").strip().lower()
+
+USER_CACHE_SIZE_RAW: str = environ.get("USER_CACHE_SIZE", "")
+USER_CACHE_SIZE: int = 10000
+if USER_CACHE_SIZE_RAW.isdigit():
+    USER_CACHE_SIZE = int(USER_CACHE_SIZE_RAW)
+
+USER_INVALIDATION_CHANNEL: Final[str] = "users:invalidate"
+
+JOURNAL_COMPACTION_SIZE_RAW: str = environ.get("JOURNAL_COMPACTION_SIZE", "")
+JOURNAL_COMPACTION_SIZE: int = 4 * 1024 * 1024
+if JOURNAL_COMPACTION_SIZE_RAW.isdigit():
+    JOURNAL_COMPACTION_SIZE = int(JOURNAL_COMPACTION_SIZE_RAW)
+
+USERS_FILE_PATH: Final[str] = path.join(
+    DATA_DIRECTORY_PATH, "users.pkl"
+)
+USERS_DATABASE_FILE_PATH: Final[str] = path.join(
+    DATA_DIRECTORY_PATH, "users.db"
+)
+AVATARS_DIRECTORY_PATH: Final[str] = path.join(
+    DATA_DIRECTORY_PATH, "avatars"
+)
+
+USER_FIELDS: Final[tuple] = (
+    "password", "user_name_index", "display_name", "avatar", "twofa_token"
+)
+SESSION_FIELDS: Final[tuple] = ("token", "os", "browser", "ip", "time")
+
+
+class BlobStore:
+    """
+    A content-addressed store that keeps every blob in a file named after
+    the SHA-256 digest of its content.
+
+    Records only hold the digest, and the content is read from disk when it
+    is needed, so large values such as avatars do not stay in memory.
+
+    Attributes:
+        directory_path (str): The directory containing the blob files.
+    """
+
+
+    def __init__(self, directory_path: str) -> None:
+        self.directory_path = directory_path
+
+
+    def _get_file_path(self, digest: str) -> Optional[str]:
+        if len(digest) != 64 or not all(char in "0123456789abcdef" for char in digest):
+            return None
+
+        return path.join(self.directory_path, digest)
+
+
+    def put(self, data: bytes) -> Optional[str]:
+        """
+        Stores a blob unless a blob with the same content exists.
+
+        Args:
+            data (bytes): The content of the blob.
+
+        Returns:
+            Optional[str]: The hex SHA-256 digest of the content, or None
+                if the blob could not be written.
+        """
+
+        digest = sha256(data).hexdigest()
+
+        file_path = path.join(self.directory_path, digest)
+        if path.isfile(file_path):
+            return digest
+
+        makedirs(self.directory_path, exist_ok = True)
+
+        temporary_file_path = f"{file_path}.{getpid()}.tmp"
+        if not write_bytes(data, temporary_file_path):
+            return None
+
+        try:
+            rename(temporary_file_path, file_path)
+        except OSError:
+            log(f"`{file_path}` could not be written.", level = 4)
+            return None
+
+        return digest
+
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """
+        Reads a blob.
+
+        Args:
+            digest (str): The hex SHA-256 digest of the content.
+
+        Returns:
+            Optional[bytes]: The content of the blob, or None if it does not exist.
+        """
+
+        file_path = self._get_file_path(digest)
+        if file_path is None or not path.isfile(file_path):
+            return None
+
+        return read_bytes(file_path)
+
+
+AVATARS: Final[BlobStore] = BlobStore(AVATARS_DIRECTORY_PATH)
+
+
+def store_avatar(user_data: dict) -> bool:
+    """
+    Moves an avatar stored inline in a user record into the avatar store
+    and replaces it with its digest.
+
+    Args:
+        user_data (dict): A dictionary containing user information.
+
+    Returns:
+        bool: True if the record was changed, otherwise False.
+    """
+
+    avatar = user_data.get("avatar", None)
+    if not isinstance(avatar, bytes):
+        return False
+
+    avatar_digest = AVATARS.put(avatar)
+    if avatar_digest is None:
+        return False
+
+    user_data["avatar"] = avatar_digest
+    return True
+
+
+class BaseUsers(ABC):
+    """
+    The interface of the user storage engines, which store user records by the
+    hashed username together with their sessions and the indexes over them.
+    """
+
+
+    @abstractmethod
+    def get_key(self, user_name_index: bytes) -> Optional[bytes]:
+        """
+        Retrieves the key of a user by the blind index of the username.
+
+        Args:
+            user_name_index (bytes): The blind index of the username.
+
+        Returns:
+            Optional[bytes]: The key representing the hashed user name,
+                or None if no user has this index.
+        """
+
+
+    @abstractmethod
+    def get_unindexed_keys(self) -> list[bytes]:
+        """
+        Retrieves the keys of users stored before blind indexes existed.
+
+        Returns:
+            list[bytes]: The keys representing the hashed user names.
+        """
+
+
+    @abstractmethod
+    def has_unindexed_keys(self) -> bool:
+        """
+        Checks whether any users were stored before blind indexes existed.
+
+        Returns:
+            bool: True if there is at least one such user, or if the store
+                could not be read, otherwise False.
+        """
+
+
+    @abstractmethod
+    def get_user_name_indexes(self) -> Optional[list[bytes]]:
+        """
+        Retrieves the username blind indexes of all indexed users.
+
+        Returns:
+            Optional[list[bytes]]: The blind indexes of the usernames,
+                or None if they could not be read.
+        """
+
+
+    @abstractmethod
+    def get_session_user_key(self, session_key: bytes) -> Optional[bytes]:
+        """
+        Retrieves the key of the user that owns a session.
+
+        Args:
+            session_key (bytes): The key representing the session id.
+
+        Returns:
+            Optional[bytes]: The key representing the hashed user name,
+                or None if no user has this session.
+        """
+
+
+    @abstractmethod
+    def get_sessions_by_ip(self, ip_address: str) -> list[Tuple[bytes, bytes]]:
+        """
+        Retrieves all sessions created from an IP address.
+
+        Args:
+            ip_address (str): The IP address.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the sessions.
+        """
+
+
+    @abstractmethod
+    def get_sessions_by_user_agent(self, operating_system: Optional[str],
+                                   browser: Optional[str]) -> list[Tuple[bytes, bytes]]:
+        """
+        Retrieves all sessions created with an operating system and browser.
+
+        Args:
+            operating_system (Optional[str]): The operating system, see `get_os_and_browser`.
+            browser (Optional[str]): The browser, see `get_os_and_browser`.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the sessions.
+        """
+
+
+    @abstractmethod
+    def add_session(self, key: bytes, session_key: bytes, session_data: dict) -> bool:
+        """
+        Adds a session to a user.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the hashed session id.
+            session_data (dict): A dictionary containing session information.
+
+        Returns:
+            bool: True if the session was added, False otherwise.
+        """
+
+
+    @abstractmethod
+    def remove_session(self, key: bytes, session_key: bytes) -> bool:
+        """
+        Removes a session from a user.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the session id.
+
+        Returns:
+            bool: True if the session existed and was removed, False otherwise.
+        """
+
+
+    @abstractmethod
+    def expire_sessions(self, before: int, limit: int = 1000) -> list[Tuple[bytes, bytes]]:
+        """
+        Removes sessions created before a point in time, oldest first.
+
+        Args:
+            before (int): The Unix time before which sessions expire.
+            limit (int): The maximum number of sessions to remove.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the removed sessions.
+        """
+
+
+    @abstractmethod
+    def set_user_name_index(self, key: bytes, user_name_index: bytes) -> bool:
+        """
+        Stores the username blind index of a user that has none yet,
+        without writing back anything else.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            user_name_index (bytes): The blind index of the username.
+
+        Returns:
+            bool: True if the blind index was stored, False if the user does not
+                exist, already has a blind index or the index belongs to another user.
+        """
+
+
+    @abstractmethod
+    def set_password(self, key: bytes, hashed_password: Union[str, bytes],
+                     previous_hashed_password: Union[str, bytes]) -> bool:
+        """
+        Replaces the password hash of a user without writing back anything else.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            hashed_password (Union[str, bytes]): The new password hash.
+            previous_hashed_password (Union[str, bytes]): The hash that has
+                to be stored for the password to be replaced.
+
+        Returns:
+            bool: True if the password hash was replaced, False otherwise.
+        """
+
+
+    @abstractmethod
+    def __setitem__(self, key: bytes, value: dict) -> None:
+        """
+        Replaces the record of a user. The sessions of the record replace the
+        stored sessions, so sessions missing from it are removed.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            value (dict): A dictionary containing user information.
+        """
+
+
+    @abstractmethod
+    def __getitem__(self, key: bytes) -> Optional[dict]:
+        """
+        Retrieves the record of a user together with its sessions.
+
+        Args:
+            key (bytes): The key representing the hashed user name of the user to retrieve.
+
+        Returns:
+            Optional[dict]: A dictionary containing user information if found,
+                or None if the key does not exist.
+        """
+
+
+class Users(BaseUsers):
+    """
+    A class to manage user data stored in a file.
+
+    Changes are appended to a journal next to the file, which is replayed on
+    load and folded into a new snapshot in the background once it grows past
+    `JOURNAL_COMPACTION_SIZE`.
+
+    Attributes:
+        file_path (str): The path to the file where user data is stored.
+        users (Optional[dict]): A dictionary containing user data.
+        user_name_indexes (dict): A dictionary mapping username blind indexes
+            to the keys of the users.
+        unindexed_keys (set): Keys of users stored before blind indexes existed.
+        session_indexes (dict): A dictionary mapping session keys to the keys
+            of the users that own them.
+        session_expiries (list): A heap of the creation times of sessions with
+            their session and user keys, oldest first.
+        ip_sessions (dict): A dictionary mapping IP addresses to sets of
+            user keys and session keys.
+        user_agent_sessions (dict): A dictionary mapping operating system and
+            browser pairs to sets of user keys and session keys.
+    """
+
+
+    def __init__(self, file_path: Optional[str] = None) -> None:
+        """
+        Initializes the Users class with a specified file path.
+
+        Args:
+            file_path (Optional[str]): The path to the file containing user data.
+                Defaults to None.
+        """
+
+        if not file_path:
+            file_path = USERS_FILE_PATH
+
+        self.file_path = file_path
+        self.journaled_file = JournaledPickleFile(file_path)
+        self.users: dict = {}
+        self.user_name_indexes: dict = {}
+        self.unindexed_keys: set = set()
+        self.session_indexes: dict = {}
+        self.session_expiries: list = []
+        self.ip_sessions: dict = {}
+        self.user_agent_sessions: dict = {}
+
+        self._compacting = Lock()
+        self._session_lock = Lock()
+
+        self.load()
+
+
+    def load(self) -> dict:
+        """
+        Loads user data from the specified file, replays the journal,
+        moves inline avatars into the avatar store and builds the
+        username and session indexes.
+
+        Returns:
+            dict: A dictionary containing the loaded user data.
+        """
+
+        users = self.journaled_file.load()
+        self.users = users
+
+        self.user_name_indexes = {}
+        self.unindexed_keys = set()
+        self.session_indexes = {}
+        self.session_expiries = []
+        self.ip_sessions = {}
+        self.user_agent_sessions = {}
+        for key, user_data in users.items():
+            if store_avatar(user_data):
+                self.journaled_file.append(key, user_data, wait = False)
+
+            self._index(key, user_data)
+
+        return users
+
+
+    def dump(self) -> None:
+        """
+        Folds the journal into a new snapshot of the specified file.
+        """
+
+        self.journaled_file.compact()
+
+
+    def _compact(self) -> None:
+        try:
+            self.journaled_file.compact()
+        finally:
+            self._compacting.release()
+
+
+    def _write(self, key: bytes) -> None:
+        """
+        Appends the current record of a user to the journal and starts a
+        background compaction once the journal is large enough.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+        """
+
+        self.journaled_file.append(key, self.users.get(key, None))
+
+        if self.journaled_file.size() < JOURNAL_COMPACTION_SIZE:
+            return
+
+        if self._compacting.acquire(blocking = False):
+            Thread(target = self._compact, daemon = True).start()
+
+
+    def _index(self, key: bytes, user_data: dict) -> None:
+        """
+        Adds a user entry to the username and session indexes.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            user_data (dict): A dictionary containing user information.
+        """
+
+        for session_key, session_data in user_data.get("sessions", {}).items():
+            self._index_session(key, session_key, session_data)
+
+        user_name_index = user_data.get("user_name_index", None)
+        if not isinstance(user_name_index, bytes):
+            self.unindexed_keys.add(key)
+            return
+
+        self.user_name_indexes[user_name_index] = key
+        self.unindexed_keys.discard(key)
+
+
+    def _index_session(self, key: bytes, session_key: bytes, session_data: dict) -> None:
+        """
+        Adds a session to the session indexes and the expiry heap.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the session id.
+            session_data (dict): A dictionary containing session information.
+        """
+
+        user_agent = (session_data.get("os", None), session_data.get("browser", None))
+
+        with self._session_lock:
+            self.session_indexes[session_key] = key
+            heappush(self.session_expiries, (session_data.get("time", 0), session_key, key))
+
+            self.ip_sessions.setdefault(
+                session_data.get("ip", None), set()
+            ).add((key, session_key))
+            self.user_agent_sessions.setdefault(user_agent, set()).add((key, session_key))
+
+
+    def _unindex_session(self, key: bytes, session_key: bytes, session_data: dict) -> None:
+        """
+        Removes a session from the session indexes, the expiry heap is
+        cleaned up lazily. The caller holds the session lock.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the session id.
+            session_data (dict): A dictionary containing session information.
+        """
+
+        self.session_indexes.pop(session_key, None)
+
+        for index, index_key in (
+                (self.ip_sessions, session_data.get("ip", None)),
+                (self.user_agent_sessions,
+                 (session_data.get("os", None), session_data.get("browser", None)))
+            ):
+
+            entries = index.get(index_key, None)
+            if entries is None:
+                continue
+
+            entries.discard((key, session_key))
+            if not entries:
+                index.pop(index_key)
+
+
+    def get_key(self, user_name_index: bytes) -> Optional[bytes]:
+        """
+        Retrieves the key of a user by the blind index of the username.
+
+        Args:
+            user_name_index (bytes): The blind index of the username.
+
+        Returns:
+            Optional[bytes]: The key representing the hashed user name,
+                or None if no user has this index.
+        """
+
+        return self.user_name_indexes.get(user_name_index, None)
+
+
+    def get_unindexed_keys(self) -> list[bytes]:
+        """
+        Retrieves the keys of users stored before blind indexes existed.
+
+        Returns:
+            list[bytes]: The keys representing the hashed user names.
+        """
+
+        return list(self.unindexed_keys)
+
+
+    def has_unindexed_keys(self) -> bool:
+        """
+        Checks whether any users were stored before blind indexes existed.
+
+        Returns:
+            bool: True if there is at least one such user, otherwise False.
+        """
+
+        return bool(self.unindexed_keys)
+
+
+    def get_user_name_indexes(self) -> Optional[list[bytes]]:
+        """
+        Retrieves the username blind indexes of all indexed users.
+
+        Returns:
+            Optional[list[bytes]]: The blind indexes of the usernames,
+                or None if they could not be read.
+        """
+
+        return list(self.user_name_indexes)
+
+
+    def get_session_user_key(self, session_key: bytes) -> Optional[bytes]:
+        """
+        Retrieves the key of the user that owns a session.
+
+        Args:
+            session_key (bytes): The key representing the session id.
+
+        Returns:
+            Optional[bytes]: The key representing the hashed user name,
+                or None if no user has this session.
+        """
+
+        return self.session_indexes.get(session_key, None)
+
+
+    def get_sessions_by_ip(self, ip_address: str) -> list[Tuple[bytes, bytes]]:
+        """
+        Retrieves all sessions created from an IP address.
+
+        Args:
+            ip_address (str): The IP address.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the sessions.
+        """
+
+        with self._session_lock:
+            return list(self.ip_sessions.get(ip_address, ()))
+
+
+    def get_sessions_by_user_agent(self, operating_system: Optional[str],
+                                   browser: Optional[str]) -> list[Tuple[bytes, bytes]]:
+        """
+        Retrieves all sessions created with an operating system and browser.
+
+        Args:
+            operating_system (Optional[str]): The operating system, see `get_os_and_browser`.
+            browser (Optional[str]): The browser, see `get_os_and_browser`.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the sessions.
+        """
+
+        with self._session_lock:
+            return list(self.user_agent_sessions.get((operating_system, browser), ()))
+
+
+    def add_session(self, key: bytes, session_key: bytes, session_data: dict) -> bool:
+        """
+        Adds a session to a user and saves it.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the hashed session id.
+            session_data (dict): A dictionary containing session information.
+
+        Returns:
+            bool: True if the user exists and the session was added, False otherwise.
+        """
+
+        user_data = self.users.get(key, None)
+        if not user_data:
+            return False
+
+        sessions = user_data.get("sessions", {})
+        sessions[session_key] = session_data
+        user_data["sessions"] = sessions
+        self._index_session(key, session_key, session_data)
+
+        self._write(key)
+        return True
+
+
+    def remove_session(self, key: bytes, session_key: bytes) -> bool:
+        """
+        Removes a session from a user and saves it.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the session id.
+
+        Returns:
+            bool: True if the session existed and was removed, False otherwise.
+        """
+
+        user_data = self.users.get(key, None)
+        if not user_data or session_key not in user_data.get("sessions", {}):
+            return False
+
+        with self._session_lock:
+            session_data = user_data["sessions"].pop(session_key, None)
+            if session_data is None:
+                return False
+
+            self._unindex_session(key, session_key, session_data)
+
+        self._write(key)
+        return True
+
+
+    def expire_sessions(self, before: int, limit: int = 1000) -> list[Tuple[bytes, bytes]]:
+        """
+        Removes sessions created before a point in time, oldest first.
+
+        Heap entries of sessions that were removed or replaced in the meantime
+        are skipped when they reach the top of the heap.
+
+        Args:
+            before (int): The Unix time before which sessions expire.
+            limit (int): The maximum number of sessions to remove.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the removed sessions.
+        """
+
+        expired = []
+        with self._session_lock:
+            while self.session_expiries and len(expired) < limit \
+                and self.session_expiries[0][0] < before:
+
+                session_time, session_key, key = heappop(self.session_expiries)
+
+                sessions = (self.users.get(key, None) or {}).get("sessions", {})
+                session_data = sessions.get(session_key, None)
+                if not session_data or session_data.get("time", 0) != session_time:
+                    continue
+
+                sessions.pop(session_key)
+                self._unindex_session(key, session_key, session_data)
+                expired.append((key, session_key))
+
+        for key in {key for key, _ in expired}:
+            self._write(key)
+
+        return expired
+
+
+    def set_user_name_index(self, key: bytes, user_name_index: bytes) -> bool:
+        """
+        Stores the username blind index of a user that has none yet,
+        without writing back anything else.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            user_name_index (bytes): The blind index of the username.
+
+        Returns:
+            bool: True if the blind index was stored, False if the user does not
+                exist, already has a blind index or the index belongs to another user.
+        """
+
+        with self._session_lock:
+            user_data = self.users.get(key, None)
+            if not user_data or isinstance(user_data.get("user_name_index", None), bytes) \
+                or user_name_index in self.user_name_indexes:
+
+                return False
+
+            user_data["user_name_index"] = user_name_index
+            self.user_name_indexes[user_name_index] = key
+            self.unindexed_keys.discard(key)
+
+        self._write(key)
+        return True
+
+
+    def set_password(self, key: bytes, hashed_password: Union[str, bytes],
+                     previous_hashed_password: Union[str, bytes]) -> bool:
+        """
+        Replaces the password hash of a user without writing back anything else.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            hashed_password (Union[str, bytes]): The new password hash.
+            previous_hashed_password (Union[str, bytes]): The hash that has
+                to be stored for the password to be replaced.
+
+        Returns:
+            bool: True if the password hash was replaced, False otherwise.
+        """
+
+        with self._session_lock:
+            user_data = self.users.get(key, None)
+            if not user_data or user_data.get("password", None) != previous_hashed_password:
+                return False
+
+            user_data["password"] = hashed_password
+
+        self._write(key)
+        return True
+
+
+    def __setitem__(self, key: bytes, value: dict) -> None:
+        """
+        Sets a user entry in the users dictionary and saves it to the file.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            value (dict): A dictionary containing user information.
+        """
+
+        store_avatar(value)
+
+        previous_user_data = self.users.get(key, None) or {}
+        with self._session_lock:
+            for session_key, session_data in previous_user_data.get("sessions", {}).items():
+                self._unindex_session(key, session_key, session_data)
+
+        self.users[key] = value
+        self._index(key, value)
+        self._write(key)
+
+
+    def __getitem__(self, key: bytes) -> Optional[dict]:
+        """
+        Retrieves a user entry from the users dictionary.
+
+        Args:
+            key (bytes): The key representing the hashed user name of the user to retrieve.
+
+        Returns:
+            Optional[dict]: A dictionary containing user information if found,
+                or None if the key does not exist.
+        """
+
+        return self.users.get(key, None)
+
+
+SQLITE_SCHEMA: Final[str] = """
+CREATE TABLE IF NOT EXISTS users (
+    key BLOB PRIMARY KEY,
+    user_name_index BLOB UNIQUE,
+    password BLOB NOT NULL,
+    display_name TEXT,
+    avatar TEXT,
+    twofa_token TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sessions (
+    key BLOB PRIMARY KEY,
+    user_key BLOB NOT NULL REFERENCES users (key) ON DELETE CASCADE,
+    token BLOB NOT NULL,
+    os TEXT,
+    browser TEXT,
+    ip TEXT,
+    time INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS sessions_user_key ON sessions (user_key);
+CREATE INDEX IF NOT EXISTS sessions_time ON sessions (time);
+CREATE INDEX IF NOT EXISTS sessions_ip ON sessions (ip);
+CREATE INDEX IF NOT EXISTS sessions_user_agent ON sessions (os, browser);
+"""
+
+SQL_SELECT_USER: Final[str] = (
+    "SELECT password, user_name_index, display_name, avatar, twofa_token "
+    "FROM users WHERE key = ?"
+)
+SQL_SELECT_USER_KEY: Final[str] = "SELECT key FROM users WHERE user_name_index = ?"
+SQL_SELECT_UNINDEXED_KEYS: Final[str] = "SELECT key FROM users WHERE user_name_index IS NULL"
+SQL_SELECT_ANY_UNINDEXED_KEY: Final[str] = (
+    "SELECT 1 FROM users WHERE user_name_index IS NULL LIMIT 1"
+)
+SQL_SELECT_USER_NAME_INDEXES: Final[str] = (
+    "SELECT user_name_index FROM users WHERE user_name_index IS NOT NULL"
+)
+SQL_COUNT_USERS: Final[str] = "SELECT COUNT(*) FROM users"
+SQL_UPDATE_PASSWORD: Final[str] = "UPDATE users SET password = ? WHERE key = ? AND password = ?"
+SQL_UPDATE_USER_NAME_INDEX: Final[str] = (
+    "UPDATE users SET user_name_index = ? WHERE key = ? AND user_name_index IS NULL"
+)
+SQL_UPSERT_USER: Final[str] = (
+    "INSERT INTO users (key, password, user_name_index, display_name, avatar, twofa_token) "
+    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+    "password = excluded.password, user_name_index = excluded.user_name_index, "
+    "display_name = excluded.display_name, avatar = excluded.avatar, "
+    "twofa_token = excluded.twofa_token"
+)
+SQL_SELECT_SESSION_USER_KEY: Final[str] = "SELECT user_key FROM sessions WHERE key = ?"
+SQL_SELECT_SESSIONS_BY_IP: Final[str] = "SELECT user_key, key FROM sessions WHERE ip = ?"
+SQL_SELECT_SESSIONS_BY_USER_AGENT: Final[str] = (
+    "SELECT user_key, key FROM sessions WHERE os IS ? AND browser IS ?"
+)
+SQL_SELECT_SESSIONS: Final[str] = (
+    "SELECT key, token, os, browser, ip, time FROM sessions WHERE user_key = ?"
+)
+SQL_UPSERT_SESSION: Final[str] = (
+    "INSERT OR REPLACE INTO sessions (key, user_key, token, os, browser, ip, time) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_DELETE_SESSION: Final[str] = "DELETE FROM sessions WHERE key = ? AND user_key = ?"
+SQL_DELETE_USER_SESSIONS: Final[str] = "DELETE FROM sessions WHERE user_key = ?"
+SQL_DELETE_EXPIRED_SESSIONS: Final[str] = (
+    "DELETE FROM sessions WHERE key IN "
+    "(SELECT key FROM sessions WHERE time < ? ORDER BY time LIMIT ?) "
+    "RETURNING user_key, key"
+)
+
+
+class SQLiteUsers(BaseUsers):
+    """
+    A class to manage user data stored in a SQLite database in WAL mode.
+
+    Every user and every session is one row, so writes cost one record instead
+    of the whole user file, and all Gunicorn workers share one consistent store.
+    Statements are module constants with placeholders, so the statement cache of
+    each connection compiles every statement only once.
+
+    Attributes:
+        file_path (str): The path to the SQLite database.
+        legacy_file_path (str): The path to a pickle file that is imported
+            into an empty database.
+    """
+
+
+    def __init__(self, file_path: Optional[str] = None,
+                 legacy_file_path: Optional[str] = None) -> None:
+        """
+        Initializes the SQLiteUsers class with a specified database path.
+
+        Args:
+            file_path (Optional[str]): The path to the SQLite database.
+                Defaults to None.
+            legacy_file_path (Optional[str]): The path to a pickle file with
+                user data to import. Defaults to None.
+        """
+
+        self.file_path = file_path or USERS_DATABASE_FILE_PATH
+        self.legacy_file_path = legacy_file_path or USERS_FILE_PATH
+
+        self._lock = Lock()
+        self._connection: Optional[Connection] = None
+        self._connection_pid: Optional[int] = None
+
+        self.load()
+
+
+    def _get_connection(self) -> Connection:
+        """
+        Returns the connection of the current process, opening it if needed.
+
+        Connections are never shared between processes, so every forked
+        Gunicorn worker opens its own connection on first use.
+        """
+
+        if self._connection is None or self._connection_pid != getpid():
+            connection = connect(
+                self.file_path, timeout = 10,
+                check_same_thread = False, cached_statements = 64
+            )
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA foreign_keys = ON")
+
+            self._connection = connection
+            self._connection_pid = getpid()
+
+        return self._connection
+
+
+    def load(self) -> dict:
+        """
+        Creates the database schema and imports an existing pickle file
+        into an empty database.
+
+        Returns:
+            dict: An empty dictionary, users are read from the database on demand.
+        """
+
+        with self._lock:
+            connection = self._get_connection()
+            connection.executescript(SQLITE_SCHEMA)
+
+            user_count = connection.execute(SQL_COUNT_USERS).fetchone()[0]
+
+        if user_count == 0:
+            legacy_users = JournaledPickleFile(self.legacy_file_path).load()
+            for key, user_data in legacy_users.items():
+                self[key] = user_data
+
+            if legacy_users:
+                log(f"Imported {len(legacy_users)} users into the database.", level = 2)
+
+        return {}
+
+
+    def dump(self) -> None:
+        """
+        Does nothing, every change is written to the database immediately.
+        """
+
+
+    def get_key(self, user_name_index: bytes) -> Optional[bytes]:
+        """
+        Retrieves the key of a user through the unique index on the blind index.
+
+        Args:
+            user_name_index (bytes): The blind index of the username.
+
+        Returns:
+            Optional[bytes]: The key representing the hashed user name,
+                or None if no user has this index.
+        """
+
+        try:
+            with self._lock:
+                row = self._get_connection().execute(
+                    SQL_SELECT_USER_KEY, (user_name_index,)
+                ).fetchone()
+
+        except SQLiteError:
+            log("User key could not be selected.", level = 4)
+            return None
+
+        return row[0] if row else None
+
+
+    def get_unindexed_keys(self) -> list[bytes]:
+        """
+        Retrieves the keys of users stored before blind indexes existed.
+
+        Returns:
+            list[bytes]: The keys representing the hashed user names.
+        """
+
+        try:
+            with self._lock:
+                rows = self._get_connection().execute(SQL_SELECT_UNINDEXED_KEYS).fetchall()
+
+        except SQLiteError:
+            log("Unindexed user keys could not be selected.", level = 4)
+            return []
+
+        return [row[0] for row in rows]
+
+
+    def has_unindexed_keys(self) -> bool:
+        """
+        Checks whether any users were stored before blind indexes existed.
+
+        Returns:
+            bool: True if there is at least one such user or the store could
+                not be read, otherwise False.
+        """
+
+        try:
+            with self._lock:
+                row = self._get_connection().execute(SQL_SELECT_ANY_UNINDEXED_KEY).fetchone()
+
+        except SQLiteError:
+            log("Unindexed user keys could not be selected.", level = 4)
+            return True
+
+        return row is not None
+
+
+    def get_user_name_indexes(self) -> Optional[list[bytes]]:
+        """
+        Retrieves the username blind indexes of all indexed users.
+
+        Returns:
+            Optional[list[bytes]]: The blind indexes of the usernames,
+                or None if they could not be read.
+        """
+
+        try:
+            with self._lock:
+                rows = self._get_connection().execute(SQL_SELECT_USER_NAME_INDEXES).fetchall()
+
+        except SQLiteError:
+            log("Username indexes could not be selected.", level = 4)
+            return None
+
+        return [row[0] for row in rows]
+
+
+    def get_session_user_key(self, session_key: bytes) -> Optional[bytes]:
+        """
+        Retrieves the key of the user that owns a session through the
+        primary key of the sessions table.
+
+        Args:
+            session_key (bytes): The key representing the session id.
+
+        Returns:
+            Optional[bytes]: The key representing the hashed user name,
+                or None if no user has this session.
+        """
+
+        try:
+            with self._lock:
+                row = self._get_connection().execute(
+                    SQL_SELECT_SESSION_USER_KEY, (session_key,)
+                ).fetchone()
+
+        except SQLiteError:
+            log("Session user key could not be selected.", level = 4)
+            return None
+
+        return row[0] if row else None
+
+
+    def _select_sessions(self, statement: str, parameters: tuple) -> list[Tuple[bytes, bytes]]:
+        try:
+            with self._lock:
+                rows = self._get_connection().execute(statement, parameters).fetchall()
+
+        except SQLiteError:
+            log("Sessions could not be selected.", level = 4)
+            return []
+
+        return [(row[0], row[1]) for row in rows]
+
+
+    def get_sessions_by_ip(self, ip_address: str) -> list[Tuple[bytes, bytes]]:
+        """
+        Retrieves all sessions created from an IP address through the index on the ip column.
+
+        Args:
+            ip_address (str): The IP address.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the sessions.
+        """
+
+        return self._select_sessions(SQL_SELECT_SESSIONS_BY_IP, (ip_address,))
+
+
+    def get_sessions_by_user_agent(self, operating_system: Optional[str],
+                                   browser: Optional[str]) -> list[Tuple[bytes, bytes]]:
+        """
+        Retrieves all sessions created with an operating system and browser
+        through the index on the os and browser columns.
+
+        Args:
+            operating_system (Optional[str]): The operating system, see `get_os_and_browser`.
+            browser (Optional[str]): The browser, see `get_os_and_browser`.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the sessions.
+        """
+
+        return self._select_sessions(
+            SQL_SELECT_SESSIONS_BY_USER_AGENT, (operating_system, browser)
+        )
+
+
+    def add_session(self, key: bytes, session_key: bytes, session_data: dict) -> bool:
+        """
+        Inserts the row of a session.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the hashed session id.
+            session_data (dict): A dictionary containing session information.
+
+        Returns:
+            bool: True if the session was inserted, False otherwise.
+        """
+
+        try:
+            with self._lock:
+                connection = self._get_connection()
+                with connection:
+                    connection.execute(SQL_UPSERT_SESSION, (
+                        session_key, key,
+                        *(session_data.get(field, None) for field in SESSION_FIELDS)
+                    ))
+
+        except SQLiteError:
+            log("Session could not be inserted.", level = 4)
+            return False
+
+        return True
+
+
+    def remove_session(self, key: bytes, session_key: bytes) -> bool:
+        """
+        Deletes the row of a session.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the session id.
+
+        Returns:
+            bool: True if the session existed and was deleted, False otherwise.
+        """
+
+        try:
+            with self._lock:
+                connection = self._get_connection()
+                with connection:
+                    cursor = connection.execute(SQL_DELETE_SESSION, (session_key, key))
+
+        except SQLiteError:
+            log("Session could not be deleted.", level = 4)
+            return False
+
+        return cursor.rowcount > 0
+
+
+    def expire_sessions(self, before: int, limit: int = 1000) -> list[Tuple[bytes, bytes]]:
+        """
+        Deletes the rows of sessions created before a point in time through
+        the index on the time column, oldest first.
+
+        Args:
+            before (int): The Unix time before which sessions expire.
+            limit (int): The maximum number of sessions to delete.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the deleted sessions.
+        """
+
+        try:
+            with self._lock:
+                connection = self._get_connection()
+                with connection:
+                    rows = connection.execute(
+                        SQL_DELETE_EXPIRED_SESSIONS, (before, limit)
+                    ).fetchall()
+
+        except SQLiteError:
+            log("Expired sessions could not be deleted.", level = 4)
+            return []
+
+        return [(row[0], row[1]) for row in rows]
+
+
+    def set_user_name_index(self, key: bytes, user_name_index: bytes) -> bool:
+        """
+        Updates only the blind index column of a user row that has none yet.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            user_name_index (bytes): The blind index of the username.
+
+        Returns:
+            bool: True if the blind index was stored, False if the user does not
+                exist, already has a blind index or the index belongs to another user.
+        """
+
+        try:
+            with self._lock:
+                connection = self._get_connection()
+                with connection:
+                    cursor = connection.execute(
+                        SQL_UPDATE_USER_NAME_INDEX, (user_name_index, key)
+                    )
+
+        except SQLiteError:
+            log("Username index could not be updated.", level = 4)
+            return False
+
+        return cursor.rowcount > 0
+
+
+    def set_password(self, key: bytes, hashed_password: Union[str, bytes],
+                     previous_hashed_password: Union[str, bytes]) -> bool:
+        """
+        Updates only the password column of a user row.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            hashed_password (Union[str, bytes]): The new password hash.
+            previous_hashed_password (Union[str, bytes]): The hash that has
+                to be stored for the password to be replaced.
+
+        Returns:
+            bool: True if the password hash was replaced, False otherwise.
+        """
+
+        try:
+            with self._lock:
+                connection = self._get_connection()
+                with connection:
+                    cursor = connection.execute(
+                        SQL_UPDATE_PASSWORD, (hashed_password, key, previous_hashed_password)
+                    )
+
+        except SQLiteError:
+            log("Password could not be updated.", level = 4)
+            return False
+
+        return cursor.rowcount > 0
+
+
+    def __setitem__(self, key: bytes, value: dict) -> None:
+        """
+        Inserts or updates a user row and replaces the rows of its sessions,
+        so sessions missing from the record are removed.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            value (dict): A dictionary containing user information.
+        """
+
+        store_avatar(value)
+        sessions = value.get("sessions", {})
+
+        try:
+            with self._lock:
+                connection = self._get_connection()
+                with connection:
+                    connection.execute(SQL_UPSERT_USER, (
+                        key, *(value.get(field, None) for field in USER_FIELDS)
+                    ))
+
+                    connection.execute(SQL_DELETE_USER_SESSIONS, (key,))
+                    connection.executemany(SQL_UPSERT_SESSION, [
+                        (
+                            session_key, key,
+                            *(session_data.get(field, None) for field in SESSION_FIELDS)
+                        )
+                        for session_key, session_data in sessions.items()
+                    ])
+
+        except SQLiteError:
+            log("User could not be written.", level = 4)
+
+
+    def __getitem__(self, key: bytes) -> Optional[dict]:
+        """
+        Retrieves a user row together with the rows of its sessions.
+
+        Args:
+            key (bytes): The key representing the hashed user name of the user to retrieve.
+
+        Returns:
+            Optional[dict]: A dictionary containing user information if found,
+                or None if the key does not exist.
+        """
+
+        try:
+            with self._lock:
+                connection = self._get_connection()
+
+                row = connection.execute(SQL_SELECT_USER, (key,)).fetchone()
+                if not row:
+                    return None
+
+                session_rows = connection.execute(SQL_SELECT_SESSIONS, (key,)).fetchall()
+
+        except SQLiteError:
+            log("User could not be selected.", level = 4)
+            return None
+
+        user_data = {
+            field: value
+            for field, value in zip(USER_FIELDS, row)
+            if value is not None
+        }
+
+        if session_rows:
+            user_data["sessions"] = {
+                session_row[0]: dict(zip(SESSION_FIELDS, session_row[1:]))
+                for session_row in session_rows
+            }
+
+        return user_data
+
+
+def encode_redis_value(value: Any) -> str:
+    """
+    Encodes a record value as a string tagged with its type.
+
+    Args:
+        value (Any): A bytes, str, int or None value.
+
+    Returns:
+        str: The tagged string.
+    """
+
+    if value is None:
+        return "n:"
+
+    if isinstance(value, bytes):
+        return "b:" + b64encode(value).decode("ascii")
+
+    if isinstance(value, bool):
+        return "i:" + str(int(value))
+
+    if isinstance(value, int):
+        return "i:" + str(value)
+
+    return "s:" + str(value)
+
+
+def decode_redis_value(value: str) -> Any:
+    """
+    Decodes a string created by `encode_redis_value`.
+
+    Args:
+        value (str): The tagged string.
+
+    Returns:
+        Any: The decoded bytes, str, int or None value.
+    """
+
+    tag, encoded = value[:2], value[2:]
+
+    if tag == "n:":
+        return None
+
+    if tag == "b:":
+        return b64decode(encoded)
+
+    if tag == "i:":
+        return int(encoded)
+
+    return encoded
+
+
+def encode_redis_session(session_data: dict) -> str:
+    """
+    Encodes a session record as JSON with tagged values.
+
+    Args:
+        session_data (dict): A dictionary containing session information.
+
+    Returns:
+        str: The encoded session.
+    """
+
+    return json_dumps({
+        field: encode_redis_value(value)
+        for field, value in session_data.items()
+    })
+
+
+def decode_redis_session(encoded_session: str) -> dict:
+    """
+    Decodes a session record created by `encode_redis_session`.
+
+    Args:
+        encoded_session (str): The encoded session.
+
+    Returns:
+        dict: A dictionary containing session information.
+    """
+
+    return {
+        field: decode_redis_value(value)
+        for field, value in json_loads(encoded_session).items()
+    }
+
+
+def get_session_index_names(session_data: dict) -> Tuple[str, str]:
+    """
+    Returns the names of the Redis sets that index a session by its IP
+    address and by its operating system and browser.
+
+    Args:
+        session_data (dict): A dictionary containing session information.
+
+    Returns:
+        Tuple[str, str]: The names of the IP set and the user agent set.
+    """
+
+    return (
+        "ip_sessions:" + str(session_data.get("ip", None) or ""),
+        "user_agent_sessions:" + str(session_data.get("os", None) or "")
+            + "/" + str(session_data.get("browser", None) or "")
+    )
+
+
+# Replaces the password field only if it still holds the verified hash,
+# without touching the other fields or the sessions of the user.
+SET_PASSWORD_SCRIPT: Final[str] = """
+if redis.call("HGET", KEYS[1], "password") ~= ARGV[1] then
+    return 0
+end
+redis.call("HSET", KEYS[1], "password", ARGV[2])
+return 1
+"""
+
+# Stores the blind index (ARGV[1] as hex, ARGV[2] encoded) of the user KEYS[1]
+# with the hex key ARGV[3], only if the user exists, has no blind index yet and
+# the index does not belong to another user.
+SET_USER_NAME_INDEX_SCRIPT: Final[str] = """
+if redis.call("EXISTS", KEYS[1]) == 0 or redis.call("HEXISTS", KEYS[1], "user_name_index") == 1
+    or redis.call("HEXISTS", "user_name_indexes", ARGV[1]) == 1 then
+    return 0
+end
+redis.call("HSET", KEYS[1], "user_name_index", ARGV[2])
+redis.call("HSET", "user_name_indexes", ARGV[1], ARGV[3])
+redis.call("SREM", "unindexed_users", ARGV[3])
+return 1
+"""
+
+
+class RedisUsers(BaseUsers):
+    """
+    A class to manage user data stored in Redis hashes, shared by all nodes.
+
+    Every user is one hash (`user:<key>`) with its sessions in a second hash
+    (`user_sessions:<key>`), the `session_indexes` hash maps every session
+    key to the key of its user, the `session_expiries` sorted set orders
+    sessions by their creation time and the `ip_sessions:<ip>` and
+    `user_agent_sessions:<os>/<browser>` sets group them. Each worker keeps
+    decoded records in a bounded LRU cache, so logins and session checks usually
+    need neither a network round trip nor deserialisation. Writes publish the user key on a pub/sub channel and
+    every worker evicts that key from its cache.
+
+    Attributes:
+        cache (LRUCache): The per-worker cache of decoded user records.
+        legacy_file_path (str): The path to a pickle file that is imported
+            into an empty store.
+    """
+
+
+    def __init__(self, cache_size: int = USER_CACHE_SIZE,
+                 legacy_file_path: Optional[str] = None) -> None:
+        """
+        Initializes the RedisUsers class.
+
+        Args:
+            cache_size (int): The maximum number of cached user records.
+            legacy_file_path (Optional[str]): The path to a pickle file with
+                user data to import. Defaults to None.
+        """
+
+        self.cache = LRUCache(cache_size)
+        self.legacy_file_path = legacy_file_path or USERS_FILE_PATH
+
+        self._listener_lock = Lock()
+        self._listener_pid: Optional[int] = None
+        self._subscribed = False
+        self._generation = 0
+
+        self._set_password_script = REDIS_CLIENT.register_script(SET_PASSWORD_SCRIPT)
+        self._set_user_name_index_script = REDIS_CLIENT.register_script(
+            SET_USER_NAME_INDEX_SCRIPT
+        )
+
+        self.load()
+
+
+    def _listen(self) -> None:
+        """
+        Evicts cached records whenever another worker publishes a change.
+
+        While the subscription is down, cached records are not trusted, and
+        the cache is cleared after every reconnect. Records read while an
+        invalidation arrived are not cached.
+        """
+
+        while True:
+            try:
+                pubsub = REDIS_CLIENT.pubsub(ignore_subscribe_messages = True)
+                pubsub.subscribe(USER_INVALIDATION_CHANNEL)
+
+                self._generation += 1
+                self.cache.clear()
+                self._subscribed = True
+
+                for message in pubsub.listen():
+                    data = message.get("data", None)
+                    if isinstance(data, str):
+                        self._invalidate(data)
+
+            except RedisError:
+                log("User invalidation subscription failed.", level = 3)
+
+            self._subscribed = False
+            self._generation += 1
+            self.cache.clear()
+            sleep(1)
+
+
+    def _is_cache_usable(self) -> bool:
+        """
+        Starts the invalidation listener of the current process if needed.
+
+        Returns:
+            bool: True if the listener is subscribed and the cache can be used.
+        """
+
+        if self._listener_pid != getpid():
+            with self._listener_lock:
+                if self._listener_pid != getpid():
+                    self._subscribed = False
+                    self.cache.clear()
+
+                    Thread(target = self._listen, daemon = True).start()
+                    self._listener_pid = getpid()
+
+        return self._subscribed
+
+
+    def _invalidate(self, hex_key: str) -> None:
+        self._generation += 1
+        self.cache.delete(hex_key)
+
+
+    def _publish(self, pipeline: Any, hex_key: str) -> None:
+        self._invalidate(hex_key)
+        pipeline.publish(USER_INVALIDATION_CHANNEL, hex_key)
+
+
+    def load(self) -> dict:
+        """
+        Imports an existing pickle file into an empty store.
+
+        Returns:
+            dict: An empty dictionary, users are read from Redis on demand.
+        """
+
+        try:
+            user_count = REDIS_CLIENT.hlen("user_name_indexes") + \
+                REDIS_CLIENT.scard("unindexed_users")
+
+        except RedisError:
+            log("Users could not be counted.", level = 4)
+            return {}
+
+        if user_count == 0:
+            legacy_users = JournaledPickleFile(self.legacy_file_path).load()
+            for key, user_data in legacy_users.items():
+                self[key] = user_data
+
+            if legacy_users:
+                log(f"Imported {len(legacy_users)} users into Redis.", level = 2)
+
+        return {}
+
+
+    def dump(self) -> None:
+        """
+        Does nothing, every change is written to Redis immediately.
+        """
+
+
+    def get_key(self, user_name_index: bytes) -> Optional[bytes]:
+        """
+        Retrieves the key of a user by the blind index of the username.
+
+        Only found keys are cached, so new accounts are visible at once.
+
+        Args:
+            user_name_index (bytes): The blind index of the username.
+
+        Returns:
+            Optional[bytes]: The key representing the hashed user name,
+                or None if no user has this index.
+        """
+
+        cache_key = "name:" + user_name_index.hex()
+        use_cache = self._is_cache_usable()
+
+        if use_cache:
+            hex_key = self.cache.get(cache_key)
+            if hex_key is not None:
+                return bytes.fromhex(hex_key)
+
+        try:
+            hex_key = REDIS_CLIENT.hget("user_name_indexes", user_name_index.hex())
+        except RedisError:
+            log("User key could not be read.", level = 4)
+            return None
+
+        if not hex_key:
+            return None
+
+        if use_cache:
+            self.cache.set(cache_key, hex_key)
+
+        return bytes.fromhex(hex_key)
+
+
+    def get_unindexed_keys(self) -> list[bytes]:
+        """
+        Retrieves the keys of users stored before blind indexes existed.
+
+        Returns:
+            list[bytes]: The keys representing the hashed user names.
+        """
+
+        try:
+            hex_keys = REDIS_CLIENT.smembers("unindexed_users")
+        except RedisError:
+            log("Unindexed user keys could not be read.", level = 4)
+            return []
+
+        return [bytes.fromhex(hex_key) for hex_key in hex_keys]
+
+
+    def has_unindexed_keys(self) -> bool:
+        """
+        Checks whether any users were stored before blind indexes existed.
+
+        Returns:
+            bool: True if there is at least one such user or the store could
+                not be read, otherwise False.
+        """
+
+        try:
+            return REDIS_CLIENT.scard("unindexed_users") > 0
+        except RedisError:
+            log("Unindexed user keys could not be read.", level = 4)
+            return True
+
+
+    def get_user_name_indexes(self) -> Optional[list[bytes]]:
+        """
+        Retrieves the username blind indexes of all indexed users.
+
+        Returns:
+            Optional[list[bytes]]: The blind indexes of the usernames,
+                or None if they could not be read.
+        """
+
+        try:
+            return [
+                bytes.fromhex(hex_index)
+                for hex_index, _ in REDIS_CLIENT.hscan_iter("user_name_indexes", count = 1000)
+            ]
+
+        except RedisError:
+            log("Username indexes could not be read.", level = 4)
+
+        return None
+
+
+    def get_session_user_key(self, session_key: bytes) -> Optional[bytes]:
+        """
+        Retrieves the key of the user that owns a session.
+
+        Sessions never change their user, so found keys are cached.
+
+        Args:
+            session_key (bytes): The key representing the session id.
+
+        Returns:
+            Optional[bytes]: The key representing the hashed user name,
+                or None if no user has this session.
+        """
+
+        cache_key = "session:" + session_key.hex()
+        use_cache = self._is_cache_usable()
+
+        if use_cache:
+            hex_key = self.cache.get(cache_key)
+            if hex_key is not None:
+                return bytes.fromhex(hex_key)
+
+        try:
+            hex_key = REDIS_CLIENT.hget("session_indexes", session_key.hex())
+        except RedisError:
+            log("Session user key could not be read.", level = 4)
+            return None
+
+        if not hex_key:
+            return None
+
+        if use_cache:
+            self.cache.set(cache_key, hex_key)
+
+        return bytes.fromhex(hex_key)
+
+
+    def _add_to_session_indexes(self, pipeline: Any, hex_key: str,
+                                session_hex: str, session_data: dict) -> None:
+        """
+        Adds a session to the session indexes in a pipeline.
+
+        Args:
+            pipeline (Any): The Redis pipeline.
+            hex_key (str): The user key as a hex string.
+            session_hex (str): The session key as a hex string.
+            session_data (dict): A dictionary containing session information.
+        """
+
+        member = hex_key + ":" + session_hex
+
+        pipeline.hset("session_indexes", session_hex, hex_key)
+        pipeline.zadd("session_expiries", {member: session_data.get("time", 0)})
+        for index_name in get_session_index_names(session_data):
+            pipeline.sadd(index_name, member)
+
+
+    def _remove_from_session_indexes(self, pipeline: Any, hex_key: str, session_hex: str,
+                                     session_data: Optional[dict]) -> None:
+        """
+        Removes a session from the session indexes in a pipeline.
+
+        Args:
+            pipeline (Any): The Redis pipeline.
+            hex_key (str): The user key as a hex string.
+            session_hex (str): The session key as a hex string.
+            session_data (Optional[dict]): A dictionary containing session information,
+                if the session still existed.
+        """
+
+        member = hex_key + ":" + session_hex
+
+        pipeline.hdel("session_indexes", session_hex)
+        pipeline.zrem("session_expiries", member)
+        if session_data is not None:
+            for index_name in get_session_index_names(session_data):
+                pipeline.srem(index_name, member)
+
+        self.cache.delete("session:" + session_hex)
+
+
+    def _get_sessions(self, index_name: str) -> list[Tuple[bytes, bytes]]:
+        try:
+            members = REDIS_CLIENT.smembers(index_name)
+        except RedisError:
+            log("Sessions could not be read.", level = 4)
+            return []
+
+        sessions = []
+        for member in members:
+            hex_key, session_hex = member.split(":", 1)
+            sessions.append((bytes.fromhex(hex_key), bytes.fromhex(session_hex)))
+
+        return sessions
+
+
+    def get_sessions_by_ip(self, ip_address: str) -> list[Tuple[bytes, bytes]]:
+        """
+        Retrieves all sessions created from an IP address through its `ip_sessions` set.
+
+        Args:
+            ip_address (str): The IP address.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the sessions.
+        """
+
+        return self._get_sessions(get_session_index_names({"ip": ip_address})[0])
+
+
+    def get_sessions_by_user_agent(self, operating_system: Optional[str],
+                                   browser: Optional[str]) -> list[Tuple[bytes, bytes]]:
+        """
+        Retrieves all sessions created with an operating system and browser
+        through their `user_agent_sessions` set.
+
+        Args:
+            operating_system (Optional[str]): The operating system, see `get_os_and_browser`.
+            browser (Optional[str]): The browser, see `get_os_and_browser`.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the sessions.
+        """
+
+        return self._get_sessions(get_session_index_names(
+            {"os": operating_system, "browser": browser}
+        )[1])
+
+
+    def add_session(self, key: bytes, session_key: bytes, session_data: dict) -> bool:
+        """
+        Adds a session field to the session hash of a user.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the hashed session id.
+            session_data (dict): A dictionary containing session information.
+
+        Returns:
+            bool: True if the session was added, False otherwise.
+        """
+
+        hex_key = key.hex()
+
+        try:
+            with REDIS_CLIENT.pipeline() as pipeline:
+                pipeline.hset(
+                    "user_sessions:" + hex_key, session_key.hex(),
+                    encode_redis_session(session_data)
+                )
+                self._add_to_session_indexes(pipeline, hex_key, session_key.hex(), session_data)
+                self._publish(pipeline, hex_key)
+                pipeline.execute()
+
+        except RedisError:
+            log("Session could not be written.", level = 4)
+            return False
+
+        return True
+
+
+    def remove_session(self, key: bytes, session_key: bytes) -> bool:
+        """
+        Removes a session field from the session hash of a user.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            session_key (bytes): The key representing the session id.
+
+        Returns:
+            bool: True if the session existed and was removed, False otherwise.
+        """
+
+        hex_key, session_hex = key.hex(), session_key.hex()
+
+        try:
+            encoded_session = REDIS_CLIENT.hget("user_sessions:" + hex_key, session_hex)
+            session_data = decode_redis_session(encoded_session) if encoded_session else None
+
+            with REDIS_CLIENT.pipeline() as pipeline:
+                pipeline.hdel("user_sessions:" + hex_key, session_hex)
+                self._remove_from_session_indexes(pipeline, hex_key, session_hex, session_data)
+                self._publish(pipeline, hex_key)
+                removed_count = pipeline.execute()[0]
+
+        except (RedisError, JSONDecodeError, ValueError):
+            log("Session could not be removed.", level = 4)
+            return False
+
+        return removed_count > 0
+
+
+    def expire_sessions(self, before: int, limit: int = 1000) -> list[Tuple[bytes, bytes]]:
+        """
+        Removes sessions created before a point in time through the
+        `session_expiries` sorted set, oldest first.
+
+        Every member is claimed with ZREM first, so a session that several
+        workers sweep at once is removed and reported by only one of them.
+
+        Args:
+            before (int): The Unix time before which sessions expire.
+            limit (int): The maximum number of sessions to remove.
+
+        Returns:
+            list[Tuple[bytes, bytes]]: The user keys and session keys of the removed sessions.
+        """
+
+        try:
+            members = REDIS_CLIENT.zrangebyscore(
+                "session_expiries", "-inf", f"({before}", start = 0, num = limit
+            )
+            if not members:
+                return []
+
+            with REDIS_CLIENT.pipeline(transaction = False) as pipeline:
+                for member in members:
+                    pipeline.zrem("session_expiries", member)
+
+                claimed = [
+                    member.split(":", 1)
+                    for member, removed_count in zip(members, pipeline.execute())
+                    if removed_count
+                ]
+
+                for hex_key, session_hex in claimed:
+                    pipeline.hget("user_sessions:" + hex_key, session_hex)
+
+                encoded_sessions = pipeline.execute()
+
+            expired = []
+            with REDIS_CLIENT.pipeline() as pipeline:
+                for (hex_key, session_hex), encoded_session in zip(claimed, encoded_sessions):
+                    session_data = decode_redis_session(encoded_session) \
+                        if encoded_session else None
+
+                    pipeline.hdel("user_sessions:" + hex_key, session_hex)
+                    self._remove_from_session_indexes(pipeline, hex_key, session_hex, session_data)
+
+                    expired.append((bytes.fromhex(hex_key), bytes.fromhex(session_hex)))
+
+                for hex_key in {hex_key for hex_key, _ in claimed}:
+                    self._publish(pipeline, hex_key)
+
+                pipeline.execute()
+
+        except (RedisError, JSONDecodeError, ValueError):
+            log("Expired sessions could not be removed.", level = 4)
+            return []
+
+        return expired
+
+
+    def set_user_name_index(self, key: bytes, user_name_index: bytes) -> bool:
+        """
+        Sets only the blind index field of the hash of a user that has none yet.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            user_name_index (bytes): The blind index of the username.
+
+        Returns:
+            bool: True if the blind index was stored, False if the user does not
+                exist, already has a blind index or the index belongs to another user.
+        """
+
+        hex_key = key.hex()
+
+        try:
+            is_stored = self._set_user_name_index_script(keys = ["user:" + hex_key], args = [
+                user_name_index.hex(), encode_redis_value(user_name_index), hex_key
+            ])
+            if not is_stored:
+                return False
+
+            with REDIS_CLIENT.pipeline() as pipeline:
+                self._publish(pipeline, hex_key)
+                pipeline.execute()
+
+        except RedisError:
+            log("Username index could not be updated.", level = 4)
+            return False
+
+        return True
+
+
+    def set_password(self, key: bytes, hashed_password: Union[str, bytes],
+                     previous_hashed_password: Union[str, bytes]) -> bool:
+        """
+        Sets only the password field of the hash of a user.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            hashed_password (Union[str, bytes]): The new password hash.
+            previous_hashed_password (Union[str, bytes]): The hash that has
+                to be stored for the password to be replaced.
+
+        Returns:
+            bool: True if the password hash was replaced, False otherwise.
+        """
+
+        hex_key = key.hex()
+
+        try:
+            is_replaced = self._set_password_script(keys = ["user:" + hex_key], args = [
+                encode_redis_value(previous_hashed_password), encode_redis_value(hashed_password)
+            ])
+            if not is_replaced:
+                return False
+
+            with REDIS_CLIENT.pipeline() as pipeline:
+                self._publish(pipeline, hex_key)
+                pipeline.execute()
+
+        except RedisError:
+            log("Password could not be updated.", level = 4)
+            return False
+
+        return True
+
+
+    def __setitem__(self, key: bytes, value: dict) -> None:
+        """
+        Replaces the hash of a user and its sessions, so sessions missing
+        from the record are removed from the session indexes as well.
+
+        Args:
+            key (bytes): The key representing the hashed user name.
+            value (dict): A dictionary containing user information.
+        """
+
+        store_avatar(value)
+
+        hex_key = key.hex()
+        user_fields = {
+            field: encode_redis_value(field_value)
+            for field, field_value in value.items()
+            if field != "sessions" and field_value is not None
+        }
+        sessions = value.get("sessions", {})
+
+        user_name_index = value.get("user_name_index", None)
+
+        try:
+            previous_sessions = {
+                session_hex: decode_redis_session(encoded_session)
+                for session_hex, encoded_session
+                in REDIS_CLIENT.hgetall("user_sessions:" + hex_key).items()
+            }
+
+            with REDIS_CLIENT.pipeline() as pipeline:
+                pipeline.delete("user:" + hex_key)
+                pipeline.hset("user:" + hex_key, mapping = user_fields)
+
+                pipeline.delete("user_sessions:" + hex_key)
+                for session_hex, session_data in previous_sessions.items():
+                    self._remove_from_session_indexes(pipeline, hex_key, session_hex, session_data)
+
+                if sessions:
+                    pipeline.hset("user_sessions:" + hex_key, mapping = {
+                        session_key.hex(): encode_redis_session(session_data)
+                        for session_key, session_data in sessions.items()
+                    })
+
+                for session_key, session_data in sessions.items():
+                    self._add_to_session_indexes(pipeline, hex_key, session_key.hex(), session_data)
+
+                if isinstance(user_name_index, bytes):
+                    pipeline.hset("user_name_indexes", user_name_index.hex(), hex_key)
+                    pipeline.srem("unindexed_users", hex_key)
+                else:
+                    pipeline.sadd("unindexed_users", hex_key)
+
+                self._publish(pipeline, hex_key)
+                pipeline.execute()
+
+        except (RedisError, JSONDecodeError, ValueError):
+            log("User could not be written.", level = 4)
+
+
+    def __getitem__(self, key: bytes) -> Optional[dict]:
+        """
+        Retrieves a user record, from the cache if possible.
+
+        Args:
+            key (bytes): The key representing the hashed user name of the user to retrieve.
+
+        Returns:
+            Optional[dict]: A dictionary containing user information if found,
+                or None if the key does not exist.
+        """
+
+        hex_key = key.hex()
+        use_cache = self._is_cache_usable()
+
+        if use_cache:
+            cached_user_data = self.cache.get(hex_key)
+            if cached_user_data is not None:
+                return cached_user_data
+
+        generation = self._generation
+
+        try:
+            with REDIS_CLIENT.pipeline(transaction = False) as pipeline:
+                pipeline.hgetall("user:" + hex_key)
+                pipeline.hgetall("user_sessions:" + hex_key)
+                user_fields, session_fields = pipeline.execute()
+
+            if not user_fields:
+                return None
+
+            user_data = {
+                field: decode_redis_value(value)
+                for field, value in user_fields.items()
+            }
+
+            if session_fields:
+                user_data["sessions"] = {
+                    bytes.fromhex(session_key): decode_redis_session(encoded_session)
+                    for session_key, encoded_session in session_fields.items()
+                }
+
+        except (RedisError, JSONDecodeError, ValueError):
+            log("User could not be read.", level = 4)
+            return None
+
+        if use_cache and generation == self._generation:
+            self.cache.set(hex_key, user_data)
+
+        return user_data
+
+
+def create_users(storage: str = USER_STORAGE) -> BaseUsers:
+    """
+    Creates the user storage engine selected by the `USER_STORAGE` setting.
+
+    Args:
+        storage (str): The name of the storage engine, "pickle", "sqlite" or "redis".
+
+    Returns:
+        BaseUsers: The storage engine.
+    """
+
+    if storage == "sqlite":
+        return SQLiteUsers()
+
+    if storage == "redis":
+        return RedisUsers()
+
+    if storage != "pickle":
+        log(f"Unknown user storage `{storage}`, using pickle.", level = 3)
+
+    return Users()
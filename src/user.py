@@ -5,21 +5,43 @@ A module for managing user authentication, session handling, and security featur
 including username and password validation, two-factor authentication, and session creation.
 """
 
-from os import path
 from math import log2
 from time import time
-from typing import Final, Optional, Tuple, Any
+from os import environ
+from hmac import compare_digest
+from threading import Thread
+from typing import Final, Optional, Union, Tuple, Any
 from re import Pattern, compile as reg_compile, match
 
+from redis import RedisError
+
 try:
+    from src.logger import log
+    from src.metrics import METRICS
+    from src.state import get_time_to_live
     from src.user_agent import get_os_and_browser
-    from src.crypto import TOTP, SHA256, generate_base32_secret
-    from src.utils import PICKLE, DATA_DIRECTORY_PATH, Error, generate_random_string
+    from src.hashing import HASHING_POOL, HashingPool, HashingBusyError
+    from src.ddos_mitigation import charge_kdf_budget
+    from src.crypto import TOTP, SHA256, generate_base32_secret, hmac_sha256
+    from src.storage import AVATARS, BaseUsers, create_users
+    from src.utils import (
+        REDIS_CLIENT, Error, PeriodicTask, CountingBloomFilter,
+        generate_random_string, load_secret_key
+    )
     from src.errors import ENTER_UN_ERROR, ENTER_PWD_ERROR, UN_OR_PWD_NOT_RIGHT_ERROR
 except (ModuleNotFoundError, ImportError):
+    from logger import log
+    from metrics import METRICS
+    from state import get_time_to_live
     from user_agent import get_os_and_browser
-    from crypto import TOTP, SHA256, generate_base32_secret
-    from utils import PICKLE, DATA_DIRECTORY_PATH, Error, generate_random_string
+    from hashing import HASHING_POOL, HashingPool, HashingBusyError
+    from ddos_mitigation import charge_kdf_budget
+    from crypto import TOTP, SHA256, generate_base32_secret, hmac_sha256
+    from storage import AVATARS, BaseUsers, create_users
+    from utils import (
+        REDIS_CLIENT, Error, PeriodicTask, CountingBloomFilter,
+        generate_random_string, load_secret_key
+    )
     from errors import ENTER_UN_ERROR, ENTER_PWD_ERROR, UN_OR_PWD_NOT_RIGHT_ERROR
 
 
@@ -40,18 +62,150 @@ PASSWORD_QUALITIES: Final[dict] = {
     (140, float('inf')): "Excellent",
 }
 
+PASSWORD_ITERATIONS_RAW: str = environ.get("PASSWORD_ITERATIONS", "")
+PASSWORD_ITERATIONS: int = 100000
+if PASSWORD_ITERATIONS_RAW.isdigit() and int(PASSWORD_ITERATIONS_RAW) > 0:
+    PASSWORD_ITERATIONS = int(PASSWORD_ITERATIONS_RAW)
+
+USER_NAME_ITERATIONS_RAW: str = environ.get("USER_NAME_ITERATIONS", "")
+USER_NAME_ITERATIONS: int = 10000
+if USER_NAME_ITERATIONS_RAW.isdigit() and int(USER_NAME_ITERATIONS_RAW) > 0:
+    USER_NAME_ITERATIONS = int(USER_NAME_ITERATIONS_RAW)
+
+SESSION_TOKEN_ITERATIONS_RAW: str = environ.get("SESSION_TOKEN_ITERATIONS", "")
+SESSION_TOKEN_ITERATIONS: int = 50000
+if SESSION_TOKEN_ITERATIONS_RAW.isdigit() and int(SESSION_TOKEN_ITERATIONS_RAW) > 0:
+    SESSION_TOKEN_ITERATIONS = int(SESSION_TOKEN_ITERATIONS_RAW)
+
 PASSWORD_SHA: Final[SHA256] = SHA256(
-    iterations = 100000, salt_length = 32
+    iterations = PASSWORD_ITERATIONS, salt_length = 32,
+    self_describing = True, legacy_iterations = 100000
+)
+USER_NAME_SHA: Final[SHA256] = SHA256(
+    iterations = USER_NAME_ITERATIONS,
+    self_describing = True, legacy_iterations = 10000
 )
-USER_NAME_SHA: Final[SHA256] = SHA256()
-SESSION_ID_SHA: Final[SHA256] = SHA256()
 SESSION_TOKEN_SHA: Final[SHA256] = SHA256(
-    iterations = 50000, salt_length = 16
+    iterations = SESSION_TOKEN_ITERATIONS, salt_length = 16,
+    self_describing = True, legacy_iterations = 50000
 )
 
-USERS_FILE_PATH: Final[str] = path.join(
-    DATA_DIRECTORY_PATH, "users.pkl"
-)
+USER_NAME_INDEX_KEY: Final[bytes] = load_secret_key("user_name_index")
+SESSION_ID_INDEX_KEY: Final[bytes] = load_secret_key("session_id_index")
+SESSION_TICKET_KEY: Final[bytes] = load_secret_key("session_ticket")
+
+SESSION_TICKET_TTL_RAW: str = environ.get("SESSION_TICKET_TTL", "")
+SESSION_TICKET_TTL: int = 300 # 5 minutes in seconds
+if SESSION_TICKET_TTL_RAW.isdigit():
+    SESSION_TICKET_TTL = int(SESSION_TICKET_TTL_RAW)
+
+SESSION_LIFETIME: Final[int] = get_time_to_live("session")
+
+MAX_SESSIONS_PER_USER_RAW: str = environ.get("MAX_SESSIONS_PER_USER", "")
+MAX_SESSIONS_PER_USER: int = 32
+if MAX_SESSIONS_PER_USER_RAW.isdigit():
+    MAX_SESSIONS_PER_USER = int(MAX_SESSIONS_PER_USER_RAW)
+
+SESSION_SWEEP_INTERVAL_RAW: str = environ.get("SESSION_SWEEP_INTERVAL", "")
+SESSION_SWEEP_INTERVAL: int = 60 # 1 minute in seconds
+if SESSION_SWEEP_INTERVAL_RAW.isdigit():
+    SESSION_SWEEP_INTERVAL = int(SESSION_SWEEP_INTERVAL_RAW)
+SESSION_SWEEP_BATCH_SIZE: Final[int] = 1000
+
+USER_NAME_FILTER_SIZE_RAW: str = environ.get("USER_NAME_FILTER_SIZE", "")
+USER_NAME_FILTER_SIZE: int = 1048576 # 4-bit counters, 512 KiB
+if USER_NAME_FILTER_SIZE_RAW.isdigit():
+    USER_NAME_FILTER_SIZE = int(USER_NAME_FILTER_SIZE_RAW)
+USER_NAME_FILTER_HASH_COUNT: Final[int] = 7
+
+USER_NAME_CHECK_TTL: Final[int] = 3600 # 1 hour in seconds
+USER_NAME_MIGRATION_RECHECK_INTERVAL: Final[int] = 60 # 1 minute in seconds
+
+# Set once no user without a blind index is left, which never changes again
+# because new users always get one. Until then the store is asked at most
+# once per `USER_NAME_MIGRATION_RECHECK_INTERVAL` per worker.
+IS_USER_NAME_MIGRATION_COMPLETE: bool = False
+USER_NAME_MIGRATION_CHECKED_AT: float = 0.0
+
+
+def get_user_name_index(user_name: str) -> Optional[bytes]:
+    """
+    Computes the blind index of a username.
+
+    The blind index is a deterministic HMAC of the username under a server
+    secret, so a user can be found with a single dictionary lookup instead
+    of comparing the username against every salted hash.
+
+    Args:
+        user_name (str): The username to index.
+
+    Returns:
+        Optional[bytes]: The blind index of the username.
+    """
+
+    return hmac_sha256(USER_NAME_INDEX_KEY, user_name)
+
+
+def get_session_index(session_id: str) -> Optional[bytes]:
+    """
+    Computes the key under which a session is stored.
+
+    Like the username blind index, the key is an HMAC of the session id under
+    a server secret, so sessions can be found and collisions checked with a
+    single lookup instead of a key derivation per existing session.
+
+    Args:
+        session_id (str): The session ID.
+
+    Returns:
+        Optional[bytes]: The key of the session.
+    """
+
+    return hmac_sha256(SESSION_ID_INDEX_KEY, session_id)
+
+
+def get_session_ticket(session_key: bytes, session_token: str) -> Optional[str]:
+    """
+    Computes the verified-session ticket of a session and its token.
+
+    The ticket is an HMAC of the session key and the plain token under a
+    server secret, so a stored ticket proves that this token was verified
+    with the key derivation before, without storing anything the token
+    could be recovered from.
+
+    Args:
+        session_key (bytes): The key of the session.
+        session_token (str): The session token in plain text.
+
+    Returns:
+        Optional[str]: The ticket as a hex string.
+    """
+
+    ticket = hmac_sha256(SESSION_TICKET_KEY, session_key + session_token.encode("utf-8"))
+    if not isinstance(ticket, bytes):
+        return None
+
+    return ticket.hex()
+
+
+def delete_session_tickets(session_keys: list[bytes]) -> None:
+    """
+    Deletes the verified-session tickets of sessions that were removed.
+
+    Args:
+        session_keys (list[bytes]): The keys of the sessions.
+    """
+
+    if not session_keys:
+        return
+
+    try:
+        REDIS_CLIENT.delete(*(
+            "verified_session:" + session_key.hex()
+            for session_key in session_keys
+        ))
+    except RedisError:
+        log("Verified session tickets could not be deleted.", level = 4)
 
 
 def is_user_name_length_valid(user_name: str) -> bool:
@@ -167,18 +321,24 @@ def is_password_quality_valid(quality: int) -> bool:
     return quality >= PASSWORD_MIN_QUALITY
 
 
-def get_signin_error(user_name: Optional[str], password: Optional[str]) -> Tuple[Optional["User"], Optional[Error]]:
+def get_signin_error(user_name: Optional[str], password: Optional[str],
+                     ip_address: Optional[str] = None) -> Tuple[Optional["User"], Optional[Error]]:
     """
     Validates user sign-in credentials and returns errors if validation fails.
 
     Args:
         user_name (Optional[str]): The user's username.
         password (Optional[str]): The user's password.
+        ip_address (Optional[str]): The IP address of the client.
 
     Returns:
         Tuple[Optional["User"], Optional[Error]]:
             - The authenticated user object if credentials are valid, otherwise `None`.
             - An error object describing the validation failure, otherwise `None`.
+
+    Raises:
+        HashingBusyError: If users stored before blind indexes existed have
+            to be compared and the budget or the hashing pool is exhausted.
     """
 
     if not isinstance(user_name, str):
@@ -190,7 +350,7 @@ def get_signin_error(user_name: Optional[str], password: Optional[str]) -> Tuple
     if not is_user_name_characters_valid(user_name):
         return None, UN_OR_PWD_NOT_RIGHT_ERROR
 
-    user = get_user_based_on_user_name(user_name)
+    user = get_user_based_on_user_name(user_name, ip_address)
     if not user:
         return None, UN_OR_PWD_NOT_RIGHT_ERROR
 
@@ -208,85 +368,10 @@ def get_signin_error(user_name: Optional[str], password: Optional[str]) -> Tuple
     return user, None
 
 
-class Users(dict):
-    """
-    A class to manage user data stored in a file.
-
-    Attributes:
-        file_path (str): The path to the file where user data is stored.
-        users (Optional[dict]): A dictionary containing user data.
-    """
-
-
-    def __init__(self, file_path: Optional[str] = None) -> None:
-        """
-        Initializes the Users class with a specified file path.
-
-        Args:
-            file_path (Optional[str]): The path to the file containing user data. 
-                Defaults to None.
-        """
-
-        if not file_path:
-            file_path = USERS_FILE_PATH
-
-        self.file_path = file_path
-        self.users: dict = {}
-
-        self.load()
-
-
-    def load(self) -> dict:
-        """
-        Loads user data from the specified file.
-
-        Returns:
-            dict: A dictionary containing the loaded user data.
-        """
-
-        users = PICKLE.load(self.file_path, {})
-        self.users = users
-
-        return users
-
-
-    def dump(self) -> None:
-        """
-        Saves the current user data to the specified file.
-        """
-
-        PICKLE.dump(self.users, self.file_path)
-
-
-    def __setitem__(self, key: bytes, value: dict) -> None:
-        """
-        Sets a user entry in the users dictionary and saves it to the file.
-
-        Args:
-            key (bytes): The key representing the hashed user name.
-            value (dict): A dictionary containing user information.
-        """
-
-        self.users[key] = value
-        self.dump()
-
-
-    def __getitem__(self, key: bytes) -> Optional[dict]:
-        """
-        Retrieves a user entry from the users dictionary.
-
-        Args:
-            key (bytes): The key representing the hashed user name of the user to retrieve.
-
-        Returns:
-            Optional[dict]: A dictionary containing user information if found, 
-                or None if the key does not exist.
-        """
-
-        return self.users.get(key, None)
-
-
-USERS = Users()
+USERS: Final[BaseUsers] = create_users()
+USER_NAME_FILTER: Final[CountingBloomFilter] = CountingBloomFilter(
+    "user_name_filter", USER_NAME_FILTER_SIZE, USER_NAME_FILTER_HASH_COUNT
+)
 
 
 class User:
@@ -297,35 +382,74 @@ class User:
         user_name (str): The username of the user.
         stored_key (bytes): The hashed user name associated with the user.
         hashed_password (str): The hashed password of the user.
-        avatar (Optional[bytes]): The user's avatar image.
+        avatar_digest (Optional[str]): The digest of the user's avatar in the avatar store.
         display_name (Optional[str]): The user's display name.
         twofa_token (Optional[str]): The user's two-factor authentication token.
         sessions (dict): A dictionary of the user's sessions.
     """
 
+    __slots__ = (
+        "user_name", "stored_key", "hashed_password", "avatar_digest",
+        "display_name", "twofa_token", "sessions"
+    )
+
     def __init__(self, user_name: str, stored_key: bytes, user_data: dict):
         self.user_name = user_name
         self.stored_key = stored_key
         self.hashed_password = user_data["password"]
 
-        self.avatar = user_data.get("avatar", None)
+        self.avatar_digest = user_data.get("avatar", None)
         self.display_name = user_data.get("display_name", None)
         self.twofa_token = user_data.get("twofa_token", None)
         self.sessions = user_data.get("sessions", {})
 
 
+    @property
+    def avatar(self) -> Optional[bytes]:
+        """
+        Reads the user's avatar image from the avatar store.
+
+        Returns:
+            Optional[bytes]: The avatar image, or None if the user has no avatar.
+        """
+
+        if isinstance(self.avatar_digest, bytes): # stored before the avatar store existed
+            return self.avatar_digest
+
+        if not self.avatar_digest:
+            return None
+
+        return AVATARS.get(self.avatar_digest)
+
+
     def is_valid_password(self, password: str) -> bool:
         """
         Verifies if a provided password matches the user's stored hashed password.
 
+        If the stored hash was created with another iteration count than
+        `PASSWORD_ITERATIONS`, the password is hashed again in the background.
+
         Args:
             password (str): The password to verify.
 
         Returns:
             bool: True if the password is valid, otherwise False.
+
+        Raises:
+            HashingBusyError: If the hashing pool is full or too slow.
         """
 
-        return PASSWORD_SHA.compare(password, self.hashed_password)
+        if not HASHING_POOL.compare(PASSWORD_SHA, password, self.hashed_password):
+            return False
+
+        if PASSWORD_SHA.needs_rehash(self.hashed_password):
+            Thread(
+                target = rehash_password,
+                args = (self.stored_key, password, self.hashed_password),
+                daemon = True
+            ).start()
+
+        return True
 
 
 class Session:
@@ -336,13 +460,18 @@ class Session:
         user (User): The associated user.
         session_id (str): The session ID.
         session_token (Optional[str]): The session token in plain text.
-        stored_key (bytes): The hashed key associated with the session.
+        stored_key (bytes): The key of the session, see `get_session_index`.
         hashed_session_token (str): The hashed session token.
         os (str): The operating system of the user during the session.
         browser (str): The browser used during the session.
         ip (str): The IP address of the user during the session.
     """
 
+    __slots__ = (
+        "user", "session_id", "session_token", "stored_key",
+        "hashed_session_token", "os", "browser", "ip"
+    )
+
     def __init__(self, user: User, session_id: str,
                  stored_key: bytes, session_data: dict,
                  session_token: Optional[str] = None) -> None:
@@ -361,37 +490,383 @@ class Session:
         """
         Verifies if a provided session token matches the stored hashed token.
 
+        A successful key derivation stores a verified-session ticket in Redis
+        for `SESSION_TICKET_TTL` seconds, during which the token is checked
+        against the ticket instead. Revoking the session deletes the ticket.
+
         Args:
             session_token (str): The session token to verify.
 
         Returns:
             bool: True if the token is valid, otherwise False.
+
+        Raises:
+            HashingBusyError: If the hashing pool is full or too slow.
         """
 
         if self.session_token:
-            return session_token == self.session_token
+            return compare_digest(session_token, self.session_token)
+
+        ticket = get_session_ticket(self.stored_key, session_token)
+        ticket_key = "verified_session:" + self.stored_key.hex()
+
+        if ticket and SESSION_TICKET_TTL > 0:
+            try:
+                stored_ticket = REDIS_CLIENT.get(ticket_key)
+            except RedisError:
+                stored_ticket = None
+
+            if stored_ticket and compare_digest(stored_ticket, ticket):
+                return True
+
+        if not HASHING_POOL.compare(
+            SESSION_TOKEN_SHA, session_token, self.hashed_session_token):
+
+            return False
+
+        if ticket and SESSION_TICKET_TTL > 0:
+            try:
+                REDIS_CLIENT.set(ticket_key, ticket, ex = SESSION_TICKET_TTL)
+            except RedisError:
+                log("Verified session ticket could not be stored.", level = 3)
+
+        return True
+
+
+    def revoke(self) -> bool:
+        """
+        Removes the session from its user and deletes its verified-session ticket.
+
+        Returns:
+            bool: True if the session existed and was removed, otherwise False.
+        """
+
+        delete_session_tickets([self.stored_key])
+        return USERS.remove_session(self.user.stored_key, self.stored_key)
+
+
+def rehash_password(hashed_user_name: bytes, password: str,
+                    hashed_password: Union[str, bytes]) -> bool:
+    """
+    Replaces a password hash with one that uses the configured iteration count.
+
+    The hash is only replaced if it was not changed in the meantime, and
+    the rehash is skipped if the hashing pool is busy, the next login
+    tries again.
+
+    Args:
+        hashed_user_name (bytes): The key representing the hashed user name.
+        password (str): The verified password in plain text.
+        hashed_password (Union[str, bytes]): The hash that was verified.
+
+    Returns:
+        bool: True if the hash was replaced, otherwise False.
+    """
+
+    try:
+        new_hashed_password = HASHING_POOL.hash(PASSWORD_SHA, password)
+    except HashingBusyError:
+        return False
+
+    if not new_hashed_password:
+        return False
+
+    if not USERS.set_password(hashed_user_name, new_hashed_password, hashed_password):
+        return False
+
+    METRICS.increment("hashing", "password_rehashes")
+    return True
+
+
+def is_user_name_migration_complete() -> bool:
+    """
+    Checks whether every user has a username blind index, without asking
+    the user store on every call.
+
+    Returns:
+        bool: True if no user stored before blind indexes existed is left.
+    """
+
+    global IS_USER_NAME_MIGRATION_COMPLETE, USER_NAME_MIGRATION_CHECKED_AT
+
+    if IS_USER_NAME_MIGRATION_COMPLETE:
+        return True
+
+    if time() - USER_NAME_MIGRATION_CHECKED_AT < USER_NAME_MIGRATION_RECHECK_INTERVAL:
+        return False
+
+    USER_NAME_MIGRATION_CHECKED_AT = time()
+    IS_USER_NAME_MIGRATION_COMPLETE = not USERS.has_unindexed_keys()
+
+    return IS_USER_NAME_MIGRATION_COMPLETE
+
+
+def is_user_name_checked(user_name_index: bytes) -> bool:
+    """
+    Checks whether a username was recently compared with every user stored
+    before blind indexes existed without a match.
+
+    Args:
+        user_name_index (bytes): The blind index of the username.
+
+    Returns:
+        bool: True if the username is known to match none of these users.
+    """
+
+    try:
+        return REDIS_CLIENT.exists("user_name_checked:" + user_name_index.hex()) == 1
+    except RedisError:
+        log("Checked username could not be read.", level = 4)
+
+    return False
+
+
+def set_user_name_checked(user_name_index: bytes) -> None:
+    """
+    Remembers for `USER_NAME_CHECK_TTL` seconds that a username matches none
+    of the users stored before blind indexes existed, so repeated lookups of
+    a name that does not exist do not compare it with all of them again.
+
+    Args:
+        user_name_index (bytes): The blind index of the username.
+    """
+
+    try:
+        REDIS_CLIENT.set("user_name_checked:" + user_name_index.hex(), "1", ex = USER_NAME_CHECK_TTL)
+    except RedisError:
+        log("Checked username could not be stored.", level = 4)
+
+
+def store_migrated_user_name_index(hashed_user_name: bytes, user_name_index: bytes) -> bool:
+    """
+    Stores the blind index of a user found by its salted username hash.
+
+    Args:
+        hashed_user_name (bytes): The key representing the hashed user name.
+        user_name_index (bytes): The blind index of the username.
+
+    Returns:
+        bool: True if the blind index was stored, otherwise False.
+    """
+
+    if not USERS.set_user_name_index(hashed_user_name, user_name_index):
+        return False
+
+    USER_NAME_FILTER.add(user_name_index)
+    METRICS.increment("user_name_migration", "migrated")
+
+    return True
 
-        return SESSION_TOKEN_SHA.compare(session_token, self.hashed_session_token)
 
+def migrate_user_name_index(user_name: str, user_name_index: bytes,
+                            ip_address: Optional[str] = None) -> Optional[bytes]:
+    """
+    Looks up a user stored before username blind indexes existed and,
+    if found, stores the blind index of this one user.
+
+    Salted username hashes cannot be reversed, so the username is compared
+    with every user that has not been migrated yet. The comparisons share
+    the deadline of one hashing call and are charged to the key derivation
+    budget of the IP address, usernames without a match are remembered for
+    a while. Large stores are migrated with `--migrate-user-names`.
+
+    Args:
+        user_name (str): The user's username.
+        user_name_index (bytes): The blind index of the username.
+        ip_address (Optional[str]): The IP address of the client, whose key
+            derivation budget is charged, or None for internal lookups.
+
+    Returns:
+        Optional[bytes]: The key of the migrated user if found, otherwise `None`.
 
-def get_user_based_on_user_name(user_name: str) -> Optional["User"]:
+    Raises:
+        HashingBusyError: If the budget of the IP address is exhausted or
+            the hashing pool is full or too slow.
+    """
+
+    if is_user_name_migration_complete() or is_user_name_checked(user_name_index):
+        return None
+
+    if ip_address is not None and \
+        charge_kdf_budget(user_name_index, ip_address, charge_account = False) is not None:
+
+        raise HashingBusyError("Key derivation budget is exhausted.")
+
+    unindexed_keys = USERS.get_unindexed_keys()
+    matches = HASHING_POOL.compare_many([
+        (USER_NAME_SHA, user_name, unindexed_key)
+        for unindexed_key in unindexed_keys
+    ])
+
+    hashed_user_name = next((
+        unindexed_key for unindexed_key, is_match in zip(unindexed_keys, matches)
+        if is_match
+    ), None)
+
+    if hashed_user_name is None:
+        set_user_name_checked(user_name_index)
+        return None
+
+    if not store_migrated_user_name_index(hashed_user_name, user_name_index):
+        # Another request may have migrated the same user in the meantime.
+        return USERS.get_key(user_name_index)
+
+    return hashed_user_name
+
+
+def migrate_user_names(user_names: list[str], pool: HashingPool = HASHING_POOL) -> int:
+    """
+    Compares usernames with the users stored before blind indexes existed
+    and stores the blind index of every user that is found.
+
+    Unlike `migrate_user_name_index`, the comparisons run in batches of one
+    job per hashing process, each with its own deadline, so stores of any
+    size can be migrated.
+
+    Args:
+        user_names (list[str]): The usernames to look for.
+        pool (HashingPool): The hashing pool for the comparisons.
+
+    Returns:
+        int: The number of migrated users.
+
+    Raises:
+        HashingBusyError: If the hashing pool is full or too slow.
+    """
+
+    unindexed_keys = USERS.get_unindexed_keys()
+    batch_size = max(1, pool.max_workers)
+
+    migrated_count = 0
+    for user_name in user_names:
+        user_name_index = get_user_name_index(user_name)
+        if not isinstance(user_name_index, bytes) or USERS.get_key(user_name_index) is not None:
+            continue
+
+        hashed_user_name = None
+        for start in range(0, len(unindexed_keys), batch_size):
+            batch = unindexed_keys[start:start + batch_size]
+            matches = pool.compare_many([
+                (USER_NAME_SHA, user_name, unindexed_key)
+                for unindexed_key in batch
+            ])
+
+            hashed_user_name = next((
+                unindexed_key for unindexed_key, is_match in zip(batch, matches)
+                if is_match
+            ), None)
+            if hashed_user_name is not None:
+                break
+
+        if hashed_user_name is None:
+            set_user_name_checked(user_name_index)
+            continue
+
+        if store_migrated_user_name_index(hashed_user_name, user_name_index):
+            unindexed_keys.remove(hashed_user_name)
+            migrated_count += 1
+
+    return migrated_count
+
+
+def get_user_based_on_user_name(user_name: str,
+                                ip_address: Optional[str] = None) -> Optional["User"]:
     """
     Retrieves a user object by username.
 
     Args:
         user_name (str): The user's username.
+        ip_address (Optional[str]): The IP address of the client, charged if
+            users stored before blind indexes existed have to be compared.
 
     Returns:
         Optional[User]: The user object if found, otherwise `None`.
+
+    Raises:
+        HashingBusyError: If users stored before blind indexes existed have
+            to be compared and the budget or the hashing pool is exhausted.
     """
 
-    for hashed_user_name, user_data in USERS.users.items():
-        if not USER_NAME_SHA.compare(user_name, hashed_user_name):
-            continue
+    user_name_index = get_user_name_index(user_name)
+    if not isinstance(user_name_index, bytes):
+        return None
+
+    hashed_user_name = USERS.get_key(user_name_index)
+    if hashed_user_name is None:
+        hashed_user_name = migrate_user_name_index(user_name, user_name_index, ip_address)
+        if hashed_user_name is None:
+            return None
 
-        return User(user_name, hashed_user_name, user_data)
+    user_data = USERS[hashed_user_name]
+    if not user_data:
+        return None
+
+    return User(user_name, hashed_user_name, user_data)
+
+
+def get_user_based_on_key(user_name: str, hashed_user_name: bytes) -> Optional["User"]:
+    """
+    Retrieves a user object by the key of an already resolved user.
+
+    Args:
+        user_name (str): The user's username.
+        hashed_user_name (bytes): The key representing the hashed user name.
+
+    Returns:
+        Optional[User]: The user object if found, otherwise `None`.
+    """
+
+    user_data = USERS[hashed_user_name]
+    if not user_data:
+        return None
+
+    return User(user_name, hashed_user_name, user_data)
+
+
+def rebuild_user_name_filter() -> bool:
+    """
+    Rebuilds the username filter from the blind indexes in the user store.
+
+    Users stored before blind indexes existed cannot be added until they
+    are migrated, `is_user_name_taken` checks their names separately.
+
+    Returns:
+        bool: True if the filter was rebuilt, otherwise False.
+    """
 
-    return None
+    return USER_NAME_FILTER.rebuild(USERS.get_user_name_indexes())
+
+
+def is_user_name_taken(user_name: str) -> bool:
+    """
+    Checks whether a username is already taken.
+
+    Names the username filter has never seen are free without a lookup,
+    only possible matches are looked up by their blind index. Salted hashes
+    are never compared here, so users stored before blind indexes existed
+    count only once they are migrated; `create_user` checks them as well.
+
+    Args:
+        user_name (str): The username to check.
+
+    Returns:
+        bool: True if a user with this username exists, otherwise False.
+    """
+
+    user_name_index = get_user_name_index(user_name)
+    if not isinstance(user_name_index, bytes):
+        return True
+
+    if not USER_NAME_FILTER.might_contain(user_name_index):
+        METRICS.increment("user_name_filter", "definite_negatives")
+        return False
+
+    if USERS.get_key(user_name_index) is not None:
+        METRICS.increment("user_name_filter", "taken")
+        return True
+
+    METRICS.increment("user_name_filter", "false_positives")
+    return False
 
 
 def create_user(user_name: str, password: str,
@@ -410,17 +885,29 @@ def create_user(user_name: str, password: str,
 
     Returns:
         Optional[User]: The created user object, or `None` if the username already exists.
+
+    Raises:
+        HashingBusyError: If the hashing pool is full or too slow.
     """
 
-    if get_user_based_on_user_name(user_name):
+    # The username filter can miss names, e.g. after a failed update or a
+    # rebuild that raced with a signup, so it only serves the availability check.
+    if get_user_based_on_user_name(user_name) is not None:
         return None
 
-    password_hash = PASSWORD_SHA.hash(password)
-    if not password_hash:
+    password_hash, hashed_user_name = HASHING_POOL.hash_many([
+        (PASSWORD_SHA, password), (USER_NAME_SHA, user_name)
+    ])
+    if not password_hash or not isinstance(hashed_user_name, bytes):
+        return None
+
+    user_name_index = get_user_name_index(user_name)
+    if not isinstance(user_name_index, bytes):
         return None
 
     user_data = {
         "password": password_hash,
+        "user_name_index": user_name_index,
     }
 
     additional_data = [
@@ -433,11 +920,8 @@ def create_user(user_name: str, password: str,
         if value is not None:
             user_data[key] = value
 
-    hashed_user_name = USER_NAME_SHA.hash(user_name)
-    if not isinstance(hashed_user_name, bytes):
-        return None
-
     USERS[hashed_user_name] = user_data
+    USER_NAME_FILTER.add(user_name_index)
 
     user = User(
         user_name, hashed_user_name,
@@ -458,12 +942,31 @@ def create_session(user: User, user_agent: str, ip_address: str) -> Optional["Se
 
     Returns:
         Session: The newly created session object.
+
+    Raises:
+        HashingBusyError: If the hashing pool is full or too slow.
     """
 
     operating_system, browser = get_os_and_browser(user_agent)
 
+    SESSION_SWEEPER.start()
+
+    user_data = USERS[user.stored_key]
+    if not user_data:
+        return None
+
+    evict_oldest_sessions(user.stored_key, user_data.get("sessions", {}))
+
+    session_id, session_key = None, None
+    while not session_id or USERS.get_session_user_key(session_key) is not None:
+        session_id = generate_random_string(6, "aA0")
+
+        session_key = get_session_index(session_id)
+        if not isinstance(session_key, bytes):
+            return None
+
     session_token = generate_random_string(32, "aA0")
-    hashed_session_token = SESSION_TOKEN_SHA.hash(session_token)
+    hashed_session_token = HASHING_POOL.hash(SESSION_TOKEN_SHA, session_token)
     if not hashed_session_token:
         return None
 
@@ -475,42 +978,184 @@ def create_session(user: User, user_agent: str, ip_address: str) -> Optional["Se
         "time": int(time())
     }
 
-    user_data = USERS[user.stored_key]
-    if not user_data:
+    if not USERS.add_session(user.stored_key, session_key, session_data):
         return None
 
-    sessions = user_data.get("sessions", {})
+    return Session(
+        user, session_id,
+        session_key, session_data,
+        session_token
+    )
+
 
-    session_id = None
-    while not session_id or any(
-            SESSION_ID_SHA.compare(session_id, current_session_id)
-            for current_session_id in sessions
-        ):
+def get_session_from_state(state_data: dict) -> Optional["Session"]:
+    """
+    Resolves the session stored in the data of a `session` state and verifies its token.
 
-        session_id = generate_random_string(6, "aA0")
+    Args:
+        state_data (dict): The data of the state, with the session ID,
+            the session token and the username.
+
+    Returns:
+        Optional[Session]: The session object if it exists and the token is valid,
+            otherwise `None`.
 
-    hashed_session_id = SESSION_ID_SHA.hash(session_id)
-    if not isinstance(hashed_session_id, bytes):
+    Raises:
+        HashingBusyError: If the hashing pool is full or too slow.
+    """
+
+    SESSION_SWEEPER.start()
+
+    session_id = state_data.get("session_id", None)
+    session_token = state_data.get("session_token", None)
+    user_name = state_data.get("user_name", None)
+
+    if not all(isinstance(value, str) for value in (session_id, session_token, user_name)):
         return None
 
-    sessions[hashed_session_id] = session_data
-    user_data["sessions"] = sessions
+    session_key = get_session_index(session_id)
+    if not isinstance(session_key, bytes):
+        return None
 
-    USERS[user.stored_key] = user_data
+    hashed_user_name = USERS.get_session_user_key(session_key)
+    if hashed_user_name is None:
+        return None
 
-    return Session(
-        user, session_id,
-        hashed_session_id, session_data,
-        session_token
+    user_data = USERS[hashed_user_name]
+    if not user_data:
+        return None
+
+    session_data = user_data.get("sessions", {}).get(session_key, None)
+    if not session_data:
+        return None
+
+    if user_data.get("user_name_index", None) != get_user_name_index(user_name):
+        return None
+
+    session = Session(
+        User(user_name, hashed_user_name, user_data),
+        session_id, session_key, session_data
     )
+    if not session.is_valid_token(session_token):
+        return None
+
+    return session
+
+
+def revoke_sessions(sessions: list[Tuple[bytes, bytes]]) -> int:
+    """
+    Removes sessions and deletes their verified-session tickets.
+
+    Args:
+        sessions (list[Tuple[bytes, bytes]]): The user keys and session keys of the sessions.
+
+    Returns:
+        int: The number of removed sessions.
+    """
+
+    revoked_session_keys = [
+        session_key for hashed_user_name, session_key in sessions
+        if USERS.remove_session(hashed_user_name, session_key)
+    ]
+
+    delete_session_tickets(revoked_session_keys)
+    METRICS.increment("sessions", "revoked", len(revoked_session_keys))
 
+    return len(revoked_session_keys)
 
-def verify_twofa(user_name: str, token: Optional[Any] = None) -> bool:
+
+def revoke_sessions_by_ip(ip_address: str) -> int:
+    """
+    Removes all sessions created from an IP address.
+
+    Args:
+        ip_address (str): The IP address.
+
+    Returns:
+        int: The number of removed sessions.
+    """
+
+    return revoke_sessions(USERS.get_sessions_by_ip(ip_address))
+
+
+def revoke_sessions_by_user_agent(operating_system: Optional[str],
+                                  browser: Optional[str]) -> int:
+    """
+    Removes all sessions created with an operating system and browser.
+
+    Args:
+        operating_system (Optional[str]): The operating system, see `get_os_and_browser`.
+        browser (Optional[str]): The browser, see `get_os_and_browser`.
+
+    Returns:
+        int: The number of removed sessions.
+    """
+
+    return revoke_sessions(USERS.get_sessions_by_user_agent(operating_system, browser))
+
+
+def evict_oldest_sessions(hashed_user_name: bytes, sessions: dict) -> int:
+    """
+    Removes the oldest sessions of a user so that a new session
+    fits into `MAX_SESSIONS_PER_USER`.
+
+    Args:
+        hashed_user_name (bytes): The key representing the hashed user name.
+        sessions (dict): The current sessions of the user.
+
+    Returns:
+        int: The number of removed sessions.
+    """
+
+    if MAX_SESSIONS_PER_USER <= 0 or len(sessions) < MAX_SESSIONS_PER_USER:
+        return 0
+
+    oldest_session_keys = sorted(
+        sessions, key = lambda session_key: sessions[session_key].get("time", 0)
+    )[:len(sessions) - MAX_SESSIONS_PER_USER + 1]
+
+    evicted_session_keys = [
+        session_key for session_key in oldest_session_keys
+        if USERS.remove_session(hashed_user_name, session_key)
+    ]
+
+    delete_session_tickets(evicted_session_keys)
+    METRICS.increment("sessions", "evicted", len(evicted_session_keys))
+
+    return len(evicted_session_keys)
+
+
+def expire_sessions() -> int:
+    """
+    Removes all sessions that are older than the lifetime of the session state.
+
+    Returns:
+        int: The number of removed sessions.
+    """
+
+    before = int(time()) - SESSION_LIFETIME
+
+    expired_count = 0
+    while True:
+        expired = USERS.expire_sessions(before, SESSION_SWEEP_BATCH_SIZE)
+
+        delete_session_tickets([session_key for _, session_key in expired])
+        METRICS.increment("sessions", "expired", len(expired))
+
+        expired_count += len(expired)
+        if len(expired) < SESSION_SWEEP_BATCH_SIZE:
+            return expired_count
+
+
+SESSION_SWEEPER: Final[PeriodicTask] = PeriodicTask(expire_sessions, SESSION_SWEEP_INTERVAL)
+
+
+def verify_twofa(user: User, token: Optional[Any] = None) -> bool:
     """
     Verifies a two-factor authentication (2FA) token.
 
     Args:
-        user_name (str): The username of the user.
+        user (User): The user object.
         token (Optional[Any]): The 2FA token to verify.
 
     Returns:
@@ -520,8 +1165,7 @@ def verify_twofa(user_name: str, token: Optional[Any] = None) -> bool:
     if not isinstance(token, str) or len(token) != 6 or not token.isdigit():
         return False
 
-    user = get_user_based_on_user_name(user_name)
-    if not user:
+    if not user.twofa_token:
         return False
 
     twofa_token = user.twofa_token
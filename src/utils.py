@@ -6,19 +6,26 @@ including random string generation, file read/write operations, environment vari
 loading, and specialized file serialization classes.
 """
 
-from threading import Lock
+from time import sleep, time
+from zlib import crc32
+from hashlib import sha256
+from struct import Struct
+from contextlib import contextmanager
+from threading import Lock, Condition, Thread
+from fcntl import flock, LOCK_EX, LOCK_SH, LOCK_NB, LOCK_UN
 from functools import wraps
+from collections import OrderedDict
 from base64 import b64encode
 from io import TextIOWrapper
 from shutil import copy2, move
-from secrets import choice, randbelow, token_hex
-from typing import Final, Optional, Callable, Any
-from os import unlink, fsync, makedirs, path, environ
+from secrets import choice, randbelow, token_hex, token_bytes
+from typing import Final, Optional, Callable, Tuple, Any
+from os import unlink, fsync, makedirs, path, environ, rename, truncate, getpid
 from json import load as json_load, dump as json_dump
 from pickle import load as pickle_load, dump as pickle_dump, \
     loads as pickle_loads, dumps as pickle_dumps
 
-from redis import StrictRedis
+from redis import StrictRedis, RedisError
 from flask import Response
 
 try:
@@ -28,6 +35,7 @@ except ModuleNotFoundError:
 
 
 REDIS_CLIENT: Final[StrictRedis] = StrictRedis(host='127.0.0.1', port=6379, decode_responses=True)
+REDIS_BYTES_CLIENT: Final[StrictRedis] = StrictRedis(host='127.0.0.1', port=6379)
 
 CURRENT_DIRECTORY_PATH: Final[str] = path.dirname(path.abspath(__file__)) \
     .replace("\\", "/").replace("//", "/").replace("src", "").replace("//", "/")
@@ -51,6 +59,9 @@ ALLOWED_PATHS: Final[list[str]] = [
 
 FILE_LOCKS: dict[str, Lock] = {}
 
+JOURNAL_HEADER: Final[Struct] = Struct(">II")
+JOURNAL_SYNC_TIMEOUT: Final[float] = 5
+
 
 for directory_path in [ASSETS_DIRECTORY_PATH, DATA_DIRECTORY_PATH]:
     if path.exists(directory_path):
@@ -533,6 +544,31 @@ def load_dotenv(file_name: str = ".env") -> None:
             environ[key.strip()] = value
 
 
+def load_secret_key(key_name: str, length: int = 32) -> bytes:
+    """
+    Load a server secret from the data directory, generating it on first use.
+
+    Args:
+        key_name (str): The name of the secret, used as the file name.
+        length (int): The length of a newly generated secret in bytes.
+
+    Returns:
+        bytes: The stored or newly generated secret.
+    """
+
+    file_path = path.join(DATA_DIRECTORY_PATH, key_name + ".key")
+
+    if path.isfile(file_path):
+        secret_key = read_bytes(file_path)
+        if secret_key and len(secret_key) == length:
+            return secret_key
+
+    secret_key = token_bytes(length)
+    write_bytes(secret_key, file_path)
+
+    return secret_key
+
+
 def convert_image_to_base64(image_data: bytes) -> str:
     """
     Converts an image into Base64 Web Format.
@@ -582,6 +618,299 @@ class Error:
         self.fields = fields
 
 
+class LRUCache:
+    """
+    A thread-safe, size-bounded cache that evicts the least recently used entry.
+    Entries can have an expiry time, after which they count as missing.
+
+    Attributes:
+        max_size (int): The maximum number of entries.
+        hits (int): The number of lookups that found an entry.
+        misses (int): The number of lookups that found no entry.
+    """
+
+
+    def __init__(self, max_size: int = 1024) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._entries: OrderedDict = OrderedDict()
+
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """
+        Retrieves an entry and marks it as recently used.
+
+        Args:
+            key (Any): The key of the entry.
+            default (Any): The value to return if there is no entry.
+
+        Returns:
+            Any: The cached value or the default value.
+        """
+
+        with self._lock:
+            value, expires_at = self._entries.get(key, (None, None))
+            if key not in self._entries or (expires_at is not None and expires_at <= time()):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+
+    def set(self, key: Any, value: Any, expires_at: Optional[float] = None) -> None:
+        """
+        Stores an entry, evicting the least recently used one if the cache is full.
+
+        Args:
+            key (Any): The key of the entry.
+            value (Any): The value to cache.
+            expires_at (Optional[float]): The Unix time at which the entry
+                expires, or None if it does not expire.
+        """
+
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+
+
+    def delete(self, key: Any) -> None:
+        """
+        Removes an entry if it exists.
+
+        Args:
+            key (Any): The key of the entry.
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+    def clear(self) -> None:
+        """
+        Removes all entries.
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+
+class PeriodicTask:
+    """
+    Runs a function in a daemon thread at a fixed interval.
+
+    Threads do not survive a fork, so `start` can be called on every use and
+    starts the thread once in each process, e.g. once per Gunicorn worker.
+
+    Attributes:
+        function (Callable[[], Any]): The function to run.
+        interval (float): The number of seconds between two runs.
+    """
+
+
+    def __init__(self, function: Callable[[], Any], interval: float) -> None:
+        self.function = function
+        self.interval = interval
+
+        self._lock = Lock()
+        self._pid: Optional[int] = None
+
+
+    def _run(self) -> None:
+        while True:
+            sleep(self.interval)
+
+            try:
+                self.function()
+            except Exception:
+                log(f"Periodic task `{self.function.__name__}` failed.", level = 4)
+
+
+    def start(self) -> None:
+        """
+        Starts the thread of the current process if it is not running yet.
+        """
+
+        if self.interval <= 0 or self._pid == getpid():
+            return
+
+        with self._lock:
+            if self._pid == getpid():
+                return
+
+            Thread(target = self._run, daemon = True).start()
+            self._pid = getpid()
+
+
+class CountingBloomFilter:
+    """
+    A counting Bloom filter stored in Redis as an array of 4-bit counters,
+    shared by all workers and updated with BITFIELD.
+
+    A lookup that finds a zero counter proves the item was never added,
+    any other lookup means the item might have been added. The filter only
+    exists after `rebuild`, until then every item might have been added.
+
+    Attributes:
+        name (str): The Redis key of the counters.
+        size (int): The number of counters.
+        hash_count (int): The number of counters per item.
+    """
+
+    # Runs BITFIELD only if the filter has been built, so an update cannot
+    # create a filter that is missing the items added before.
+    UPDATE_SCRIPT: Final[str] = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return false
+end
+return redis.call("BITFIELD", KEYS[1], unpack(ARGV))
+"""
+
+
+    def __init__(self, name: str, size: int = 1048576, hash_count: int = 7) -> None:
+        self.name = name
+        self.size = max(size, 2)
+        self.hash_count = max(hash_count, 1)
+
+        self._update_script = REDIS_CLIENT.register_script(self.UPDATE_SCRIPT)
+
+
+    def _get_positions(self, item: bytes) -> list[int]:
+        digest = sha256(item).digest()
+        first_hash = int.from_bytes(digest[:8], "big")
+        second_hash = int.from_bytes(digest[8:16], "big") | 1
+
+        return [
+            (first_hash + index * second_hash) % self.size
+            for index in range(self.hash_count)
+        ]
+
+
+    def _update(self, item: bytes, amount: int) -> bool:
+        arguments = ["OVERFLOW", "SAT"]
+        for position in self._get_positions(item):
+            arguments.extend(("INCRBY", "u4", f"#{position}", amount))
+
+        try:
+            self._update_script(keys = [self.name], args = arguments)
+        except RedisError:
+            log(f"Bloom filter `{self.name}` could not be updated.", level = 4)
+            return False
+
+        return True
+
+
+    def add(self, item: bytes) -> bool:
+        """
+        Adds an item to the filter.
+
+        Args:
+            item (bytes): The item to add.
+
+        Returns:
+            bool: True if the filter was updated or has not been built yet,
+                otherwise False.
+        """
+
+        return self._update(item, 1)
+
+
+    def remove(self, item: bytes) -> bool:
+        """
+        Removes an item that was added before from the filter.
+
+        Args:
+            item (bytes): The item to remove.
+
+        Returns:
+            bool: True if the filter was updated or has not been built yet,
+                otherwise False.
+        """
+
+        return self._update(item, -1)
+
+
+    def might_contain(self, item: bytes) -> bool:
+        """
+        Checks whether an item might have been added to the filter.
+
+        Args:
+            item (bytes): The item to look up.
+
+        Returns:
+            bool: False only if the item was definitely never added.
+        """
+
+        try:
+            with REDIS_CLIENT.pipeline(transaction = False) as pipeline:
+                pipeline.exists(self.name)
+
+                bitfield = pipeline.bitfield(self.name)
+                for position in self._get_positions(item):
+                    bitfield.get("u4", f"#{position}")
+                bitfield.execute()
+
+                is_built, counters = pipeline.execute()
+
+        except RedisError:
+            log(f"Bloom filter `{self.name}` could not be read.", level = 4)
+            return True
+
+        return not is_built or all(counters)
+
+
+    def rebuild(self, items: Optional[list[bytes]]) -> bool:
+        """
+        Replaces the filter with one that contains exactly the given items.
+
+        The counters are packed in memory and swapped in with a single
+        RENAME, so workers never see a partially built filter.
+
+        Args:
+            items (Optional[list[bytes]]): The items of the filter, or None
+                to delete the filter because the items are not known.
+
+        Returns:
+            bool: True if the filter was replaced, otherwise False.
+        """
+
+        try:
+            if items is None:
+                REDIS_CLIENT.delete(self.name)
+                return True
+
+            counters = bytearray((self.size + 1) // 2)
+            for item in items:
+                for position in self._get_positions(item):
+                    byte_index, shift = position // 2, 0 if position % 2 else 4
+                    if (counters[byte_index] >> shift) & 0xF < 0xF:
+                        counters[byte_index] += 1 << shift
+
+            temporary_name = self.name + ":" + token_hex(8)
+            with REDIS_CLIENT.pipeline() as pipeline:
+                pipeline.set(temporary_name, bytes(counters))
+                pipeline.rename(temporary_name, self.name)
+                pipeline.execute()
+
+        except RedisError:
+            log(f"Bloom filter `{self.name}` could not be rebuilt.", level = 4)
+            return False
+
+        return True
+
+
 class File:
     """
     A base class for file handling operations with support for loading and dumping data.
@@ -776,3 +1105,263 @@ class PickleFile(File):
 
 JSON: Final[JSONFile] = JSONFile()
 PICKLE: Final[PickleFile] = PickleFile()
+
+
+class JournaledPickleFile:
+    """
+    A pickled dictionary on disk that is changed through an append-only journal.
+
+    Every change appends one framed `(key, value)` record to the journal instead of
+    rewriting the whole file, so the cost of a write does not grow with the size of
+    the dictionary. Appends from the same process are made durable together by one
+    fsync (group commit). `compact` folds the journal into a new snapshot.
+
+    Attributes:
+        file_path (str): The path to the snapshot.
+        journal_file_path (str): The path to the journal.
+        commit_delay (float): Seconds the committer waits to gather appends for one fsync.
+    """
+
+
+    def __init__(self, file_path: str, commit_delay: float = 0.005) -> None:
+        self.file_path = file_path
+        self.journal_file_path = file_path + ".journal"
+        self.rotated_journal_file_path = self.journal_file_path + ".old"
+        self.commit_delay = commit_delay
+
+        self._condition = Condition()
+        self._written = 0
+        self._committed = 0
+        self._synced = 0
+        self._committer_pid: Optional[int] = None
+
+
+    @contextmanager
+    def _file_lock(self, name: str, exclusive: bool, blocking: bool = True):
+        """
+        Holds an advisory lock that is shared between processes.
+
+        Yields:
+            bool: True if the lock is held, False if it was busy and `blocking` is False.
+        """
+
+        operation = LOCK_EX if exclusive else LOCK_SH
+        if not blocking:
+            operation |= LOCK_NB
+
+        with open(self.journal_file_path + "." + name + ".lock", "ab") as lock_stream:
+            try:
+                flock(lock_stream.fileno(), operation)
+            except BlockingIOError:
+                yield False
+                return
+
+            try:
+                yield True
+            finally:
+                flock(lock_stream.fileno(), LOCK_UN)
+
+
+    @staticmethod
+    def _read_records(file_path: str) -> Tuple[list, int]:
+        """
+        Reads the records of a journal up to the first incomplete or corrupt frame.
+
+        Returns:
+            Tuple[list, int]: The records and the length of the valid part of the file.
+        """
+
+        data = read_bytes(file_path, b"") if path.isfile(file_path) else b""
+
+        records = []
+        offset = 0
+        while offset + JOURNAL_HEADER.size <= len(data):
+            length, checksum = JOURNAL_HEADER.unpack_from(data, offset)
+            start = offset + JOURNAL_HEADER.size
+            payload = data[start:start + length]
+
+            if len(payload) != length or crc32(payload) != checksum:
+                break
+
+            try:
+                records.append(pickle_loads(payload))
+            except Exception:
+                break
+
+            offset = start + length
+
+        return records, offset
+
+
+    @staticmethod
+    def _apply(data: dict, records: list) -> None:
+        for key, value in records:
+            if value is None:
+                data.pop(key, None)
+                continue
+
+            data[key] = value
+
+
+    def load(self) -> dict:
+        """
+        Loads the snapshot and replays the journal on top of it.
+
+        An incomplete frame at the end of the journal, left by a crash, is cut off.
+
+        Returns:
+            dict: The current dictionary.
+        """
+
+        with self._file_lock("compaction", exclusive = False):
+            data = PICKLE.load(self.file_path, {})
+            if not isinstance(data, dict):
+                data = {}
+
+            rotated_records, _ = self._read_records(self.rotated_journal_file_path)
+            self._apply(data, rotated_records)
+
+            with self._file_lock("rotation", exclusive = True):
+                records, valid_length = self._read_records(self.journal_file_path)
+
+                if path.isfile(self.journal_file_path) and \
+                        path.getsize(self.journal_file_path) > valid_length:
+                    log(f"Cutting off a torn record of `{self.journal_file_path}`.", level = 3)
+                    truncate(self.journal_file_path, valid_length)
+
+            self._apply(data, records)
+
+        return data
+
+
+    def _commit(self) -> None:
+        """
+        Fsyncs the journal whenever records were appended, one fsync per group.
+        Records count as committed after every attempt, but as synced only
+        after a successful fsync.
+        """
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._written > self._committed)
+
+            sleep(self.commit_delay)
+
+            with self._condition:
+                target = self._written
+
+            is_synced = True
+            try:
+                with self._file_lock("rotation", exclusive = False):
+                    with open(self.journal_file_path, "ab") as file_stream:
+                        fsync(file_stream.fileno())
+
+            except OSError:
+                log(f"`{self.journal_file_path}` could not be synced.", level = 4)
+                is_synced = False
+
+            with self._condition:
+                self._committed = max(self._committed, target)
+                if is_synced:
+                    self._synced = max(self._synced, target)
+
+                self._condition.notify_all()
+
+
+    def append(self, key: Any, value: Any, wait: bool = True) -> bool:
+        """
+        Appends a record to the journal.
+
+        Args:
+            key (Any): The key of the changed entry.
+            value (Any): The new value, or None if the entry was removed.
+            wait (bool): Whether to wait until the record is synced to disk.
+
+        Returns:
+            bool: True if the record was written, and with `wait` also synced to
+                disk within `JOURNAL_SYNC_TIMEOUT` seconds, False otherwise.
+        """
+
+        payload = pickle_dumps((key, value))
+        frame = JOURNAL_HEADER.pack(len(payload), crc32(payload)) + payload
+
+        try:
+            with self._file_lock("rotation", exclusive = False):
+                with open(self.journal_file_path, "ab") as file_stream:
+                    file_stream.write(frame)
+
+        except OSError:
+            log(f"`{self.journal_file_path}` could not be appended to.", level = 4)
+            return False
+
+        with self._condition:
+            if self._committer_pid != getpid():
+                self._written = self._committed = self._synced = 0
+                self._committer_pid = getpid()
+                Thread(target = self._commit, daemon = True).start()
+
+            self._written += 1
+            sequence = self._written
+            self._condition.notify_all()
+
+            if not wait:
+                return True
+
+            self._condition.wait_for(
+                lambda: self._committed >= sequence, timeout = JOURNAL_SYNC_TIMEOUT
+            )
+            is_synced = self._synced >= sequence
+
+        if not is_synced:
+            log(f"`{self.journal_file_path}` was not synced, the record may be lost.", level = 4)
+
+        return is_synced
+
+
+    def size(self) -> int:
+        """
+        Returns the size of the journal in bytes.
+        """
+
+        try:
+            return path.getsize(self.journal_file_path)
+        except OSError:
+            return 0
+
+
+    def compact(self) -> bool:
+        """
+        Folds the journal into a new snapshot.
+
+        The journal is renamed first, so appends continue into a fresh journal
+        while the snapshot is rebuilt from disk. Rebuilding from disk keeps the
+        records of every process, not only the ones this process has seen.
+
+        Returns:
+            bool: True if the journal was compacted, False if another
+                compaction is running or it failed.
+        """
+
+        with self._file_lock("compaction", exclusive = True, blocking = False) as acquired:
+            if not acquired:
+                return False
+
+            with self._file_lock("rotation", exclusive = True):
+                if not path.isfile(self.rotated_journal_file_path) and \
+                        path.isfile(self.journal_file_path):
+                    rename(self.journal_file_path, self.rotated_journal_file_path)
+
+            data = PICKLE.load(self.file_path, {})
+            if not isinstance(data, dict):
+                data = {}
+
+            records, _ = self._read_records(self.rotated_journal_file_path)
+            self._apply(data, records)
+
+            if not PICKLE.dump(data, self.file_path):
+                return False
+
+            if path.isfile(self.rotated_journal_file_path):
+                unlink(self.rotated_journal_file_path)
+
+        return True
@@ -0,0 +1,102 @@
+"""
+tests/conftest.py
+
+This module provides fixtures that give every test its own user store,
+username filter and client IP addresses, so tests never write accounts to
+`src/data` and remove the keys they create on the configured Redis server.
+"""
+
+from secrets import token_hex, randbelow
+
+import pytest
+from redis import RedisError
+
+from src import user
+from src.storage import Users
+from src.crypto import sha256_hash_text
+from src.internet_protocol import get_ip_networks
+from src.utils import REDIS_CLIENT, CountingBloomFilter
+from src.ddos_mitigation import RATE_LIMIT_DISPATCH, DEFAULT_RATE_LIMITER
+
+
+@pytest.fixture(name = "redis_client")
+def fixture_redis_client():
+    """
+    Returns the Redis client, skipping the test if Redis is not available.
+    """
+
+    try:
+        REDIS_CLIENT.ping()
+    except RedisError:
+        pytest.skip("Redis is not available.")
+
+    return REDIS_CLIENT
+
+
+@pytest.fixture(name = "users")
+def fixture_users(redis_client, tmp_path, monkeypatch):
+    """
+    Replaces the user store with an empty pickle store in a temporary
+    directory and the username filter with one under a key of its own.
+    Deletes the Redis keys of the username checks at teardown.
+    """
+
+    users = Users(str(tmp_path / "users.pkl"))
+    user_name_filter = CountingBloomFilter("test_user_name_filter:" + token_hex(8), 4096)
+
+    monkeypatch.setattr(user, "USERS", users)
+    monkeypatch.setattr(user, "USER_NAME_FILTER", user_name_filter)
+    monkeypatch.setattr(user, "IS_USER_NAME_MIGRATION_COMPLETE", False)
+    monkeypatch.setattr(user, "USER_NAME_MIGRATION_CHECKED_AT", 0.0)
+
+    checked_indexes = []
+    set_user_name_checked = user.set_user_name_checked
+
+    def record_user_name_checked(user_name_index: bytes) -> None:
+        checked_indexes.append(user_name_index)
+        set_user_name_checked(user_name_index)
+
+    monkeypatch.setattr(user, "set_user_name_checked", record_user_name_checked)
+
+    user.rebuild_user_name_filter()
+    yield users
+
+    redis_client.delete(user_name_filter.name, *(
+        "user_name_checked:" + user_name_index.hex()
+        for user_name_index in checked_indexes
+    ))
+
+
+def delete_keys_ending_with(suffix: str) -> None:
+    """
+    Deletes every Redis key that ends with a suffix, e.g. the hash of an IP address.
+    """
+
+    keys = list(REDIS_CLIENT.scan_iter("*" + suffix, count = 1000))
+    if keys:
+        REDIS_CLIENT.delete(*keys)
+
+
+@pytest.fixture(name = "create_ip_address")
+def fixture_create_ip_address(redis_client):
+    """
+    Returns a function that creates a random IPv6 address in a /32, by
+    default the documentation prefix. Deletes the rate limits, budgets and
+    cached reputation of every created address and its networks at teardown.
+    """
+
+    ip_addresses = []
+
+    def create_ip_address(prefix: str = "2001:db8") -> str:
+        ip_address = f"{prefix}:{randbelow(65536):x}:{randbelow(65536):x}::1"
+        ip_addresses.append(ip_address)
+        return ip_address
+
+    yield create_ip_address
+
+    for rate_limiter in [*RATE_LIMIT_DISPATCH.values(), DEFAULT_RATE_LIMITER]:
+        rate_limiter.sync()
+
+    for ip_address in ip_addresses:
+        for value in [ip_address, *(network for _, network in get_ip_networks(ip_address))]:
+            delete_keys_ending_with(":" + sha256_hash_text(value))
@@ -0,0 +1,19 @@
+"""
+tests/test_hashing.py
+
+This module checks the deadlines of the hashing pool.
+"""
+
+import pytest
+
+from src.user import PASSWORD_SHA
+from src.hashing import HashingPool, HashingBusyError
+
+
+def test_explicit_zero_deadline_is_not_replaced_by_default():
+    pool = HashingPool(max_workers = 1, deadline = 60.0)
+
+    with pytest.raises(HashingBusyError):
+        pool.hash_many([(PASSWORD_SHA, "fancypassword")], deadline = 0)
+
+    assert pool.hash_many([(PASSWORD_SHA, "fancypassword")])[0]
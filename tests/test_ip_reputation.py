@@ -0,0 +1,148 @@
+"""
+tests/test_ip_reputation.py
+
+This module checks the concurrent IP reputation lookup against local stub
+servers for the providers and the configured Redis server for their cache.
+"""
+
+from json import dumps as json_dumps
+from threading import Event, Thread
+from time import monotonic, sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from redis import RedisError
+
+from src import ddos_mitigation
+from src.utils import REDIS_CLIENT
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers ip-api requests after the delay of the server, reporting every IP
+    address as a proxy, and ExoneraTor requests after the ExoneraTor delay of
+    the server with a negative result.
+    """
+
+    def log_message(self, *_) -> None:
+        pass
+
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/json/"):
+            sleep(self.server.delay)
+            body = json_dumps({"proxy": True, "hosting": False}).encode("utf-8")
+        else:
+            sleep(self.server.exonerator_delay)
+            body = b"<html>Result is negative</html>"
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass
+
+
+@pytest.fixture(name = "stub_server")
+def fixture_stub_server(monkeypatch):
+    """
+    Starts a stub server for the providers and points their URLs at it.
+    """
+
+    try:
+        REDIS_CLIENT.ping()
+    except RedisError:
+        pytest.skip("Redis is not available.")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.delay = 0
+    server.exonerator_delay = 0
+    Thread(target = server.serve_forever, daemon = True).start()
+
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(ddos_mitigation, "IPAPI_URL", base_url + "/json/{ip_address}")
+    monkeypatch.setattr(ddos_mitigation, "EXONERATOR_URL", base_url + "/exonerator.html")
+
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(name = "ip_address")
+def fixture_ip_address(create_ip_address):
+    """
+    Returns a public IPv6 address, which skips the IPv4-only DNS provider and
+    is not in the cache of earlier runs.
+    """
+
+    return create_ip_address("2a01:4f8")
+
+
+def test_returns_result_of_fast_provider(stub_server, ip_address):
+    assert ddos_mitigation.is_ip_malicious(ip_address) == "Malicious"
+
+
+def test_returns_partial_results_at_deadline(stub_server, ip_address, monkeypatch):
+    stub_server.delay = 1
+    monkeypatch.setattr(ddos_mitigation, "IP_REPUTATION_DEADLINE", 0.3)
+
+    start_time = monotonic()
+    assert ddos_mitigation.is_ip_malicious(ip_address) is None
+    assert monotonic() - start_time < 0.8
+
+    # Lets the late provider cache its result before the cache keys are deleted.
+    while ddos_mitigation.IP_REPUTATION_POOL._pending and monotonic() - start_time < 5:
+        sleep(0.05)
+
+
+def test_sheds_lookups_when_pool_is_full(stub_server, ip_address, monkeypatch):
+    release = Event()
+    pool = ddos_mitigation.ReputationPool(max_workers = 1, max_queue_depth = 2)
+    monkeypatch.setattr(ddos_mitigation, "IP_REPUTATION_POOL", pool)
+
+    futures = [pool.submit(release.wait) for _ in range(2)]
+    try:
+        assert all(futures)
+        assert pool.submit(release.wait) is None
+        assert ddos_mitigation.is_ip_malicious(ip_address) is None
+    finally:
+        release.set()
+
+
+def test_cancels_queued_lookups_at_deadline(stub_server, ip_address, monkeypatch):
+    release = Event()
+    pool = ddos_mitigation.ReputationPool(max_workers = 1, max_queue_depth = 8)
+    monkeypatch.setattr(ddos_mitigation, "IP_REPUTATION_POOL", pool)
+    monkeypatch.setattr(ddos_mitigation, "IP_REPUTATION_DEADLINE", 0.1)
+
+    blocking_future = pool.submit(release.wait)
+    try:
+        assert ddos_mitigation.is_ip_malicious(ip_address) is None
+        assert pool._pending == 1
+    finally:
+        release.set()
+
+    blocking_future.result(timeout = 1)
+
+
+def test_exonerator_timeout_counts_as_unknown(stub_server, ip_address):
+    stub_server.exonerator_delay = 1
+
+    assert ddos_mitigation.is_ip_tor_exonerator(ip_address, timeout = 0.2) is None
+    assert ddos_mitigation.get_cache("tor_exonerator", ip_address) is None
+
+
+def test_failing_provider_counts_as_unknown(stub_server, ip_address, monkeypatch):
+    timeouts = []
+
+    def failing_provider(_, timeout):
+        timeouts.append(timeout)
+        raise ValueError("The provider answered garbage.")
+
+    monkeypatch.setattr(ddos_mitigation, "IP_REPUTATION_PROVIDERS", (
+        ("Failing", failing_provider, 3, False),
+    ))
+
+    assert ddos_mitigation.is_ip_malicious(ip_address) is None
+    assert timeouts == [3]
@@ -0,0 +1,27 @@
+"""
+tests/test_journal.py
+
+This module checks that appending to the journal reports whether the
+record was synced to disk.
+"""
+
+from src import utils
+from src.utils import JournaledPickleFile
+
+
+def test_append_reports_synced_record(tmp_path):
+    journaled_file = JournaledPickleFile(str(tmp_path / "users.pkl"))
+
+    assert journaled_file.append(b"key", {"password": b"hash"})
+    assert journaled_file.load() == {b"key": {"password": b"hash"}}
+
+
+def test_append_reports_failed_sync(tmp_path, monkeypatch):
+    def fail_fsync(_):
+        raise OSError("The disk is full.")
+
+    monkeypatch.setattr(utils, "fsync", fail_fsync)
+    journaled_file = JournaledPickleFile(str(tmp_path / "users.pkl"))
+
+    assert not journaled_file.append(b"key", {"password": b"hash"})
+    assert journaled_file.append(b"other_key", None, wait = False)
@@ -0,0 +1,104 @@
+"""
+tests/test_login_flow.py
+
+This module drives a login of the test user through the captcha, the password
+and the two-factor authentication step, against a temporary user store and the
+configured Redis server, and checks that the password never reaches Redis.
+"""
+
+from typing import Optional
+
+import pytest
+
+import main
+from src.crypto import TOTP
+from src.utils import REDIS_CLIENT
+from src.login_flow import LoginFlow
+from src.user import create_test_user, get_user_based_on_user_name
+
+
+CORRECT_IMAGES = [3]
+
+
+@pytest.fixture(name = "client")
+def fixture_client(users, create_ip_address, monkeypatch):
+    """
+    Returns a test client with an IP address of its own, whose login, captcha
+    and two-factor pages return the ID of the login flow instead of rendering
+    templates. Deletes the session state and the budget of the test user at
+    teardown.
+    """
+
+    def render_login(user_name: Optional[str] = None, password: Optional[str] = None,
+                     error: Optional[object] = None, state: Optional[str] = None) -> str:
+        return ("login-error:" if error else "login:") + (state or "")
+
+    def render_captcha(login_flow: LoginFlow, error: Optional[object] = None) -> str:
+        login_flow.set_captcha(CORRECT_IMAGES)
+        return ("captcha-error:" if error else "captcha:") + login_flow.flow_id
+
+    def render_twofa(login_flow: LoginFlow, error: Optional[object] = None) -> str:
+        return ("twofa-error:" if error else "twofa:") + login_flow.flow_id
+
+    monkeypatch.setattr(main, "render_login", render_login)
+    monkeypatch.setattr(main, "render_captcha", render_captcha)
+    monkeypatch.setattr(main, "render_twofa", render_twofa)
+    monkeypatch.setattr(main, "is_ip_malicious", lambda ip_address: None)
+
+    client = main.app.test_client()
+    client.environ_base["REMOTE_ADDR"] = create_ip_address()
+
+    yield client
+
+    session_cookie = client.get_cookie("session")
+    REDIS_CLIENT.delete(
+        *(["state:" + session_cookie.value] if session_cookie else []),
+        *("kdf_budget:account:" + user_key.hex() for user_key in users.users)
+    )
+
+
+def finish_twofa(client, flow_id: str) -> None:
+    user = get_user_based_on_user_name("test")
+    token = TOTP(user.twofa_token).generate_token()
+    response = client.post("/login", data = {"state": flow_id, "codes": token})
+
+    assert response.get_data(as_text = True) == "test"
+    assert "session=" in response.headers.get("Set-Cookie", "")
+    assert not REDIS_CLIENT.exists("login_flow:" + flow_id)
+
+
+def test_captcha_password_twofa(client):
+    create_test_user()
+    user = get_user_based_on_user_name("test")
+    assert user is not None and user.twofa_token
+
+    response = client.post("/login", data = {"user_name": "test", "password": "fancypassword"})
+    step, flow_id = response.get_data(as_text = True).split(":")
+    assert step == "captcha"
+    assert "password" not in REDIS_CLIENT.hgetall("login_flow:" + flow_id)
+
+    response = client.post("/login", data = {"state": flow_id, f"i{CORRECT_IMAGES[0]}": "1"})
+    assert response.get_data(as_text = True) == "login:" + flow_id
+
+    response = client.post("/login", data = {"state": flow_id, "password": "fancypassword"})
+    assert response.get_data(as_text = True) == "twofa:" + flow_id
+    assert "password" not in REDIS_CLIENT.hgetall("login_flow:" + flow_id)
+
+    finish_twofa(client, flow_id)
+
+
+def test_pow_verifies_password_before_flow(client, monkeypatch):
+    monkeypatch.setattr(main, "verify_pow_response", lambda request: True)
+    create_test_user()
+
+    response = client.post("/login", data = {"user_name": "test", "password": "wrongpassword"})
+    assert response.get_data(as_text = True) == "login-error:"
+
+    response = client.post("/login", data = {"user_name": "test", "password": "fancypassword"})
+    step, flow_id = response.get_data(as_text = True).split(":")
+    assert step == "twofa"
+
+    fields = REDIS_CLIENT.hgetall("login_flow:" + flow_id)
+    assert fields.get("passed:password", None) == "1" and "password" not in fields
+
+    finish_twofa(client, flow_id)
@@ -0,0 +1,35 @@
+"""
+tests/test_rate_limit.py
+
+This module checks the rate limit of the browser check against the configured
+Redis server.
+"""
+
+import pytest
+
+import main
+from src.ddos_mitigation import RATE_LIMIT
+
+
+@pytest.fixture(name = "client")
+def fixture_client(create_ip_address, monkeypatch):
+    """
+    Returns a test client whose IP address is not malicious and in a /48
+    of its own, so earlier runs do not share its budget.
+    """
+
+    monkeypatch.setattr(main, "is_ip_malicious", lambda ip_address: None)
+
+    client = main.app.test_client()
+    client.environ_base["REMOTE_ADDR"] = create_ip_address()
+
+    return client
+
+
+def test_unverified_session_cookie_gets_default_limit(client):
+    client.set_cookie("session", "A" * 32)
+
+    status_codes = [client.get("/").status_code for _ in range(RATE_LIMIT + 1)]
+
+    assert status_codes[:RATE_LIMIT] == [200] * RATE_LIMIT
+    assert status_codes[RATE_LIMIT] == 429
@@ -0,0 +1,41 @@
+"""
+tests/test_state_codec.py
+
+This module checks that every state type still in use round-trips through
+the binary encoding and that older schemas can still be decoded.
+"""
+
+import pytest
+
+from src.state_codec import (
+    STATE_CODEC_VERSION, STATE_SCHEMAS, STATE_SCHEMAS_BY_NAME,
+    encode_state, decode_state, encode_varint
+)
+
+
+SAMPLE_VALUES = {
+    "str": "Ab3De6Gh9Jk2Mn5Pq8St1Vw4Yz7Bc0Ef3Hi6Kl9", "uint": 1767225600, "uints": [4, 0, 300]
+}
+
+
+@pytest.mark.parametrize("state_name", sorted(STATE_SCHEMAS_BY_NAME))
+def test_schema_round_trips(state_name):
+    schema_id, fields = STATE_SCHEMAS_BY_NAME[state_name]
+    data = {field_name: SAMPLE_VALUES[field_type] for field_name, field_type in fields}
+
+    encoded = encode_state(state_name, data)
+
+    assert encoded[:2] == bytes((STATE_CODEC_VERSION, schema_id))
+    assert decode_state(encoded) == (state_name, data)
+
+
+def test_older_schema_decodes():
+    encoded_ip = SAMPLE_VALUES["str"].encode("utf-8")
+    encoded = bytes((STATE_CODEC_VERSION, 2)) + encode_varint(len(encoded_ip)) + encoded_ip
+
+    assert decode_state(encoded) == ("browser_checked", {"ip": SAMPLE_VALUES["str"]})
+
+
+def test_removed_schema_is_reserved():
+    assert 4 not in STATE_SCHEMAS
+    assert decode_state(bytes((STATE_CODEC_VERSION, 4, 0))) == (None, {})
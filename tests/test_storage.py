@@ -0,0 +1,141 @@
+"""
+tests/test_storage.py
+
+This module checks that updating a single field of a user in any user storage
+engine leaves the other fields and the sessions of the user alone, and that
+replacing a user replaces its sessions.
+"""
+
+from time import time
+from secrets import token_bytes, randbelow
+
+import pytest
+from redis import RedisError
+
+from src.utils import REDIS_CLIENT
+from src.storage import Users, SQLiteUsers, RedisUsers
+
+
+@pytest.fixture(name = "users", params = ["pickle", "sqlite", "redis"])
+def fixture_users(request, tmp_path):
+    """
+    Returns an empty user store of every storage engine.
+    """
+
+    try:
+        REDIS_CLIENT.ping()
+    except RedisError:
+        pytest.skip("Redis is not available.")
+
+    legacy_file_path = str(tmp_path / "legacy.pkl")
+
+    if request.param == "pickle":
+        return Users(str(tmp_path / "users.pkl"))
+    if request.param == "sqlite":
+        return SQLiteUsers(str(tmp_path / "users.db"), legacy_file_path)
+
+    return RedisUsers(legacy_file_path = legacy_file_path)
+
+
+@pytest.fixture(name = "create_key")
+def fixture_create_key(users):
+    """
+    Returns a function that creates user keys and deletes the Redis entries
+    of those users and their sessions after the test.
+    """
+
+    keys = []
+
+    def create_key() -> bytes:
+        key = token_bytes(16)
+        keys.append(key)
+        return key
+
+    yield create_key
+
+    if not isinstance(users, RedisUsers):
+        return
+
+    for key in keys:
+        for session_key in (users[key] or {}).get("sessions", {}):
+            users.remove_session(key, session_key)
+
+    with REDIS_CLIENT.pipeline() as pipeline:
+        for key in keys:
+            hex_key = key.hex()
+            user_name_index = (users[key] or {}).get("user_name_index", None)
+
+            pipeline.delete("user:" + hex_key, "user_sessions:" + hex_key)
+            pipeline.srem("unindexed_users", hex_key)
+            if isinstance(user_name_index, bytes):
+                pipeline.hdel("user_name_indexes", user_name_index.hex())
+
+        pipeline.execute()
+
+
+def test_set_password_keeps_removed_sessions_removed(users, create_key):
+    key, session_key = create_key(), token_bytes(16)
+    users[key] = {
+        "password": b"old", "user_name_index": token_bytes(32),
+        "sessions": {session_key: {"token": b"token", "ip": "127.0.0.1", "time": int(time())}}
+    }
+
+    assert users.remove_session(key, session_key)
+
+    assert users.set_password(key, b"new", b"old")
+    assert not users.set_password(key, b"newer", b"old")
+
+    user_data = users[key]
+    assert user_data["password"] == b"new"
+    assert not user_data.get("sessions", None)
+    assert users.get_session_user_key(session_key) is None
+
+
+def test_set_user_name_index_keeps_removed_sessions_removed(users, create_key):
+    key, other_key, session_key = create_key(), create_key(), token_bytes(16)
+    user_name_index = token_bytes(32)
+
+    users[key] = {
+        "password": b"old",
+        "sessions": {session_key: {"token": b"token", "ip": "127.0.0.1", "time": int(time())}}
+    }
+    users[other_key] = {"password": b"other"}
+
+    assert key in users.get_unindexed_keys()
+    assert users.remove_session(key, session_key)
+
+    assert users.set_user_name_index(key, user_name_index)
+    assert not users.set_user_name_index(other_key, user_name_index)
+    assert not users.set_user_name_index(token_bytes(16), token_bytes(32))
+
+    assert users.get_key(user_name_index) == key
+    assert key not in users.get_unindexed_keys()
+    assert other_key in users.get_unindexed_keys()
+
+    user_data = users[key]
+    assert user_data["user_name_index"] == user_name_index
+    assert not user_data.get("sessions", None)
+
+
+def test_setitem_replaces_sessions(users, create_key):
+    key, kept_session_key, dropped_session_key = create_key(), token_bytes(16), token_bytes(16)
+    ip_address = "192.0.2." + str(randbelow(254) + 1)
+
+    sessions = {
+        session_key: {"token": b"token", "ip": ip_address, "time": int(time())}
+        for session_key in (kept_session_key, dropped_session_key)
+    }
+    users[key] = {"password": b"old", "sessions": sessions}
+
+    users[key] = {"password": b"new", "sessions": {kept_session_key: sessions[kept_session_key]}}
+
+    assert set(users[key]["sessions"]) == {kept_session_key}
+    assert users.get_session_user_key(kept_session_key) == key
+    assert users.get_session_user_key(dropped_session_key) is None
+    assert users.get_sessions_by_ip(ip_address) == [(key, kept_session_key)]
+
+    users[key] = {"password": b"new"}
+
+    assert not users[key].get("sessions", None)
+    assert users.get_session_user_key(kept_session_key) is None
+    assert not users.get_sessions_by_ip(ip_address)
@@ -0,0 +1,115 @@
+"""
+tests/test_user_name_migration.py
+
+This module checks how users stored before username blind indexes existed
+are found and migrated, that the availability check never compares salted
+hashes and that signups do not rely on the username filter.
+"""
+
+from time import time
+from secrets import token_hex, token_bytes
+
+import pytest
+
+from src import user
+from src.hashing import HashingPool, HashingBusyError
+from src.user import (
+    PASSWORD_SHA, USER_NAME_SHA, get_user_name_index, get_user_based_on_user_name,
+    is_user_name_taken, migrate_user_names
+)
+
+
+@pytest.fixture(name = "legacy_user_name")
+def fixture_legacy_user_name(users):
+    """
+    Stores a user without a username blind index and returns its username.
+    """
+
+    user_name = "legacy" + token_hex(4)
+    users[USER_NAME_SHA.hash(user_name)] = {
+        "password": PASSWORD_SHA.hash("fancypassword"),
+        "sessions": {token_bytes(16): {"token": b"token", "ip": "127.0.0.1", "time": int(time())}}
+    }
+
+    return user_name
+
+
+@pytest.fixture(name = "compare_calls")
+def fixture_compare_calls(monkeypatch):
+    """
+    Counts the calls of the hashing pool that compare salted hashes.
+    """
+
+    calls = []
+    compare_many = user.HASHING_POOL.compare_many
+
+    def count_compare_many(jobs, deadline = None):
+        calls.append(len(jobs))
+        return compare_many(jobs, deadline)
+
+    monkeypatch.setattr(user.HASHING_POOL, "compare_many", count_compare_many)
+    return calls
+
+
+def test_login_lookup_migrates_legacy_user(users, legacy_user_name, compare_calls):
+    found_user = get_user_based_on_user_name(legacy_user_name)
+
+    assert found_user is not None and found_user.user_name == legacy_user_name
+    assert users.get_key(get_user_name_index(legacy_user_name)) == found_user.stored_key
+    assert not users.get_unindexed_keys()
+    assert users[found_user.stored_key].get("sessions", None)
+
+    assert get_user_based_on_user_name(legacy_user_name) is not None
+    assert compare_calls == [1]
+
+
+def test_unknown_name_is_compared_once(legacy_user_name, compare_calls):
+    unknown_user_name = "unknown" + token_hex(4)
+
+    assert get_user_based_on_user_name(unknown_user_name) is None
+    assert get_user_based_on_user_name(unknown_user_name) is None
+    assert compare_calls == [1]
+
+
+def test_exhausted_budget_skips_comparison(legacy_user_name, compare_calls, monkeypatch):
+    monkeypatch.setattr(user, "charge_kdf_budget", lambda *_, **__: "ip")
+
+    with pytest.raises(HashingBusyError):
+        get_user_based_on_user_name(legacy_user_name, "192.0.2.1")
+
+    assert not compare_calls
+
+
+def test_availability_check_never_compares_hashes(legacy_user_name, compare_calls):
+    assert not is_user_name_taken(legacy_user_name)
+    assert not compare_calls
+
+    assert migrate_user_names([legacy_user_name], HashingPool(max_workers = 0)) == 1
+    assert is_user_name_taken(legacy_user_name)
+
+
+def test_definite_negative_skips_store_after_migration(users, monkeypatch):
+    assert user.is_user_name_migration_complete()
+
+    def ask_store(*_):
+        raise AssertionError("The availability check asked the user store.")
+
+    monkeypatch.setattr(users, "has_unindexed_keys", ask_store)
+    monkeypatch.setattr(users, "get_key", ask_store)
+
+    assert not is_user_name_taken("free" + token_hex(4))
+
+
+def test_create_user_ignores_stale_filter(users, legacy_user_name):
+    user_name = "taken" + token_hex(4)
+    created_user = user.create_user(user_name, "fancypassword")
+    assert created_user is not None
+
+    user.USER_NAME_FILTER.rebuild([])
+    assert not is_user_name_taken(user_name)
+
+    assert user.create_user(user_name, "otherpassword") is None
+    assert users.get_key(get_user_name_index(user_name)) == created_user.stored_key
+
+    assert user.create_user(legacy_user_name, "otherpassword") is None
+    assert len(users.get_user_name_indexes()) == 2